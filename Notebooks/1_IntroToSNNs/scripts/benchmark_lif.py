@@ -0,0 +1,124 @@
+# Accuracy and speed of the LIF solvers at different time steps. A population
+# driven by random input spikes on a 1 ms grid is simulated with each method
+# and time step, and output spike times are compared to a fine-step reference.
+# For each method, the coarsest time step that meets the tolerance is reported
+# together with its runtime.
+#
+# Usage (from the 1_IntroToSNNs folder):
+#     python -m scripts.benchmark_lif
+
+from typing import List, Sequence
+import argparse
+import time
+
+import numpy as np
+
+from scripts.lif import LIFNeurons
+
+
+def spike_times(
+    inp_ms: np.ndarray, dt: float, method: str, **params
+) -> List[np.ndarray]:
+    """
+    spike_times - Output spike times in ms of each neuron.
+    :param inp_ms:  Input spike counts on a 1 ms grid [#ms x #neurons]
+    :param dt:      Time step in ms; 1 / dt must be an integer
+    """
+    steps_per_ms = int(round(1 / dt))
+    inp = np.zeros((len(inp_ms) * steps_per_ms, inp_ms.shape[1]))
+    inp[::steps_per_ms] = inp_ms
+    neurons = LIFNeurons(inp_ms.shape[1:], dt=dt, method=method, **params)
+    spikes = neurons.evolve(inp, record=True).spikes
+    # - Spikes are detected at the end of a time step
+    return [(np.flatnonzero(col) + 1) * dt for col in spikes.T]
+
+
+def timing_error(times: List[np.ndarray], reference: List[np.ndarray]):
+    """
+    timing_error - Fraction of neurons whose spike count differs from the
+                   reference and mean absolute spike time difference in ms of
+                   the others.
+    """
+    matching = [(t, r) for t, r in zip(times, reference) if len(t) == len(r)]
+    count_mismatch = 1 - len(matching) / len(reference)
+    diffs = np.concatenate([np.abs(t - r) for t, r in matching] + [np.zeros(0)])
+    return count_mismatch, float(diffs.mean()) if diffs.size else 0.0
+
+
+def benchmark(
+    duration: int = 200,
+    num_neurons: int = 100,
+    input_rate: float = 0.3,
+    time_steps: Sequence[float] = (1.0, 0.5, 0.2, 0.1, 0.05, 0.02, 0.01),
+    reference_dt: float = 0.001,
+    tolerance: float = 0.25,
+    methods: Sequence[str] = ("euler", "exact"),
+    seed: int = 0,
+    **params,
+) -> List[dict]:
+    """
+    benchmark - Compare solver methods and time steps.
+    :param duration:      Simulated time in ms
+    :param num_neurons:   Number of neurons, each with its own input
+    :param input_rate:    Input spike probability per ms
+    :param time_steps:    Time steps in ms to test
+    :param reference_dt:  Time step of the exact reference simulation
+    :param tolerance:     Maximum mean spike time error in ms, with all spike
+                          counts matching the reference
+    :param params:        Neuron parameters for `LIFNeurons`
+    :return:
+        List with one dict of results per method and time step
+    """
+    rng = np.random.default_rng(seed)
+    inp_ms = (rng.random((duration, num_neurons)) < input_rate).astype(float)
+    params = {"weight": 0.5, **params}
+    reference = spike_times(inp_ms, reference_dt, "exact", **params)
+    results = []
+    for method in methods:
+        for dt in time_steps:
+            t_start = time.perf_counter()
+            times = spike_times(inp_ms, dt, method, **params)
+            runtime = time.perf_counter() - t_start
+            count_mismatch, error = timing_error(times, reference)
+            results.append(
+                {
+                    "method": method,
+                    "dt": dt,
+                    "runtime_s": runtime,
+                    "count_mismatch": count_mismatch,
+                    "time_error_ms": error,
+                    "accurate": count_mismatch == 0 and error <= tolerance,
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LIF solvers")
+    parser.add_argument("--duration", type=int, default=200)
+    parser.add_argument("--neurons", type=int, default=100)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = benchmark(args.duration, args.neurons, tolerance=args.tolerance)
+    print(f"{'method':>8} {'dt':>6} {'runtime_s':>10} {'mismatch':>9} {'error_ms':>9}")
+    for row in results:
+        print(
+            f"{row['method']:>8} {row['dt']:>6} {row['runtime_s']:>10.4f} "
+            + f"{row['count_mismatch']:>9.2f} {row['time_error_ms']:>9.4f}"
+        )
+    best = {}
+    for row in results:
+        if row["accurate"] and row["dt"] > best.get(row["method"], {"dt": 0})["dt"]:
+            best[row["method"]] = row
+    for method, row in best.items():
+        print(
+            f"{method}: coarsest accurate dt {row['dt']} ms, {row['runtime_s']:.4f} s"
+        )
+    if "euler" in best and "exact" in best:
+        speedup = best["euler"]["runtime_s"] / best["exact"]["runtime_s"]
+        print(f"Speed-up of exact integration at equal accuracy: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
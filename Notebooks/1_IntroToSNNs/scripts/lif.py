@@ -0,0 +1,258 @@
+# Vectorized simulation of populations of LIF and IAF neurons, following the
+# model of the IntroToSNNs notebook. All state variables are arrays of one
+# shape, typically [#parameter settings x #neurons], so that many neurons and
+# parameter values are simulated in a single loop over time.
+#
+# Model, with time in ms:
+#     I_s  += weight * (input spikes)
+#     dI_s/dt = -I_s / tau_s
+#     dV_m/dt = (-V_m + I_s + bias) / tau_m     (LIF)
+#     dV_m/dt = I_s + bias                      (IAF, `tau_m=None`)
+#     V_m > v_th:  spike and V_m -= v_th
+# With `multi_spike=True`, a neuron instead emits floor(V_m / v_th) spikes per
+# step and V_m is reduced by as many thresholds, as the sinabs layers do.
+# With `tau_s=None` there is no synapse and input spikes are added to I_s for
+# one time step only.
+#
+# Between input spikes the LIF equations are linear and time-invariant, so
+# with `method="exact"` each step applies the propagator matrix of the system,
+#     [I_s, V_m - bias](t + dt) = exp(A dt) [I_s, V_m - bias](t),
+# which is exact at any step size as long as input spikes fall on the time grid.
+#
+# The f-I curve of the notebook's bias sweep becomes
+#     counts = fi_curve(
+#         np.arange(-5, 5, 0.2), num_steps=100, tau_m=None, tau_s=None, multi_spike=True
+#     )
+
+from typing import Callable, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+METHODS = ("euler", "exp", "exact")
+
+ArrayLike = Union[float, np.ndarray]
+
+
+class LIFRecord(NamedTuple):
+    # Number of output spikes of each neuron
+    spike_counts: np.ndarray
+    # Output spikes (counts with `multi_spike`) [#time steps x *shape], if recorded
+    spikes: Optional[np.ndarray] = None
+    # Membrane potential [#time steps x *shape], if recorded
+    v_m: Optional[np.ndarray] = None
+    # Synaptic current [#time steps x *shape], if recorded
+    i_s: Optional[np.ndarray] = None
+
+
+class LIFNeurons:
+    """
+    LIFNeurons - A population of LIF or IAF neurons of arbitrary shape. Each
+                 parameter can be a scalar or an array that broadcasts to
+                 `shape`, e.g. a column of bias values for shape
+                 [#biases x #neurons]. State is carried across calls to
+                 `evolve` until `reset` is called.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, ...],
+        tau_m: Optional[ArrayLike] = 10.0,
+        tau_s: Optional[ArrayLike] = 10.0,
+        v_th: ArrayLike = 1.0,
+        bias: ArrayLike = 0.0,
+        weight: ArrayLike = 1.0,
+        dt: float = 1.0,
+        method: str = "exp",
+        multi_spike: bool = False,
+    ):
+        """
+        :param shape:   Shape of the population
+        :param tau_m:   Membrane time constant in ms. `None` for IAF neurons
+        :param tau_s:   Synaptic time constant in ms. `None` for no synapse
+        :param v_th:    Spiking threshold
+        :param bias:    Bias current
+        :param weight:  Input weight
+        :param dt:      Time step in ms
+        :param method:  "euler": forward Euler, as in the notebook
+                        "exp":   exponential Euler, exact decay of synapse and
+                                 membrane with the current held over each step
+                        "exact": exact integration with the propagator matrix
+        :param multi_spike:  If `True`, emit floor(V_m / v_th) spikes per step
+                             and subtract as many thresholds, as in sinabs.
+                             Otherwise at most one spike per step.
+        """
+        if method not in METHODS:
+            raise ValueError(f"LIFNeurons: `method` must be one of {METHODS}.")
+        self.shape = tuple(shape)
+        self.dt = dt
+        self.method = method
+        self.multi_spike = multi_spike
+        self.leaky = tau_m is not None
+        self.has_synapse = tau_s is not None
+        self.v_th = self._param(v_th)
+        self.bias = self._param(bias)
+        self.weight = self._param(weight)
+        self.tau_m = self._param(tau_m) if self.leaky else None
+        self.tau_s = self._param(tau_s) if self.has_synapse else None
+        self._init_decays()
+        self.reset()
+
+    def _param(self, value: ArrayLike) -> np.ndarray:
+        return np.broadcast_to(np.asarray(value, dtype=float), self.shape)
+
+    def _init_decays(self):
+        # - Per-step factors of the synapse and membrane updates
+        if self.has_synapse:
+            if self.method == "euler":
+                self.decay_s = 1 - self.dt / self.tau_s
+            else:
+                self.decay_s = np.exp(-self.dt / self.tau_s)
+        if self.leaky:
+            if self.method == "euler":
+                self.decay_m = 1 - self.dt / self.tau_m
+            else:
+                self.decay_m = np.exp(-self.dt / self.tau_m)
+        if self.method == "exact" and self.has_synapse:
+            # - Off-diagonal propagator entry: contribution of I_s to V_m
+            if self.leaky:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    self.prop_sm = np.where(
+                        np.isclose(self.tau_s, self.tau_m),
+                        self.dt / self.tau_m * self.decay_m,
+                        self.tau_s
+                        / (self.tau_s - self.tau_m)
+                        * (self.decay_s - self.decay_m),
+                    )
+            else:
+                self.prop_sm = self.tau_s * (1 - self.decay_s)
+
+    def reset(self):
+        """
+        reset - Set membrane potentials and synaptic currents to 0.
+        """
+        self.v_m = np.zeros(self.shape)
+        self.i_s = np.zeros(self.shape)
+
+    def _step(self, inp: Optional[np.ndarray]) -> np.ndarray:
+        # - Input spikes, synapse, membrane, spike generation
+        if self.has_synapse:
+            if inp is not None:
+                self.i_s = self.i_s + self.weight * inp
+            i_start = self.i_s
+            self.i_s = self.i_s * self.decay_s
+        else:
+            self.i_s = self.weight * inp if inp is not None else np.zeros(self.shape)
+        current = self.i_s + self.bias
+        if self.method == "exact" and self.has_synapse:
+            if self.leaky:
+                self.v_m = (
+                    self.bias
+                    + (self.v_m - self.bias) * self.decay_m
+                    + i_start * self.prop_sm
+                )
+            else:
+                self.v_m = self.v_m + self.bias * self.dt + i_start * self.prop_sm
+        elif self.leaky:
+            # - Euler and exponential Euler differ only in the decay factor
+            self.v_m = current + (self.v_m - current) * self.decay_m
+        else:
+            self.v_m = self.v_m + current * self.dt
+        if self.multi_spike:
+            spikes = np.maximum(np.floor(self.v_m / self.v_th), 0).astype(int)
+            self.v_m = self.v_m - spikes * self.v_th
+            return spikes
+        spikes = self.v_m > self.v_th
+        self.v_m = np.where(spikes, self.v_m - self.v_th, self.v_m)
+        return spikes
+
+    def evolve(
+        self,
+        inp: Optional[np.ndarray] = None,
+        num_steps: Optional[int] = None,
+        record: bool = False,
+    ) -> LIFRecord:
+        """
+        evolve - Simulate the population.
+        :param inp:        Input spike counts per time step, array
+                           [#time steps x ...] that broadcasts to `shape` at
+                           each step. `None` for no input.
+        :param num_steps:  Number of time steps, if `inp` is `None`
+        :param record:     If `True`, return spikes and state traces
+        :return:
+            `LIFRecord`
+        """
+        if inp is not None:
+            inp = np.asarray(inp, dtype=float)
+            num_steps = len(inp)
+        elif num_steps is None:
+            raise ValueError("LIFNeurons: Either `inp` or `num_steps` is required.")
+        counts = np.zeros(self.shape, int)
+        if record:
+            trace_shape = (num_steps, *self.shape)
+            spikes_t = np.zeros(trace_shape, int if self.multi_spike else bool)
+            v_m_t = np.zeros(trace_shape)
+            i_s_t = np.zeros(trace_shape)
+        for t in range(num_steps):
+            spikes = self._step(None if inp is None else inp[t])
+            counts += spikes
+            if record:
+                spikes_t[t] = spikes
+                v_m_t[t] = self.v_m
+                i_s_t[t] = self.i_s
+        if record:
+            return LIFRecord(counts, spikes_t, v_m_t, i_s_t)
+        return LIFRecord(counts)
+
+
+def evolve_chunked(
+    neurons: LIFNeurons,
+    num_steps: int,
+    chunk_size: int = 10000,
+    inp: Union[np.ndarray, Callable[[int, int], np.ndarray], None] = None,
+) -> np.ndarray:
+    """
+    evolve_chunked - Simulate a long time span in chunks, so that the input never
+                     has to be held in memory as a whole.
+    :param neurons:     `LIFNeurons` object
+    :param num_steps:   Total number of time steps
+    :param chunk_size:  Number of time steps per chunk
+    :param inp:         `None`, an array (e.g. memory-mapped) of input spike
+                        counts, or a function `inp(start, stop)` that returns
+                        the input for time steps `start` to `stop`
+    :return:
+        Spike counts of each neuron over all time steps
+    """
+    counts = np.zeros(neurons.shape, int)
+    for start in range(0, num_steps, chunk_size):
+        stop = min(start + chunk_size, num_steps)
+        if inp is None:
+            chunk = None
+        elif callable(inp):
+            chunk = inp(start, stop)
+        else:
+            chunk = inp[start:stop]
+        counts += neurons.evolve(chunk, num_steps=stop - start).spike_counts
+    return counts
+
+
+def fi_curve(
+    biases: np.ndarray,
+    num_steps: int = 100,
+    chunk_size: Optional[int] = None,
+    **params,
+) -> np.ndarray:
+    """
+    fi_curve - Output spike counts of single neurons driven by constant bias
+               currents, all biases simulated at once.
+    :param biases:      Bias values
+    :param num_steps:   Number of time steps
+    :param chunk_size:  If not `None`, simulate in chunks of this many steps
+    :param params:      Further parameters for `LIFNeurons`
+    :return:
+        Spike count for each bias
+    """
+    biases = np.asarray(biases, dtype=float)
+    neurons = LIFNeurons(biases.shape, bias=biases, **params)
+    if chunk_size is None:
+        return neurons.evolve(num_steps=num_steps).spike_counts
+    return evolve_chunked(neurons, num_steps, chunk_size)
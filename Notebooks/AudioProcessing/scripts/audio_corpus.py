@@ -0,0 +1,244 @@
+# Packed corpus of filtered audio clips. All `*_filtered.npz` files from the
+# cache are stored in one contiguous float32 array that is memory-mapped on
+# loading, so that choosing keywords, subsets and train/test splits are index
+# operations instead of thousands of small pickled file reads.
+#
+# Replaces the loading loop in the TwoWordClassifier notebooks by
+#     corpus = AudioCorpus.build(DATA_PATH)
+#     idcs_train, idcs_test = corpus.split(keywords, percentage, ratio_train)
+#     train_data, train_targets = corpus.get(idcs_train, keywords)
+#     test_data, test_targets = corpus.get(idcs_test, keywords)
+
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+from pathlib import Path
+import hashlib
+import json
+import os
+
+import numpy as np
+
+ALL_KEYWORDS = ["yes", "no", "left", "right", "on"]
+LEN_SAMPLES = 100  # Samples per clip (at 100 Hz)
+NUM_CHANNELS = 32  # Filterbank channels
+
+
+def _load_clip(fn: Union[str, Path]) -> np.ndarray:
+    clip = np.load(fn, allow_pickle=True)
+    if isinstance(clip, np.lib.npyio.NpzFile):
+        # - Proper npz archive: use its first array
+        clip = clip[clip.files[0]]
+    return np.asarray(clip, dtype=np.float32)
+
+
+def _fit_length(clip: np.ndarray, len_samples: int) -> np.ndarray:
+    # - Zero-pad or truncate clips to `len_samples`
+    if clip.shape[0] >= len_samples:
+        return clip[:len_samples]
+    return np.pad(clip, ((0, len_samples - clip.shape[0]), (0, 0)))
+
+
+def find_cached_files(
+    data_path: Union[str, Path], keywords: Sequence[str] = ALL_KEYWORDS
+) -> Tuple[List[Path], List[int]]:
+    """
+    find_cached_files - Find filtered clips in `<data_path>/cache` as the
+                        notebooks do (`cache/**/{keyword}/**/*filtered.npz`).
+    :return:
+        List with paths of filtered clips
+        List with the index in `keywords` of each clip's keyword
+    """
+    cache = Path(data_path) / "cache"
+    files = {}
+    for idx_kw, keyword in enumerate(keywords):
+        for fn in sorted(cache.glob(f"**/{keyword}/**/*filtered.npz")):
+            # - A file matching several keywords belongs to the first one
+            files.setdefault(fn, idx_kw)
+    return list(files.keys()), list(files.values())
+
+
+class AudioCorpus:
+    """
+    AudioCorpus - Packed corpus of filtered clips. A corpus directory contains
+                  - `data.npy`:    float32 array [#clips x #samples x #channels]
+                  - `labels.npy`:  Index into `keywords` for each clip
+                  - `offsets.npy`: Offset of each clip in the flattened sample
+                                   axis of `data.npy`
+                  - `index.json`:  Keywords and source file of each clip, with
+                                   size and modification time of each source
+    """
+
+    def __init__(self, corpus_dir: Union[str, Path]):
+        self.corpus_dir = Path(corpus_dir)
+        self.data = np.load(self.corpus_dir / "data.npy", mmap_mode="r")
+        self.labels = np.load(self.corpus_dir / "labels.npy")
+        self.offsets = np.load(self.corpus_dir / "offsets.npy")
+        with open(self.corpus_dir / "index.json") as f:
+            index = json.load(f)
+        self.keywords: List[str] = index["keywords"]
+        self.files: List[str] = index["files"]
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def fingerprint(self) -> str:
+        """
+        fingerprint - Hash of `index.json`, which changes whenever the corpus is
+                      rebuilt from different sources or with other parameters.
+        """
+        with open(self.corpus_dir / "index.json", "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()[:16]
+
+    @classmethod
+    def build(
+        cls,
+        data_path: Union[str, Path],
+        corpus_dir: Union[str, Path, None] = None,
+        keywords: Sequence[str] = ALL_KEYWORDS,
+        len_samples: int = LEN_SAMPLES,
+        rebuild: bool = False,
+    ) -> "AudioCorpus":
+        """
+        build - Pack all filtered clips of the cache in `data_path` into a
+                corpus, unless it already exists. A corpus written by
+                `preprocess_audio` is never reused, as its clips come from
+                another filterbank.
+        :param data_path:    Folder with the `cache` directory
+        :param corpus_dir:   Where to store the corpus. Default: `<data_path>/corpus`
+        :param keywords:     Keywords whose clips are included
+        :param len_samples:  Clips are zero-padded or truncated to this length
+        :param rebuild:      Rebuild even if the corpus exists
+        :return:
+            `AudioCorpus` object
+        """
+        corpus_dir = Path(corpus_dir or Path(data_path) / "corpus")
+        path_index = corpus_dir / "index.json"
+        if not rebuild and path_index.exists():
+            with open(path_index) as f:
+                if "preprocessing" in json.load(f):
+                    raise ValueError(
+                        f"AudioCorpus: {corpus_dir} holds clips filtered by "
+                        + "`preprocess_audio`, not the `_filtered.npz` cache."
+                    )
+        if rebuild or not path_index.exists():
+            files, labels = find_cached_files(data_path, keywords)
+            clips = (_load_clip(fn) for fn in files)
+            rel_files = [str(Path(fn).relative_to(data_path)) for fn in files]
+            sources = {}
+            for rel, fn in zip(rel_files, files):
+                stat = os.stat(fn)
+                sources[rel] = [stat.st_size, stat.st_mtime_ns]
+            write_corpus(
+                corpus_dir,
+                clips,
+                labels,
+                rel_files,
+                keywords,
+                len_samples,
+                extra_index={"sources": sources},
+            )
+        return cls(corpus_dir)
+
+    def split(
+        self,
+        keywords: Sequence[str],
+        percentage: float = 1.0,
+        ratio_train: float = 0.8,
+        seed: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        split - Shuffle the clips of `keywords` and split a fraction
+                `percentage` of them into training and test sets, with the
+                same set sizes as in the notebooks.
+        :param keywords:     Keywords to use
+        :param percentage:   Fraction of clips to use
+        :param ratio_train:  Fraction of used clips for training
+        :param seed:         Seed for shuffling
+        :return:
+            Clip indices for training
+            Clip indices for testing
+        """
+        kw_idcs = [self.keywords.index(kw) for kw in keywords]
+        idcs = np.flatnonzero(np.isin(self.labels, kw_idcs))
+        np.random.default_rng(seed).shuffle(idcs)
+        num_train = int(idcs.size * ratio_train * percentage)
+        num_test = int(idcs.size * (1 - ratio_train) * percentage)
+        return idcs[:num_train], idcs[num_train : num_train + num_test]
+
+    def get(
+        self, idcs: Iterable[int], keywords: Sequence[str]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        get - Load clips and their targets.
+        :param idcs:      Clip indices, e.g. from `split`
+        :param keywords:  Keywords defining the target channels
+        :return:
+            3D-array of clips [#clips x #samples x #channels]
+            3D-array of one-hot targets [#clips x #samples x #keywords]
+        """
+        idcs = np.asarray(idcs)
+        # - Sorted access keeps reads from the memory map sequential
+        order = np.argsort(idcs)
+        data = np.empty((idcs.size, *self.data.shape[1:]), np.float32)
+        data[order] = self.data[idcs[order]]
+        keywords = list(keywords)
+        kw_map = np.array(
+            [keywords.index(kw) if kw in keywords else -1 for kw in self.keywords]
+        )
+        label_idcs = kw_map[self.labels[idcs]]
+        if np.any(label_idcs < 0):
+            raise ValueError(
+                "AudioCorpus: Some of the requested clips belong to keywords "
+                + "that are not in `keywords`."
+            )
+        one_hot = np.eye(len(keywords))[label_idcs]
+        targets = np.repeat(one_hot[:, None, :], data.shape[1], axis=1)
+        return data, targets
+
+
+def write_corpus(
+    corpus_dir: Union[str, Path],
+    clips: Iterable[np.ndarray],
+    labels: Sequence[int],
+    files: Sequence[str],
+    keywords: Sequence[str],
+    len_samples: int = LEN_SAMPLES,
+    num_channels: int = NUM_CHANNELS,
+    extra_index: Optional[dict] = None,
+):
+    """
+    write_corpus - Write clips to a corpus directory (see `AudioCorpus`). Clips
+                   are written one by one into the memory map, so they can be
+                   produced by a generator without holding all in memory.
+    :param corpus_dir:    Target directory
+    :param clips:         Iterable over 2D-arrays [#samples x #channels], in the
+                          same order as `labels` and `files`
+    :param labels:        Keyword index for each clip
+    :param files:         Source file for each clip
+    :param keywords:      Keywords that `labels` refer to
+    :param len_samples:   Clips are zero-padded or truncated to this length
+    :param num_channels:  Number of channels per clip
+    :param extra_index:   Additional entries for `index.json`
+    """
+    corpus_dir = Path(corpus_dir)
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    # - Remove the index first, so an interrupted build is never taken as valid
+    (corpus_dir / "index.json").unlink(missing_ok=True)
+
+    data = np.lib.format.open_memmap(
+        corpus_dir / "data.npy",
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(labels), len_samples, num_channels),
+    )
+    for idx, clip in enumerate(clips):
+        data[idx] = _fit_length(clip, len_samples)
+    data.flush()
+    del data
+
+    np.save(corpus_dir / "labels.npy", np.asarray(labels, dtype=np.int16))
+    np.save(corpus_dir / "offsets.npy", np.arange(len(labels)) * len_samples)
+    index = {"keywords": list(keywords), "files": list(files)}
+    index.update(extra_index or {})
+    with open(corpus_dir / "index.json", "w") as f:
+        json.dump(index, f)
+    print(f"Packed {len(labels)} clips into {corpus_dir}")
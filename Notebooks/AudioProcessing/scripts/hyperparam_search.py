@@ -0,0 +1,293 @@
+# Hyper-parameter search for the TwoWordClassifier reservoir. The filterbank
+# output comes from the packed `AudioCorpus`. Reservoir states are cached on
+# disk per reservoir configuration, so configurations that only differ in the
+# readout (`regularize`) are simulated once. Configurations are simulated in a
+# process pool, first on a fraction of the clips; only those close to the best
+# screening accuracy are evaluated on all clips. Screening and ranking use a
+# validation set split off the training clips; the test set is only used to
+# report the accuracy of the final pick.
+#
+# Usage:
+#     corpus = AudioCorpus.build(DATA_PATH)
+#     configs = param_grid(tau_mem=[0.02, 0.05], regularize=[1e-3, 1e-1])
+#     table = search(corpus, ["yes", "no"], configs, cache_dir="search_cache")
+
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import hashlib
+import itertools
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.audio_corpus import AudioCorpus
+from scripts.batched_reservoir import (
+    BatchedReservoir,
+    accuracy,
+    fit_readout,
+    reservoir_features,
+)
+from scripts.reservoir_weights import reservoir_weights
+
+# - Parameters that change the reservoir states; all others only affect the readout
+RESERVOIR_PARAMS = (
+    "num_neurons",
+    "weights_spike_conv",
+    "tau_mem",
+    "tau_syn",
+    "sparsity_inp",
+    "sparsity_res",
+    "seed",
+)
+DEFAULTS = dict(
+    num_neurons=100,
+    weights_spike_conv=3.0,
+    tau_mem=0.05,
+    tau_syn=0.05,
+    sparsity_inp=0.5,
+    sparsity_res=0.1,
+    seed=0,
+    regularize=0.001,
+)
+
+
+def param_grid(**values: Sequence) -> List[dict]:
+    """
+    param_grid - All combinations of the given parameter values, completed with
+                 `DEFAULTS`.
+    """
+    unknown = set(values) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"param_grid: Unknown parameters {sorted(unknown)}.")
+    names = list(values)
+    return [
+        {**DEFAULTS, **dict(zip(names, combination))}
+        for combination in itertools.product(*values.values())
+    ]
+
+
+def _hash(*items) -> str:
+    digest = hashlib.sha1()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            digest.update(item.tobytes())
+        else:
+            digest.update(json.dumps(item, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def _cached_features(
+    corpus: AudioCorpus,
+    idcs: np.ndarray,
+    data: np.ndarray,
+    res_params: dict,
+    cache_dir: Path,
+    batch_size: int,
+) -> Tuple[np.ndarray, dict]:
+    # - Reservoir states of the clips `idcs`, loaded from or written to the cache
+    path = cache_dir / f"{_hash(res_params, idcs, corpus.fingerprint())}.npy"
+    path_meta = path.with_suffix(".json")
+    if path.exists() and path_meta.exists():
+        with open(path_meta) as f:
+            meta = json.load(f)
+        return np.load(path, mmap_mode="r"), meta
+    w_inp, w_rec = reservoir_weights(
+        corpus.data.shape[-1],
+        res_params["num_neurons"],
+        res_params["sparsity_inp"],
+        res_params["sparsity_res"],
+        seed=res_params["seed"],
+    )
+    reservoir = BatchedReservoir(
+        w_inp,
+        w_rec,
+        weights_spike_conv=res_params["weights_spike_conv"],
+        tau_mem=res_params["tau_mem"],
+        tau_syn=res_params["tau_syn"],
+    )
+    t_start = time.perf_counter()
+    features = reservoir_features(reservoir, data, batch_size=batch_size)
+    sim_time = time.perf_counter() - t_start
+    meta = {
+        "sim_time_s": sim_time,
+        "sim_time_per_clip_ms": 1000 * sim_time / max(len(idcs), 1),
+    }
+    # - Write the metadata last, so that an interrupted write is not reused
+    tmp = path.with_suffix(".tmp.npy")
+    np.save(tmp, features)
+    tmp.rename(path)
+    with open(path_meta, "w") as f:
+        json.dump(meta, f)
+    return features, meta
+
+
+def _evaluate(args) -> List[dict]:
+    # - Simulate one reservoir configuration and evaluate all its readouts on
+    #   each set in `eval_sets`
+    corpus_dir, keywords, idcs_train, eval_sets, configs, cache_dir, batch_size = args
+    corpus = AudioCorpus(corpus_dir)
+    res_params = {key: configs[0][key] for key in RESERVOIR_PARAMS}
+    features = {}
+    for name, idcs in {"train": idcs_train, **eval_sets}.items():
+        data, targets = corpus.get(idcs, keywords)
+        feat, meta = _cached_features(
+            corpus, idcs, data, res_params, cache_dir, batch_size
+        )
+        features[name] = (feat, targets, meta, len(idcs))
+    num_clips = sum(num for *_, num in features.values())
+    sim_time = sum(
+        meta["sim_time_per_clip_ms"] * num for *_, meta, num in features.values()
+    )
+    feat_train, train_targets, *_ = features["train"]
+    rows = []
+    for config in configs:
+        weights, bias = fit_readout(feat_train, train_targets, config["regularize"])
+        row = dict(config)
+        for name, (feat, targets, *_) in features.items():
+            row[f"{name}_accuracy"] = accuracy(feat, targets, weights, bias)
+        row["sim_time_per_clip_ms"] = sim_time / num_clips
+        row["num_clips"] = num_clips
+        rows.append(row)
+    return rows
+
+
+def _run_stage(
+    corpus: AudioCorpus,
+    keywords: Sequence[str],
+    configs: List[dict],
+    idcs_train: np.ndarray,
+    eval_sets: Dict[str, np.ndarray],
+    cache_dir: Path,
+    num_workers: Optional[int],
+    batch_size: int,
+) -> List[dict]:
+    # - Group configurations by reservoir, so each reservoir is simulated once
+    groups: Dict[str, List[dict]] = {}
+    for config in configs:
+        key = _hash({name: config[name] for name in RESERVOIR_PARAMS})
+        groups.setdefault(key, []).append(config)
+    tasks = [
+        (
+            corpus.corpus_dir,
+            list(keywords),
+            idcs_train,
+            eval_sets,
+            group,
+            cache_dir,
+            batch_size,
+        )
+        for group in groups.values()
+    ]
+    with ProcessPoolExecutor(num_workers) as executor:
+        return [row for rows in executor.map(_evaluate, tasks) for row in rows]
+
+
+def search(
+    corpus: AudioCorpus,
+    keywords: Sequence[str],
+    configs: List[dict],
+    cache_dir: Union[str, Path] = "search_cache",
+    percentage: float = 1.0,
+    ratio_train: float = 0.8,
+    ratio_val: float = 0.2,
+    screen_fraction: Optional[float] = 0.25,
+    tolerance: float = 0.05,
+    num_workers: Optional[int] = None,
+    batch_size: int = 256,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    search - Evaluate reservoir and readout configurations and rank them by
+             validation accuracy. Only the best configuration is evaluated on
+             the test set.
+    :param corpus:           `AudioCorpus` with the filtered clips
+    :param keywords:         Keywords to classify
+    :param configs:          List of parameter dicts, e.g. from `param_grid`
+    :param cache_dir:        Folder for cached reservoir states
+    :param percentage:       Fraction of clips to use, as in `AudioCorpus.split`
+    :param ratio_train:      Fraction of used clips for training and validation
+    :param ratio_val:        Fraction of the training clips held out for validation
+    :param screen_fraction:  Fraction of the clips used for screening. With
+                             `None`, all configurations are evaluated on all
+                             clips.
+    :param tolerance:        Configurations whose screening accuracy is more than
+                             this below the best one are stopped early
+    :param num_workers:      Number of worker processes. Default: number of CPUs
+    :param batch_size:       Number of clips simulated together in a worker
+    :param seed:             Seed for the train/test split
+    :return:
+        `pandas.DataFrame` with one row per configuration, best first. Column
+        `stage` tells whether a configuration was stopped after screening.
+        `test_accuracy` is only set for the first row.
+    """
+    if not 0 < ratio_val < 1:
+        raise ValueError("search: `ratio_val` must be between 0 and 1.")
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    configs = [{**DEFAULTS, **config} for config in configs]
+    idcs_train, idcs_test = corpus.split(keywords, percentage, ratio_train, seed)
+    num_val = max(int(len(idcs_train) * ratio_val), 1)
+    idcs_train, idcs_val = idcs_train[num_val:], idcs_train[:num_val]
+    results = []
+    if screen_fraction is not None and screen_fraction < 1:
+        num_train = max(int(len(idcs_train) * screen_fraction), 1)
+        num_val = max(int(len(idcs_val) * screen_fraction), 1)
+        screened = _run_stage(
+            corpus,
+            keywords,
+            configs,
+            idcs_train[:num_train],
+            {"validation": idcs_val[:num_val]},
+            cache_dir,
+            num_workers,
+            batch_size,
+        )
+        best = max(row["validation_accuracy"] for row in screened)
+        configs = []
+        for row in screened:
+            if row["validation_accuracy"] >= best - tolerance:
+                configs.append({key: row[key] for key in DEFAULTS})
+            else:
+                results.append({**row, "stage": "screening"})
+        print(
+            f"Screening: {len(configs)} of {len(screened)} configurations "
+            + f"within {tolerance} of the best accuracy {best:.3f}"
+        )
+    full = _run_stage(
+        corpus,
+        keywords,
+        configs,
+        idcs_train,
+        {"validation": idcs_val},
+        cache_dir,
+        num_workers,
+        batch_size,
+    )
+    # - Test accuracy of the selected configuration only
+    selected = max(full, key=lambda row: row["validation_accuracy"])
+    (final,) = _run_stage(
+        corpus,
+        keywords,
+        [{key: selected[key] for key in DEFAULTS}],
+        idcs_train,
+        {"test": idcs_test},
+        cache_dir,
+        num_workers,
+        batch_size,
+    )
+    selected["test_accuracy"] = final["test_accuracy"]
+    print(
+        "Selected configuration: validation accuracy "
+        + f"{selected['validation_accuracy']:.3f}, "
+        + f"test accuracy {selected['test_accuracy']:.3f}"
+    )
+    results.extend({**row, "stage": "full"} for row in full)
+    table = pd.DataFrame(results)
+    table["full"] = table["stage"] == "full"
+    table = table.sort_values(
+        ["full", "validation_accuracy"], ascending=False, kind="stable"
+    )
+    return table.drop(columns="full").reset_index(drop=True)
@@ -0,0 +1,263 @@
+# Batch preprocessing of the keyword wav files with a 32-band Butterworth mel
+# filterbank, in the spirit of rockpool's `ButterMelFilter(fs=fs, num_filters=32)`
+# that the live demo applies to single recordings. Clips are filtered in stacks
+# with `scipy.signal.sosfilt`, chunks of files are spread over a process pool
+# and the result is written directly as an `AudioCorpus`. Rebuilding only
+# filters files that are new or have changed since the last build. The corpus
+# goes to `<data_path>/corpus_filtered` by default, apart from the corpus of
+# the notebooks' `_filtered.npz` cache that `AudioCorpus.build` packs.
+#
+# Usage (from the AudioProcessing folder):
+#     python -m scripts.preprocess_audio audio_data/
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+from scipy import signal
+from scipy.io import wavfile
+
+from scripts.audio_corpus import ALL_KEYWORDS, AudioCorpus, write_corpus
+
+FS = 16000  # Sampling rate of the audio data
+CUTOFF_FS = 100.0  # Sampling rate of the filtered clips
+CLIP_DURATION = 1.0  # Clip length in seconds
+
+
+def hz_to_mel(freq):
+    return 2595 * np.log10(1 + np.asarray(freq) / 700)
+
+
+def mel_to_hz(mel):
+    return 700 * (10 ** (np.asarray(mel) / 2595) - 1)
+
+
+def butter_mel_sos(
+    fs: float = FS,
+    num_filters: int = 32,
+    order: int = 2,
+    filter_width: float = 2.0,
+    f_min: float = 50.0,
+) -> np.ndarray:
+    """
+    butter_mel_sos - Second-order sections of Butterworth band-pass filters with
+                     center frequencies equally spaced on the mel scale.
+    :param fs:            Sampling rate in Hz
+    :param num_filters:   Number of bands
+    :param order:         Butterworth filter order
+    :param filter_width:  Band width in units of the spacing between bands
+    :param f_min:         Lowest center frequency in Hz
+    :return:
+        Array of shape [#filters x #sections x 6]
+    """
+    f_max = 0.45 * fs
+    mel_centers = np.linspace(hz_to_mel(f_min), hz_to_mel(f_max), num_filters)
+    half_width = filter_width * (mel_centers[1] - mel_centers[0]) / 2
+    sos = []
+    for center in mel_centers:
+        low = max(mel_to_hz(center - half_width), 1.0)
+        high = min(mel_to_hz(center + half_width), 0.49 * fs)
+        sos.append(signal.butter(order, [low, high], "bandpass", fs=fs, output="sos"))
+    return np.array(sos)
+
+
+def filter_clips(
+    clips: np.ndarray,
+    sos_bands: np.ndarray,
+    fs: float = FS,
+    cutoff_fs: float = CUTOFF_FS,
+    order: int = 2,
+) -> np.ndarray:
+    """
+    filter_clips - Apply the filterbank to a stack of clips: band-pass, rectify,
+                   low-pass and downsample to `cutoff_fs`.
+    :param clips:      2D-array of equally long clips [#clips x #samples]
+    :param sos_bands:  Filterbank from `butter_mel_sos`
+    :return:
+        3D-array [#clips x #samples_out x #filters], float32
+    """
+    sos_lowpass = signal.butter(order, cutoff_fs / 2, "lowpass", fs=fs, output="sos")
+    step = int(round(fs / cutoff_fs))
+    num_out = clips.shape[1] // step
+    filtered = np.empty((clips.shape[0], num_out, len(sos_bands)), np.float32)
+    for idx_band, sos in enumerate(sos_bands):
+        # - All clips at once along the time axis
+        band = np.abs(signal.sosfilt(sos, clips, axis=1))
+        envelope = signal.sosfilt(sos_lowpass, band, axis=1)
+        filtered[:, :, idx_band] = envelope[:, : num_out * step : step]
+    return filtered
+
+
+def load_wav(fn: Union[str, Path], fs: float = FS, duration: float = CLIP_DURATION):
+    """
+    load_wav - Load a wav file as float, resample to `fs`, zero-pad or truncate
+               to `duration` and normalize to a maximum amplitude of 1, as the
+               live demo does.
+    """
+    fs_file, audio = wavfile.read(fn)
+    if np.issubdtype(audio.dtype, np.integer):
+        audio = audio / np.iinfo(audio.dtype).max
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    if fs_file != fs:
+        audio = signal.resample_poly(audio, int(fs), int(fs_file))
+    num_samples = int(fs * duration)
+    audio = np.pad(audio[:num_samples], (0, max(0, num_samples - len(audio))))
+    peak = np.max(np.abs(audio))
+    return audio / peak if peak > 0 else audio
+
+
+def _process_chunk(args: Tuple[List[str], dict]) -> np.ndarray:
+    files, params = args
+    clips = np.stack([load_wav(fn, params["fs"], params["duration"]) for fn in files])
+    sos = butter_mel_sos(params["fs"], params["num_filters"], params["order"])
+    return filter_clips(clips, sos, params["fs"], params["cutoff_fs"], params["order"])
+
+
+def find_wav_files(
+    data_path: Union[str, Path], keywords: Sequence[str] = ALL_KEYWORDS
+) -> Tuple[List[Path], List[int]]:
+    """
+    find_wav_files - Wav files in `<data_path>/audio/<keyword>/` for each keyword.
+    :return:
+        List with paths of wav files
+        List with the index in `keywords` of each file's keyword
+    """
+    files = []
+    labels = []
+    for idx_kw, keyword in enumerate(keywords):
+        for fn in sorted((Path(data_path) / "audio" / keyword).rglob("*.wav")):
+            files.append(fn)
+            labels.append(idx_kw)
+    return files, labels
+
+
+def build_filtered_corpus(
+    data_path: Union[str, Path],
+    corpus_dir: Union[str, Path, None] = None,
+    keywords: Sequence[str] = ALL_KEYWORDS,
+    num_filters: int = 32,
+    order: int = 2,
+    fs: float = FS,
+    cutoff_fs: float = CUTOFF_FS,
+    duration: float = CLIP_DURATION,
+    num_workers: Optional[int] = None,
+    chunk_size: int = 256,
+) -> AudioCorpus:
+    """
+    build_filtered_corpus - Filter all wav files of `keywords` and write them as
+                            an `AudioCorpus`. Files whose size and modification
+                            time match the previous build are copied from the
+                            existing corpus instead of being filtered again.
+    :param data_path:    Folder with the `audio` directory
+    :param corpus_dir:   Where to store the corpus. Default: `<data_path>/corpus_filtered`
+    :param keywords:     Keywords whose clips are included
+    :param num_filters:  Number of filterbank channels
+    :param order:        Butterworth filter order
+    :param fs:           Sampling rate at which clips are filtered
+    :param cutoff_fs:    Sampling rate of the filtered clips
+    :param duration:     Clip duration in seconds
+    :param num_workers:  Number of worker processes. Default: number of CPUs
+    :param chunk_size:   Number of clips filtered together in one worker call
+    :return:
+        `AudioCorpus` object
+    """
+    data_path = Path(data_path)
+    corpus_dir = Path(corpus_dir or data_path / "corpus_filtered")
+    params = dict(
+        fs=fs,
+        num_filters=num_filters,
+        order=order,
+        cutoff_fs=cutoff_fs,
+        duration=duration,
+    )
+    files, labels = find_wav_files(data_path, keywords)
+    rel_files = [str(fn.relative_to(data_path)) for fn in files]
+    sources = {}
+    for rel, fn in zip(rel_files, files):
+        stat = os.stat(fn)
+        sources[rel] = [stat.st_size, stat.st_mtime_ns]
+
+    # - Rows of the previous build that can be reused
+    previous = None
+    reuse: Dict[int, int] = {}
+    path_index = corpus_dir / "index.json"
+    if path_index.exists():
+        with open(path_index) as f:
+            index = json.load(f)
+        if index.get("preprocessing") == params:
+            previous = AudioCorpus(corpus_dir)
+            old_rows = {fn: row for row, fn in enumerate(index["files"])}
+            old_sources = index.get("sources", {})
+            for idx, rel in enumerate(rel_files):
+                if rel in old_rows and old_sources.get(rel) == sources[rel]:
+                    reuse[idx] = old_rows[rel]
+
+    changed = [str(fn) for idx, fn in enumerate(files) if idx not in reuse]
+    print(
+        f"Filtering {len(changed)} of {len(files)} files "
+        + f"({len(reuse)} unchanged since the last build)"
+    )
+    chunks = [
+        (changed[i : i + chunk_size], params)
+        for i in range(0, len(changed), chunk_size)
+    ]
+
+    tmp_dir = corpus_dir.with_name(corpus_dir.name + "_tmp")
+    with ProcessPoolExecutor(num_workers) as executor:
+        fresh = (
+            clip for chunk in executor.map(_process_chunk, chunks) for clip in chunk
+        )
+
+        def clips() -> Iterator[np.ndarray]:
+            for idx in range(len(files)):
+                if idx in reuse:
+                    yield previous.data[reuse[idx]]
+                else:
+                    yield next(fresh)
+
+        write_corpus(
+            tmp_dir,
+            clips(),
+            labels,
+            rel_files,
+            keywords,
+            len_samples=int(duration * cutoff_fs),
+            num_channels=num_filters,
+            extra_index={"preprocessing": params, "sources": sources},
+        )
+
+    # - Replace the previous corpus only once the new one is complete
+    del previous
+    if corpus_dir.exists():
+        shutil.rmtree(corpus_dir)
+    tmp_dir.rename(corpus_dir)
+    return AudioCorpus(corpus_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Filter keyword wav files into a packed audio corpus"
+    )
+    parser.add_argument("data_path", help="Folder with the 'audio' directory")
+    parser.add_argument("--corpus-dir", default=None)
+    parser.add_argument("--keywords", nargs="+", default=ALL_KEYWORDS)
+    parser.add_argument("--num-filters", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    build_filtered_corpus(
+        args.data_path,
+        args.corpus_dir,
+        keywords=args.keywords,
+        num_filters=args.num_filters,
+        num_workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Sparse random weights for the audio reservoir. Input and recurrent matrices
+# are sampled directly in CSR format with an exact number of non-zero entries,
+# so that no dense [#neurons x #neurons] array is ever allocated and reservoirs
+# with tens of thousands of neurons can be built.
+#
+# In the notebooks, `sparsity_inp` and `sparsity_res` are the fractions of
+# weights that are kept. Replaces the weight construction there by
+#     w_inp, w_rec = reservoir_weights(num_channels, num_neurons,
+#                                      sparsity_inp, sparsity_res)
+# The result can be passed to `BatchedReservoir` as is, or converted with
+# `.toarray()` for the NEST layers.
+
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+
+def sparse_normal(
+    shape: Tuple[int, int],
+    density: float,
+    loc: float = 0.0,
+    scale: float = 1.0,
+    rng: Union[np.random.Generator, int, None] = None,
+) -> sparse.csr_matrix:
+    """
+    sparse_normal - Sparse matrix with exactly `round(density * size)` non-zero
+                    entries at distinct random positions, drawn from a normal
+                    distribution.
+    :param shape:    Shape of the matrix
+    :param density:  Fraction of non-zero entries, between 0 and 1
+    :param loc:      Mean of the non-zero entries
+    :param scale:    Standard deviation of the non-zero entries
+    :param rng:      Random generator or seed
+    :return:
+        `scipy.sparse.csr_matrix`
+    """
+    if not 0 <= density <= 1:
+        raise ValueError("sparse_normal: `density` must be between 0 and 1.")
+    rng = np.random.default_rng(rng)
+    num_rows, num_cols = shape
+    num_nonzero = int(round(density * num_rows * num_cols))
+    # - Number of entries per row as for positions drawn without replacement
+    #   over the whole matrix, so the density is exact
+    row_counts = rng.multivariate_hypergeometric(
+        np.full(num_rows, num_cols), num_nonzero
+    )
+    # - Distinct columns within each row, never allocating more than one row
+    indices = np.empty(num_nonzero, dtype=np.int64)
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(row_counts, out=indptr[1:])
+    for row, count in enumerate(row_counts):
+        if count > 0:
+            cols = rng.choice(num_cols, size=count, replace=False)
+            indices[indptr[row] : indptr[row + 1]] = np.sort(cols)
+    values = rng.normal(loc, scale, size=num_nonzero)
+    return sparse.csr_matrix((values, indices, indptr), shape=shape)
+
+
+def spectral_radius(w: Union[sparse.spmatrix, np.ndarray]) -> float:
+    """
+    spectral_radius - Largest absolute eigenvalue of a square matrix, from the
+                      ARPACK sparse eigen-solver. Small matrices are solved
+                      densely.
+    """
+    w = sparse.csr_matrix(w, dtype=float)
+    if w.nnz == 0:
+        return 0.0
+    if w.shape[0] < 3:
+        # - ARPACK requires k < n - 1
+        return float(np.max(np.abs(np.linalg.eigvals(w.toarray()))))
+    eigval = sparse_linalg.eigs(w, k=1, which="LM", return_eigenvectors=False)
+    return float(np.abs(eigval[0]))
+
+
+def reservoir_weights(
+    num_channels: int,
+    num_neurons: int,
+    sparsity_inp: float = 0.5,
+    sparsity_res: float = 0.1,
+    scale_inp: float = 0.01,
+    loc_rec: float = -0.0001,
+    scale_rec: float = 0.0002,
+    radius: Optional[float] = None,
+    seed: Optional[int] = None,
+) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+    """
+    reservoir_weights - Input and recurrent weights of the reservoir, with the
+                        distributions of the TwoWordClassifier notebooks.
+    :param num_channels:  Number of input channels
+    :param num_neurons:   Number of reservoir neurons
+    :param sparsity_inp:  Fraction of input weights that are non-zero
+    :param sparsity_res:  Fraction of recurrent weights that are non-zero
+    :param scale_inp:     Standard deviation of the input weights
+    :param loc_rec:       Mean of the recurrent weights
+    :param scale_rec:     Standard deviation of the recurrent weights
+    :param radius:        If not `None`, rescale the recurrent weights to this
+                          spectral radius
+    :param seed:          Random seed
+    :return:
+        Input weights, CSR [#channels x #neurons]
+        Recurrent weights, CSR [#neurons x #neurons]
+    """
+    rng = np.random.default_rng(seed)
+    w_inp = sparse_normal(
+        (num_channels, num_neurons), sparsity_inp, 0.0, scale_inp, rng
+    )
+    w_rec = sparse_normal(
+        (num_neurons, num_neurons), sparsity_res, loc_rec, scale_rec, rng
+    )
+    if radius is not None:
+        current = spectral_radius(w_rec)
+        if current > 0:
+            w_rec = w_rec * (radius / current)
+    return w_inp, w_rec
@@ -0,0 +1,331 @@
+# Streaming keyword spotting with the audio reservoir. Audio is consumed in
+# frames of 10-20 ms from a wav file or raw PCM on stdin; filterbank and
+# reservoir run incrementally with carried state, and keywords are detected
+# from the readout output summed over a sliding decision window.
+#
+# Usage (from the AudioProcessing folder):
+#     python -m scripts.streaming_kws kws_model.npz --threshold 200 --wav recording.wav
+#     arecord -f S16_LE -r 16000 -c 1 | python -m scripts.streaming_kws kws_model.npz --threshold 200
+#
+# There is no background class, so some keyword always has the largest score
+# and `threshold` has to be chosen per model. With one-hot training targets, a
+# window filled by a keyword scores about `window / dt` (500 for 0.5 s at 1 ms),
+# and chance level is that divided by the number of keywords.
+
+from typing import Iterator, List, NamedTuple, Optional, Sequence
+from collections import deque
+import argparse
+import sys
+import time
+
+import numpy as np
+from scipy import signal, sparse
+from scipy.io import wavfile
+
+from scripts.batched_reservoir import BatchedReservoir
+from scripts.preprocess_audio import CUTOFF_FS, FS, butter_mel_sos
+
+FRAME_MS = 10
+
+
+class Detection(NamedTuple):
+    # Time of the detection in seconds from the start of the stream
+    time: float
+    keyword: str
+    # Readout output summed over the decision window
+    score: float
+
+
+def wav_frames(
+    path: str, frame_ms: float = FRAME_MS, fs: float = FS
+) -> Iterator[np.ndarray]:
+    """
+    wav_frames - Replay a wav file in frames of `frame_ms` milliseconds.
+    """
+    fs_file, audio = wavfile.read(path)
+    if np.issubdtype(audio.dtype, np.integer):
+        audio = audio / np.iinfo(audio.dtype).max
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    if fs_file != fs:
+        audio = signal.resample_poly(audio, int(fs), int(fs_file))
+    frame_size = int(fs * frame_ms / 1000)
+    for start in range(0, len(audio) - frame_size + 1, frame_size):
+        yield audio[start : start + frame_size]
+
+
+def stdin_frames(frame_ms: float = FRAME_MS, fs: float = FS) -> Iterator[np.ndarray]:
+    """
+    stdin_frames - Read mono 16 bit little-endian PCM at `fs` from stdin.
+    """
+    frame_size = int(fs * frame_ms / 1000)
+    while True:
+        data = sys.stdin.buffer.read(2 * frame_size)
+        if len(data) < 2 * frame_size:
+            return
+        yield np.frombuffer(data, dtype="<i2") / np.iinfo(np.int16).max
+
+
+class StreamingFilterbank:
+    """
+    StreamingFilterbank - The filterbank of `preprocess_audio` applied frame by
+                          frame, carrying filter states and the downsampling
+                          phase between frames. Instead of normalizing whole
+                          clips, the input is divided by a running peak
+                          amplitude that decays with time constant `tau_peak`.
+    """
+
+    def __init__(
+        self,
+        fs: float = FS,
+        num_filters: int = 32,
+        order: int = 2,
+        cutoff_fs: float = CUTOFF_FS,
+        tau_peak: float = 2.0,
+    ):
+        self.sos_bands = butter_mel_sos(fs, num_filters, order)
+        self.sos_lowpass = signal.butter(
+            order, cutoff_fs / 2, "lowpass", fs=fs, output="sos"
+        )
+        self.step = int(round(fs / cutoff_fs))
+        self.decay_peak = np.exp(-1 / (fs * tau_peak))
+        self.num_filters = num_filters
+        self.reset()
+
+    def reset(self):
+        num_sections = self.sos_bands.shape[1]
+        self.zi_bands = np.zeros((self.num_filters, num_sections, 2))
+        self.zi_lowpass = np.zeros((self.num_filters, self.sos_lowpass.shape[0], 2))
+        self.phase = 0
+        self.peak = 0.0
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        """
+        process - Filter one frame of audio.
+        :return:
+            2D-array [#output samples x #filters] of new samples at `cutoff_fs`
+        """
+        self.peak = max(
+            np.max(np.abs(frame)), self.peak * self.decay_peak ** len(frame)
+        )
+        frame = frame / max(self.peak, 1e-6)
+        # - Indices of the samples that are kept after downsampling
+        keep = np.arange(self.phase, len(frame), self.step)
+        self.phase = (self.phase - len(frame)) % self.step
+        out = np.empty((len(keep), self.num_filters))
+        for idx in range(self.num_filters):
+            band, self.zi_bands[idx] = signal.sosfilt(
+                self.sos_bands[idx], frame, zi=self.zi_bands[idx]
+            )
+            envelope, self.zi_lowpass[idx] = signal.sosfilt(
+                self.sos_lowpass, np.abs(band), zi=self.zi_lowpass[idx]
+            )
+            out[:, idx] = envelope[keep]
+        return out
+
+
+class KeywordSpotter:
+    """
+    KeywordSpotter - Filterbank, reservoir and readout on a stream of frames.
+                     A keyword is detected when its readout output, summed
+                     over the last `window` seconds, is the largest and exceeds
+                     `threshold`. After a detection, no further detection is
+                     emitted for `holdoff` seconds. `threshold` is required,
+                     since without a background class every window has a
+                     best keyword.
+    """
+
+    def __init__(
+        self,
+        filterbank: StreamingFilterbank,
+        reservoir: BatchedReservoir,
+        weights: np.ndarray,
+        bias: np.ndarray,
+        keywords: Sequence[str],
+        window: float = 0.5,
+        threshold: Optional[float] = None,
+        holdoff: float = 0.5,
+        fs_filtered: float = CUTOFF_FS,
+    ):
+        if threshold is None:
+            raise ValueError(
+                "KeywordSpotter: `threshold` must be set, there is no background class."
+            )
+        self.filterbank = filterbank
+        self.reservoir = reservoir
+        self.weights = weights
+        self.bias = bias
+        self.keywords = list(keywords)
+        self.threshold = threshold
+        self.holdoff = holdoff
+        self.steps_per_sample = int(round(1 / (fs_filtered * reservoir.dt)))
+        self.window_steps = int(round(window / reservoir.dt))
+        self.latencies: List[float] = []
+        self.reset()
+
+    def reset(self):
+        self.filterbank.reset()
+        self.reservoir.reset(1)
+        self.last_sample = np.zeros(self.filterbank.num_filters)
+        self.outputs = deque(maxlen=self.window_steps)
+        self.window_sum = np.zeros(len(self.keywords))
+        self.time = 0.0
+        self.audio_time = 0.0
+        self.last_detection = -np.inf
+        self.latencies = []
+
+    def _upsample(self, samples: np.ndarray) -> np.ndarray:
+        # - Linear interpolation from the previous sample, continued across frames
+        points = np.vstack((self.last_sample, samples))
+        frac = np.arange(1, self.steps_per_sample + 1) / self.steps_per_sample
+        steps = (
+            points[:-1, None] * (1 - frac[:, None]) + points[1:, None] * frac[:, None]
+        )
+        self.last_sample = points[-1]
+        return steps.reshape(-1, points.shape[1])
+
+    def process_frame(self, frame: np.ndarray, fs: float = FS) -> Optional[Detection]:
+        """
+        process_frame - Process one frame of audio.
+        :return:
+            `Detection` if a keyword has been detected during this frame, else `None`
+        """
+        t_start = time.perf_counter()
+        self.audio_time += len(frame) / fs
+        filtered = self.filterbank.process(frame)
+        detection = None
+        if len(filtered) > 0:
+            inp = self._upsample(filtered)[None]
+            features, __ = self.reservoir.evolve(inp)
+            output = features[0] @ self.weights + self.bias
+            for out in output:
+                # - Running sum over the sliding window
+                if len(self.outputs) == self.window_steps:
+                    self.window_sum -= self.outputs[0]
+                self.outputs.append(out)
+                self.window_sum += out
+                self.time += self.reservoir.dt
+                idx_best = int(np.argmax(self.window_sum))
+                score = float(self.window_sum[idx_best])
+                if (
+                    len(self.outputs) == self.window_steps
+                    and score > self.threshold
+                    and self.time - self.last_detection >= self.holdoff
+                ):
+                    self.last_detection = self.time
+                    detection = Detection(self.time, self.keywords[idx_best], score)
+        self.latencies.append(time.perf_counter() - t_start)
+        return detection
+
+    def run(self, frames: Iterator[np.ndarray], fs: float = FS) -> Iterator[Detection]:
+        """
+        run - Process a stream of frames and yield detections.
+        """
+        for frame in frames:
+            detection = self.process_frame(frame, fs)
+            if detection is not None:
+                yield detection
+
+    @property
+    def real_time_factor(self) -> float:
+        """
+        real_time_factor - Processing time divided by duration of the processed audio.
+        """
+        return sum(self.latencies) / max(self.audio_time, 1e-12)
+
+    def latency_stats(self) -> dict:
+        """
+        latency_stats - Mean, median and 99th percentile of the per-frame latency in ms.
+        """
+        lat = 1000 * np.array(self.latencies)
+        if lat.size == 0:
+            return {}
+        return {
+            "mean_ms": float(lat.mean()),
+            "median_ms": float(np.median(lat)),
+            "p99_ms": float(np.percentile(lat, 99)),
+            "real_time_factor": self.real_time_factor,
+        }
+
+
+def save_model(path: str, reservoir_kwargs: dict, weights, bias, keywords):
+    """
+    save_model - Store reservoir parameters and trained readout for `load_model`.
+                 Sparse weights, e.g. from `reservoir_weights`, are stored as
+                 their CSR arrays.
+    """
+    arrays = {}
+    for key, val in reservoir_kwargs.items():
+        if sparse.issparse(val):
+            val = sparse.csr_matrix(val)
+            arrays[f"sparse_{key}_data"] = val.data
+            arrays[f"sparse_{key}_indices"] = val.indices
+            arrays[f"sparse_{key}_indptr"] = val.indptr
+            arrays[f"sparse_{key}_shape"] = np.array(val.shape)
+        else:
+            arrays[f"reservoir_{key}"] = val
+    np.savez(path, weights=weights, bias=bias, keywords=np.array(keywords), **arrays)
+
+
+def load_model(path: str, **kwargs) -> KeywordSpotter:
+    """
+    load_model - Build a `KeywordSpotter` from a file written by `save_model`.
+                 `kwargs` are passed on to `KeywordSpotter`.
+    """
+    content = np.load(path)
+    reservoir_kwargs = {
+        key[len("reservoir_") :]: content[key]
+        for key in content.files
+        if key.startswith("reservoir_")
+    }
+    for key, val in reservoir_kwargs.items():
+        if val.ndim == 0:
+            reservoir_kwargs[key] = val.item()
+    for key in content.files:
+        if key.startswith("sparse_") and key.endswith("_shape"):
+            name = key[len("sparse_") : -len("_shape")]
+            reservoir_kwargs[name] = sparse.csr_matrix(
+                (
+                    content[f"sparse_{name}_data"],
+                    content[f"sparse_{name}_indices"],
+                    content[f"sparse_{name}_indptr"],
+                ),
+                shape=tuple(content[key]),
+            )
+    reservoir = BatchedReservoir(**reservoir_kwargs)
+    return KeywordSpotter(
+        StreamingFilterbank(num_filters=reservoir.num_channels),
+        reservoir,
+        content["weights"],
+        content["bias"],
+        [str(kw) for kw in content["keywords"]],
+        **kwargs,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming keyword spotting")
+    parser.add_argument("model", help="File written by `save_model`")
+    parser.add_argument("--wav", default=None, help="Replay wav file instead of stdin")
+    parser.add_argument("--frame-ms", type=float, default=FRAME_MS)
+    parser.add_argument("--window", type=float, default=0.5)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        required=True,
+        help="Minimum readout output summed over the decision window",
+    )
+    args = parser.parse_args()
+
+    spotter = load_model(args.model, window=args.window, threshold=args.threshold)
+    if args.wav is None:
+        frames = stdin_frames(args.frame_ms)
+    else:
+        frames = wav_frames(args.wav, args.frame_ms)
+    for detection in spotter.run(frames):
+        print(f"{detection.time:8.2f} s  {detection.keyword}  ({detection.score:.2f})")
+    print(spotter.latency_stats(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,36 +4,10 @@ import torch
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.animation import FuncAnimation
-from torch import nn
-
-
-class MNISTClassifier(nn.Module):
-    def __init__(self):
-        super().__init__()
-
-        self.seq = nn.Sequential(*[
-            nn.Conv2d(in_channels=1, out_channels=8,
-                      kernel_size=(3, 3), bias=False),
-            nn.ReLU(),
-            nn.AvgPool2d(kernel_size=(2, 2), stride=(2, 2)),
-            nn.Conv2d(in_channels=8, out_channels=32,
-                      kernel_size=(3, 3), bias=False),
-            nn.ReLU(),
-            nn.AvgPool2d(kernel_size=(2, 2), stride=(2, 2)),
-            nn.Conv2d(in_channels=32, out_channels=16,
-                      kernel_size=(3, 3), bias=False),
-            nn.ReLU(),
-            nn.AvgPool2d(kernel_size=(2, 2), stride=(2, 2)),
-            nn.Dropout2d(0.5),
-            nn.Flatten(),
-            nn.Linear(576, 32, bias=False),
-            nn.ReLU(),
-            nn.Linear(32, 10, bias=False),
-            nn.ReLU(),
-        ])
-
-    def forward(self, x):
-        return self.seq(x)
+
+from scripts.early_exit import EarlyExitClassifier
+from scripts.model import MNISTClassifier
+from scripts.profiler import LayerProfiler
 
 
 # instantiating the model and transferring to GPU
@@ -55,6 +29,11 @@ TIMESTEP_LENGTH = 10  # ms
 N_TIMESTEPS_IN_BATCH = 10
 mw_conversion_factor = SYNOP_POWER * 1000 / TIMESTEP_LENGTH / N_TIMESTEPS_IN_BATCH
 
+# per-layer synops, spikes and timing; set PROFILE_EVERY > 1 to sample batches
+# (power is then only printed for the sampled batches)
+PROFILE_EVERY = 1
+profiler = LayerProfiler(net, every=PROFILE_EVERY, synop_power=SYNOP_POWER)
+
 
 live = LiveDv(host='localhost', port=7777, qlen=10)
 
@@ -70,24 +49,46 @@ def transform(x):
     return x
 
 
+THR = 30
+# stop simulating a batch once the leading class is above THR and ahead of
+# the runner-up by EXIT_MARGIN spikes (opt-in; set EARLY_EXIT = True)
+EARLY_EXIT = False
+EXIT_MARGIN = 10
+if EARLY_EXIT:
+    early_exit = EarlyExitClassifier(net, threshold=THR, margin=EXIT_MARGIN)
+
+
 def process_batch():
     batch = live.get_batch()
     batch = transform(batch)
 
-    out = net(batch)
+    if EARLY_EXIT:
+        with profiler.record():
+            result = early_exit(batch)
+        power = result.synops * mw_conversion_factor
+        saved = result.synops_saved * mw_conversion_factor
+        label = '.' if result.label is None else result.label
+        print(label, power, f'({result.timesteps_used} steps, {saved} saved)')
+        return
+
+    with profiler.record():
+        out = net(batch)
     maxval, pred_label = torch.max(out.sum(0), dim=0)
-    power = net.get_synops(0)['SynOps'].sum() * mw_conversion_factor
-    
+    label = pred_label.item() if maxval > THR else '.'
+
     # return out.sum(0).cpu().numpy()
-    THR = 30
-    if maxval > THR:
-        print(pred_label.item(), power)
+    # power is only measured on profiled batches, i.e. every PROFILE_EVERY-th
+    if profiler.was_profiled:
+        print(label, profiler.last_synops.sum() * mw_conversion_factor)
     else:
-        print('.', power)
+        print(label)
 
 
-while True:
-    process_batch()
+try:
+    while True:
+        process_batch()
+except KeyboardInterrupt:
+    profiler.to_csv('layer_profile.csv')
 
 
 # fig, ax = plt.subplots()
@@ -0,0 +1,85 @@
+# Confidence-based early exit for live DVS predictions: time steps of a batch
+# are fed to the spiking network a few at a time and the remaining ones are
+# skipped as soon as the output spike counts give a confident decision.
+
+from typing import NamedTuple, Optional
+
+import numpy as np
+import torch
+from torch import nn
+
+from scripts.synops import SynOpCounter
+
+
+class EarlyExitResult(NamedTuple):
+    # Predicted class, or `None` if the counts never became confident
+    label: Optional[int]
+    # Output spike counts per class, accumulated over the simulated time steps
+    counts: np.ndarray
+    # Number of simulated time steps
+    timesteps_used: int
+    # Synaptic operations of the simulated time steps
+    synops: float
+    # Estimated synaptic operations of the skipped time steps
+    synops_saved: float
+
+
+class EarlyExitClassifier:
+    """
+    EarlyExitClassifier - Feed the time steps of a batch to a spiking network in
+                          chunks of `step` time steps, accumulating output
+                          spike counts. Stop as soon as the leading class has
+                          more than `threshold` spikes and leads the runner-up
+                          by at least `margin` spikes. With `margin=0` and no
+                          early decision this is the same as thresholding the
+                          summed output of the full batch. The network state is
+                          not reset, so that it carries over to the next batch.
+                          Synop counting hooks are only attached to the
+                          network during a call.
+    """
+
+    def __init__(
+        self, net: nn.Module, threshold: float = 30, margin: float = 0, step: int = 1
+    ):
+        if step < 1:
+            raise ValueError("EarlyExitClassifier: `step` must be at least 1.")
+        self.net = net
+        self.threshold = threshold
+        self.margin = margin
+        self.step = step
+
+    def is_confident(self, counts: torch.Tensor) -> bool:
+        """
+        is_confident - Check whether accumulated `counts` allow a decision.
+        """
+        if counts.numel() > 1:
+            top, second = torch.topk(counts, 2).values
+        else:
+            top, second = counts[0], 0
+        return bool(top > self.threshold and top - second >= self.margin)
+
+    def __call__(self, batch: torch.Tensor) -> EarlyExitResult:
+        """
+        __call__ - Classify `batch` with early exit.
+        :param batch:  Input with time as first dimension
+        :return:
+            `EarlyExitResult`
+        """
+        num_timesteps = batch.shape[0]
+        if num_timesteps == 0:
+            return EarlyExitResult(None, np.zeros(0), 0, 0.0, 0.0)
+        counts = None
+        label = None
+        with torch.no_grad(), SynOpCounter(self.net) as counter:
+            for t_start in range(0, num_timesteps, self.step):
+                out = self.net(batch[t_start : t_start + self.step]).flatten(1)
+                counts = out.sum(0) if counts is None else counts + out.sum(0)
+                if self.is_confident(counts):
+                    label = int(counts.argmax())
+                    break
+            synops = float(counter.pop().sum())
+        timesteps_used = min(t_start + self.step, num_timesteps)
+        synops_saved = synops / timesteps_used * (num_timesteps - timesteps_used)
+        return EarlyExitResult(
+            label, counts.cpu().numpy(), timesteps_used, synops, synops_saved
+        )
@@ -0,0 +1,234 @@
+# Export a pruned, weight-quantized version of the DVS `MNISTClassifier` for
+# CPU deployment and benchmark it against the float network.
+#
+# Usage (from the DVS_demo folder):
+#     python -m scripts.export_model --weights mnist_net_saved.pth --out mnist_net_int8.pth
+
+from typing import Dict, Optional, Tuple
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+from scripts.frame_dataset import cached_frame_loader
+from scripts.model import FINAL_MAP_SIZE, MNISTClassifier, to_snn
+from scripts.synops import SynOpCounter
+
+# - Indices of the synaptic layers within `MNISTClassifier.seq`
+CONV_LAYERS = (0, 3, 6)
+LINEAR_LAYERS = (11, 13)
+
+
+def prune_channels(
+    model: MNISTClassifier, rel_threshold: float = 1e-2
+) -> MNISTClassifier:
+    """
+    prune_channels - Remove convolutional channels and hidden units whose
+                     weights are close to zero, together with the weights that
+                     read from them in the following layer.
+    :param model:          Trained model
+    :param rel_threshold:  Channels whose L2 weight norm is below `rel_threshold`
+                           times the largest norm in the same layer are removed.
+    :return:
+        New `MNISTClassifier` with fewer channels
+    """
+    seq = model.seq
+    keep = []
+    for idx in CONV_LAYERS + LINEAR_LAYERS[:1]:
+        norms = seq[idx].weight.detach().flatten(1).norm(dim=1)
+        is_kept = norms >= rel_threshold * norms.max()
+        keep.append(torch.nonzero(is_kept).flatten())
+
+    pruned = MNISTClassifier(
+        channels=tuple(len(k) for k in keep[:3]), hidden=len(keep[3])
+    )
+    with torch.no_grad():
+        keep_in = torch.arange(seq[0].in_channels)
+        for idx, keep_out in zip(CONV_LAYERS, keep[:3]):
+            pruned.seq[idx].weight[:] = seq[idx].weight[keep_out][:, keep_in]
+            keep_in = keep_out
+        # - Flattened features are ordered by channel, then by position
+        keep_features = (
+            keep_in[:, None] * FINAL_MAP_SIZE + torch.arange(FINAL_MAP_SIZE)
+        ).flatten()
+        lin_hidden, lin_out = LINEAR_LAYERS
+        pruned.seq[lin_hidden].weight[:] = seq[lin_hidden].weight[keep[3]][
+            :, keep_features
+        ]
+        pruned.seq[lin_out].weight[:] = seq[lin_out].weight[:, keep[3]]
+    return pruned
+
+
+def quantize_weights(
+    model: nn.Module, num_bits: int = 8, quantum: Optional[float] = None
+) -> Tuple[Dict[str, torch.Tensor], Dict[str, float]]:
+    """
+    quantize_weights - Symmetric per-layer quantization of all weights.
+    :param model:     Model whose weights are quantized
+    :param num_bits:  Bit width of the integer weights. Default: 8
+    :param quantum:   If `None`, each layer's largest weight is mapped to the
+                      largest integer. Otherwise weights become integer
+                      multiples of `quantum`, which should be a fraction of the
+                      spiking threshold (e.g. `threshold / 64`), clipped to the
+                      integer range.
+    :return:
+        Dict with integer weights (int8 or int16) for each parameter name
+        Dict with the scale (float value of one integer step) for each name
+    """
+    max_int = 2 ** (num_bits - 1) - 1
+    dtype = torch.int8 if num_bits <= 8 else torch.int16
+    int_weights = {}
+    scales = {}
+    for name, weight in model.state_dict().items():
+        if quantum is None:
+            scale = max(weight.abs().max().item(), 1e-12) / max_int
+        else:
+            scale = quantum
+        int_weights[name] = (
+            torch.round(weight / scale).clamp(-max_int, max_int).to(dtype)
+        )
+        scales[name] = scale
+    return int_weights, scales
+
+
+def dequantize(
+    int_weights: Dict[str, torch.Tensor], scales: Dict[str, float]
+) -> Dict[str, torch.Tensor]:
+    """
+    dequantize - Float state dict from integer weights and their scales.
+    """
+    return {name: w.float() * scales[name] for name, w in int_weights.items()}
+
+
+def save_quantized(
+    path, model: MNISTClassifier, int_weights: Dict[str, torch.Tensor], scales
+):
+    """
+    save_quantized - Save integer weights, scales and the (pruned) architecture.
+    """
+    torch.save(
+        {
+            "channels": model.channels,
+            "hidden": model.hidden,
+            "int_weights": int_weights,
+            "scales": scales,
+        },
+        path,
+    )
+
+
+def load_quantized(path) -> MNISTClassifier:
+    """
+    load_quantized - Load a checkpoint written by `save_quantized` into a float
+                     `MNISTClassifier` with dequantized weights.
+    """
+    checkpoint = torch.load(path, map_location="cpu")
+    model = MNISTClassifier(
+        channels=checkpoint["channels"], hidden=checkpoint["hidden"]
+    )
+    model.load_state_dict(dequantize(checkpoint["int_weights"], checkpoint["scales"]))
+    return model
+
+
+def evaluate_ann(model: nn.Module, dataloader) -> float:
+    """
+    evaluate_ann - Fraction of correctly classified frames for the analog model.
+    """
+    model.eval()
+    num_correct = 0
+    num_total = 0
+    with torch.no_grad():
+        for images, labels in dataloader:
+            predictions = model(images).argmax(1)
+            num_correct += (predictions == labels).sum().item()
+            num_total += labels.numel()
+    return num_correct / num_total
+
+
+def benchmark_snn(
+    model: MNISTClassifier, frames: torch.Tensor, labels: torch.Tensor, n_timesteps: int
+) -> Dict[str, float]:
+    """
+    benchmark_snn - Convert `model` to a spiking network and present each frame
+                    for `n_timesteps` time steps, split evenly over the steps.
+    :return:
+        Dict with accuracy, mean latency per frame (ms) and mean synaptic
+        operations per frame
+    """
+    net = to_snn(model)
+    num_correct = 0
+    latencies = []
+    synops = []
+    with SynOpCounter(net) as counter, torch.no_grad():
+        for frame, label in zip(frames, labels):
+            inp = frame.unsqueeze(0).repeat(n_timesteps, 1, 1, 1) / n_timesteps
+            net.reset_states()
+            t_start = time.perf_counter()
+            out = net(inp)
+            latencies.append(time.perf_counter() - t_start)
+            synops.append(counter.pop().sum())
+            num_correct += int(out.sum(0).argmax().item() == label.item())
+    return {
+        "accuracy": num_correct / len(labels),
+        "latency_ms": 1000 * float(np.mean(latencies)),
+        "synops": float(np.mean(synops)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prune and quantize the DVS MNISTClassifier"
+    )
+    parser.add_argument("--weights", default="mnist_net_saved.pth")
+    parser.add_argument("--out", default="mnist_net_int8.pth")
+    parser.add_argument("--data", default="./train")
+    parser.add_argument("--num-bits", type=int, default=8)
+    parser.add_argument(
+        "--quantum",
+        type=float,
+        default=None,
+        help="Quantize to multiples of this value (fraction of threshold 1.0)",
+    )
+    parser.add_argument("--prune-threshold", type=float, default=1e-2)
+    parser.add_argument("--snn-samples", type=int, default=200)
+    parser.add_argument("--timesteps", type=int, default=10)
+    args = parser.parse_args()
+
+    model = MNISTClassifier()
+    model.load_state_dict(torch.load(args.weights, map_location="cpu"))
+    model.eval()
+
+    pruned = prune_channels(model, args.prune_threshold)
+    int_weights, scales = quantize_weights(pruned, args.num_bits, args.quantum)
+    save_quantized(args.out, pruned, int_weights, scales)
+    exported = load_quantized(args.out)
+    exported.eval()
+    print(
+        f"Channels {model.channels} -> {exported.channels}, hidden units {model.hidden} -> {exported.hidden}"
+    )
+
+    # - Re-validate on the training frames and benchmark the spiking networks
+    dataloader = cached_frame_loader(args.data, shuffle=False, augment=False)
+    subset = torch.randperm(len(dataloader.dataset))[: args.snn_samples]
+    frames, labels = dataloader.dataset[subset.tolist()]
+    results = {}
+    for name, mdl, path in (
+        ("float", model, args.weights),
+        ("exported", exported, args.out),
+    ):
+        results[name] = {
+            "size_kB": os.path.getsize(path) / 1024,
+            "ann_accuracy": evaluate_ann(mdl, dataloader),
+            **benchmark_snn(mdl, frames, labels, args.timesteps),
+        }
+
+    print(f"\n{'':10}" + "".join(f"{key:>14}" for key in results["float"]))
+    for name, res in results.items():
+        print(f"{name:10}" + "".join(f"{val:14.4g}" for val in res.values()))
+
+
+if __name__ == "__main__":
+    main()
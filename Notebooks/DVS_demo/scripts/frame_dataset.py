@@ -0,0 +1,185 @@
+# Training frames for the DVS classifier, decoded once into a uint8 memory-mapped
+# array and augmented per batch with tensor operations instead of per image with
+# PIL transforms.
+#
+# Replaces in the notebooks:
+#     train_dataset = ImageFolder(root=FOLDER, transform=transform)
+#     train_dataloader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
+# by
+#     train_dataloader = cached_frame_loader(FOLDER, batch_size=BATCH_SIZE)
+
+from typing import List, Optional, Sequence, Tuple, Union
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.nn import functional as F
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler
+from torch.utils.data import SequentialSampler
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def _list_images(folder: Path) -> Tuple[List[str], List[Path], List[int]]:
+    # - Same class and file order as `torchvision.datasets.ImageFolder`
+    classes = sorted(d.name for d in folder.iterdir() if d.is_dir())
+    files = []
+    labels = []
+    for label, cls in enumerate(classes):
+        for fn in sorted((folder / cls).rglob("*")):
+            if fn.suffix.lower() in IMAGE_EXTENSIONS:
+                files.append(fn)
+                labels.append(label)
+    return classes, files, labels
+
+
+def _decode(fn: Path) -> np.ndarray:
+    from PIL import Image
+
+    # - First channel, as `ToTensor()(image)[0]` in the notebooks
+    with Image.open(fn) as image:
+        return np.asarray(image.convert("RGB"))[..., 0]
+
+
+def build_frame_cache(
+    folder: Union[str, Path],
+    cache_dir: Union[str, Path, None] = None,
+    num_workers: int = 4,
+) -> Path:
+    """
+    build_frame_cache - Decode all images of an `ImageFolder`-style directory
+                        into `frames.npy` (uint8, [#frames x height x width])
+                        and `labels.npy`. The cache is only rebuilt if the list
+                        of image files has changed.
+    :param folder:       Directory with one sub-directory of images per class
+    :param cache_dir:    Where to store the cache. Default: `<folder>_cache`
+    :param num_workers:  Number of processes for decoding
+    :return:
+        Path to the cache directory
+    """
+    folder = Path(folder)
+    cache_dir = Path(cache_dir or folder.with_name(folder.name + "_cache"))
+    classes, files, labels = _list_images(folder)
+    listing = "\n".join(str(fn.relative_to(folder)) for fn in files)
+
+    path_listing = cache_dir / "files.txt"
+    if path_listing.exists() and path_listing.read_text() == listing:
+        return cache_dir
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    first = _decode(files[0])
+    frames = np.lib.format.open_memmap(
+        cache_dir / "frames.npy",
+        mode="w+",
+        dtype=np.uint8,
+        shape=(len(files), *first.shape),
+    )
+    with Pool(num_workers) as pool:
+        for idx, frame in enumerate(pool.imap(_decode, files, chunksize=256)):
+            frames[idx] = frame
+    frames.flush()
+    del frames
+    np.save(cache_dir / "labels.npy", np.array(labels, dtype=np.int64))
+    (cache_dir / "classes.txt").write_text("\n".join(classes))
+    # - Written last, so that an interrupted build is never taken as valid
+    path_listing.write_text(listing)
+    print(f"Cached {len(files)} frames from {folder} in {cache_dir}")
+    return cache_dir
+
+
+def random_affine(
+    images: torch.Tensor,
+    scale: Tuple[float, float] = (0.6, 1.0),
+    translate: Tuple[float, float] = (0.2, 0.2),
+    generator: Optional[torch.Generator] = None,
+) -> torch.Tensor:
+    """
+    random_affine - Batched counterpart of
+                    `RandomAffine(0, scale=scale, translate=translate)`: each
+                    image is scaled about its center and shifted by up to
+                    `translate` times its size, with nearest-neighbour sampling.
+    :param images:     Float tensor of shape [batch x channels x height x width]
+    :param scale:      Range of scaling factors
+    :param translate:  Maximum shift as fraction of width and height
+    :param generator:  Optional random number generator
+    :return:
+        Transformed images, same shape as `images`
+    """
+    batch, __, height, width = images.shape
+    factors = torch.empty(batch).uniform_(*scale, generator=generator)
+    # - Integer pixel shifts, normalized to the [-1, 1] grid coordinates
+    shifts = torch.empty(batch, 2).uniform_(-1, 1, generator=generator)
+    shifts *= torch.tensor([translate[0] * width, translate[1] * height])
+    shifts = shifts.round() * torch.tensor([2.0 / width, 2.0 / height])
+
+    theta = torch.zeros(batch, 2, 3)
+    theta[:, 0, 0] = 1 / factors
+    theta[:, 1, 1] = 1 / factors
+    theta[:, :, 2] = -shifts / factors[:, None]
+    grid = F.affine_grid(theta.to(images.device), images.shape, align_corners=False)
+    return F.grid_sample(images, grid, mode="nearest", align_corners=False)
+
+
+class CachedFrameDataset(Dataset):
+    """
+    CachedFrameDataset - Dataset over the frame cache from `build_frame_cache`.
+                         Items are whole batches: indexing with a list of
+                         indices returns a float tensor of shape
+                         [batch x 1 x height x width] with pixel values in
+                         0..255, and a label tensor. Use with `batch_size=None`
+                         and a `BatchSampler`, as in `cached_frame_loader`.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], augment: bool = True):
+        self.cache_dir = Path(cache_dir)
+        self.augment = augment
+        self.labels = torch.from_numpy(np.load(self.cache_dir / "labels.npy"))
+        self.classes = (self.cache_dir / "classes.txt").read_text().split("\n")
+        # - Opened lazily, so that each worker process maps the file itself
+        self._frames = None
+
+    @property
+    def frames(self) -> np.ndarray:
+        if self._frames is None:
+            self._frames = np.load(self.cache_dir / "frames.npy", mmap_mode="r")
+        return self._frames
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, indices: Sequence[int]) -> Tuple[torch.Tensor, torch.Tensor]:
+        indices = np.asarray(indices)
+        # - Sorted reads are contiguous on disk wherever possible
+        order = np.argsort(indices)
+        frames = np.empty((len(indices), *self.frames.shape[1:]), np.uint8)
+        frames[order] = self.frames[indices[order]]
+        images = torch.from_numpy(frames).unsqueeze(1).float()
+        if self.augment:
+            images = random_affine(images)
+        return images, self.labels[indices]
+
+
+def cached_frame_loader(
+    folder: Union[str, Path],
+    batch_size: int = 256,
+    shuffle: bool = True,
+    augment: bool = True,
+    num_workers: int = 2,
+    cache_dir: Union[str, Path, None] = None,
+) -> DataLoader:
+    """
+    cached_frame_loader - `DataLoader` over the training frames in `folder`,
+                          building the frame cache first if necessary. Each
+                          worker loads and augments whole batches.
+    """
+    cache_dir = build_frame_cache(folder, cache_dir)
+    dataset = CachedFrameDataset(cache_dir, augment=augment)
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(
+        dataset,
+        sampler=BatchSampler(sampler, batch_size=batch_size, drop_last=False),
+        batch_size=None,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+    )
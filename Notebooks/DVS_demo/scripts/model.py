@@ -0,0 +1,62 @@
+from typing import Tuple
+
+from torch import nn
+
+# - Size of the input frames and of the feature maps after the last pooling layer
+INPUT_SHAPE = (1, 64, 64)
+FINAL_MAP_SIZE = 6 * 6
+
+# - Arguments for converting the model with `sinabs.from_torch.from_model`
+SNN_KWARGS = dict(
+    input_shape=INPUT_SHAPE,
+    threshold=1.0,
+    membrane_subtract=1.0,
+    threshold_low=-5.0,
+)
+
+
+class MNISTClassifier(nn.Module):
+    """
+    MNISTClassifier - Convolutional network for DVS digit frames. The number of
+                      channels per convolutional layer and of hidden units can
+                      be reduced, e.g. for pruned versions of the network.
+    """
+
+    def __init__(self, channels: Tuple[int, int, int] = (8, 32, 16), hidden: int = 32):
+        super().__init__()
+        self.channels = tuple(channels)
+        self.hidden = hidden
+
+        self.seq = nn.Sequential(*[
+            nn.Conv2d(in_channels=1, out_channels=channels[0],
+                      kernel_size=(3, 3), bias=False),
+            nn.ReLU(),
+            nn.AvgPool2d(kernel_size=(2, 2), stride=(2, 2)),
+            nn.Conv2d(in_channels=channels[0], out_channels=channels[1],
+                      kernel_size=(3, 3), bias=False),
+            nn.ReLU(),
+            nn.AvgPool2d(kernel_size=(2, 2), stride=(2, 2)),
+            nn.Conv2d(in_channels=channels[1], out_channels=channels[2],
+                      kernel_size=(3, 3), bias=False),
+            nn.ReLU(),
+            nn.AvgPool2d(kernel_size=(2, 2), stride=(2, 2)),
+            nn.Dropout2d(0.5),
+            nn.Flatten(),
+            nn.Linear(channels[2] * FINAL_MAP_SIZE, hidden, bias=False),
+            nn.ReLU(),
+            nn.Linear(hidden, 10, bias=False),
+            nn.ReLU(),
+        ])
+
+    def forward(self, x):
+        return self.seq(x)
+
+
+def to_snn(model: MNISTClassifier):
+    """
+    to_snn - Convert `model` to a spiking network with the same settings as in
+             the notebooks and `mnist_dvs_live.py`.
+    """
+    from sinabs.from_torch import from_model
+
+    return from_model(model.seq, **SNN_KWARGS)
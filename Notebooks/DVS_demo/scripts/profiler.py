@@ -0,0 +1,245 @@
+# Low-overhead per-layer profiling of a sinabs network: synaptic operations,
+# output spikes, sparsity and wall time of each layer, accumulated over a
+# rolling window of (optionally sub-sampled) forward passes.
+
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import csv
+import json
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+from scripts.synops import SYNAPTIC_LAYERS, layer_fanout, spiking_model
+
+SUMMARY_COLUMNS = [
+    "layer",
+    "synops",
+    "synops_share",
+    "energy_mJ",
+    "spikes",
+    "sparsity",
+    "time_ms",
+    "time_share",
+]
+
+
+def is_spiking_layer(module: nn.Module) -> bool:
+    """
+    is_spiking_layer - Stateful sinabs layers provide `reset_states`, plain
+                       torch layers do not.
+    """
+    return hasattr(module, "reset_states") and not list(module.children())
+
+
+class LayerProfiler:
+    """
+    LayerProfiler - Profile each stage of a spiking network. A stage is a
+                    synaptic (convolutional or linear) layer together with all
+                    layers up to the next synaptic layer, e.g. `Conv2d ->
+                    SpikingLayer -> AvgPool2d`. For every profiled forward pass
+                    the synaptic operations, output spikes, sparsity (fraction
+                    of silent outputs) and wall time of each stage are stored.
+                    Only every `every`-th pass is profiled; hooks return
+                    immediately on all other passes. Statistics are kept for
+                    the last `window` profiled passes.
+    """
+
+    def __init__(
+        self,
+        net: nn.Module,
+        every: int = 1,
+        window: int = 100,
+        synop_power: Optional[float] = None,
+        sync_cuda: bool = True,
+    ):
+        """
+        :param net:          Spiking network, e.g. from `sinabs.from_torch.from_model`
+        :param every:        Profile only every `every`-th forward pass. Default: 1
+        :param window:       Number of profiled passes kept for statistics. Default: 100
+        :param synop_power:  Energy per synaptic operation in mJ. If not `None`,
+                             summaries include the energy per forward pass.
+        :param sync_cuda:    Synchronize CUDA before taking time stamps, so that
+                             wall times are attributed to the correct stage.
+        """
+        if every < 1 or window < 1:
+            raise ValueError("LayerProfiler: `every` and `window` must be at least 1.")
+        self.every = every
+        self.synop_power = synop_power
+        self.records = deque(maxlen=window)
+        self.num_passes = 0
+        # Whether the latest pass was profiled
+        self.was_profiled = False
+        self._active = False
+        self._handles = []
+        self._sync = sync_cuda and torch.cuda.is_available()
+
+        # - Group leaf modules into stages, each starting with a synaptic layer
+        self.layer_names: List[str] = []
+        stages: List[List[nn.Module]] = []
+        for name, module in spiking_model(net).named_modules():
+            if isinstance(module, SYNAPTIC_LAYERS):
+                self.layer_names.append(name)
+                stages.append([module])
+            elif stages and not list(module.children()):
+                stages[-1].append(module)
+
+        self.fanouts = np.array([layer_fanout(stage[0]) for stage in stages])
+        num_stages = len(stages)
+        self._events = np.zeros(num_stages)
+        self._spikes = np.zeros(num_stages)
+        self._silent = np.zeros(num_stages)
+        self._outputs = np.zeros(num_stages)
+        self._t_start = np.zeros(num_stages)
+        self._time = np.zeros(num_stages)
+
+        for idx, stage in enumerate(stages):
+            self._register(stage[0].register_forward_pre_hook, self._hook_start, idx)
+            self._register(stage[-1].register_forward_hook, self._hook_stop, idx)
+            for module in stage[1:]:
+                if is_spiking_layer(module):
+                    self._register(module.register_forward_hook, self._hook_spk, idx)
+
+    def _register(self, register, hook, idx_stage: int):
+        self._handles.append(register(lambda *args: hook(idx_stage, *args)))
+
+    def _timestamp(self) -> float:
+        if self._sync:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _hook_start(self, idx_stage, module, inputs):
+        if self._active:
+            self._events[idx_stage] += inputs[0].detach().sum().item()
+            self._t_start[idx_stage] = self._timestamp()
+
+    def _hook_stop(self, idx_stage, module, inputs, output):
+        if self._active:
+            self._time[idx_stage] += self._timestamp() - self._t_start[idx_stage]
+
+    def _hook_spk(self, idx_stage, module, inputs, output):
+        if self._active:
+            output = output.detach()
+            self._spikes[idx_stage] += output.sum().item()
+            self._silent[idx_stage] += (output == 0).sum().item()
+            self._outputs[idx_stage] += output.numel()
+
+    @contextmanager
+    def record(self):
+        """
+        record - Context manager around a forward pass. Profiles the pass if it
+                 is due according to `every`.
+
+        Example:
+            with profiler.record():
+                out = net(batch)
+        """
+        self._active = self.num_passes % self.every == 0
+        self.was_profiled = self._active
+        self.num_passes += 1
+        if self._active:
+            for stats in (self._events, self._spikes, self._silent, self._outputs):
+                stats[:] = 0
+            self._time[:] = 0
+        try:
+            yield
+        finally:
+            if self._active:
+                self._active = False
+                with np.errstate(invalid="ignore"):
+                    sparsity = self._silent / self._outputs
+                self.records.append(
+                    {
+                        "synops": self._events * self.fanouts,
+                        "spikes": self._spikes.copy(),
+                        "sparsity": sparsity,
+                        "time_ms": self._time * 1000,
+                    }
+                )
+
+    @property
+    def last_synops(self) -> Optional[np.ndarray]:
+        """
+        last_synops - Synaptic operations per stage of the latest profiled pass,
+                      or `None` if no pass has been profiled yet.
+        """
+        return self.records[-1]["synops"] if self.records else None
+
+    def summary(self) -> List[Dict[str, Union[str, float]]]:
+        """
+        summary - Mean statistics per stage over the profiled passes in the
+                  rolling window. `synops_share` and `time_share` are the
+                  fractions of the network totals for which each stage accounts.
+        :return:
+            List with one dict per stage, keys as in `SUMMARY_COLUMNS`
+        """
+        if not self.records:
+            return []
+        means = {
+            key: np.nanmean([rec[key] for rec in self.records], axis=0)
+            for key in self.records[0]
+        }
+        synops_share = means["synops"] / max(means["synops"].sum(), 1)
+        time_share = means["time_ms"] / max(means["time_ms"].sum(), 1e-12)
+        rows = []
+        for idx, name in enumerate(self.layer_names):
+            energy = (
+                np.nan
+                if self.synop_power is None
+                else means["synops"][idx] * self.synop_power
+            )
+            values = [
+                name,
+                means["synops"][idx],
+                synops_share[idx],
+                energy,
+                means["spikes"][idx],
+                means["sparsity"][idx],
+                means["time_ms"][idx],
+                time_share[idx],
+            ]
+            rows.append(
+                {
+                    col: val if isinstance(val, str) else float(val)
+                    for col, val in zip(SUMMARY_COLUMNS, values)
+                }
+            )
+        return rows
+
+    def to_csv(self, path: Union[str, Path]):
+        """
+        to_csv - Write `summary` to a CSV file with one row per stage.
+        """
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.summary())
+
+    def to_json(self, path: Union[str, Path]):
+        """
+        to_json - Write `summary` together with the number of profiled passes to
+                  a JSON file.
+        """
+        content = {
+            "num_passes": self.num_passes,
+            "num_profiled": len(self.records),
+            "every": self.every,
+            "layers": [
+                {k: (None if v != v else v) for k, v in row.items()}
+                for row in self.summary()
+            ],
+        }
+        with open(path, "w") as f:
+            json.dump(content, f, indent=2)
+
+    def remove(self):
+        """
+        remove - Remove all hooks from the network.
+        """
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
@@ -0,0 +1,98 @@
+# Count synaptic operations of a spiking network with forward hooks, per layer
+# and per time step, instead of querying the layer statistics after each pass.
+
+from typing import List
+
+import numpy as np
+import torch
+from torch import nn
+
+# - Layers whose input events each trigger `layer_fanout` synaptic operations
+SYNAPTIC_LAYERS = (nn.Conv2d, nn.Linear)
+
+
+def layer_fanout(layer: nn.Module) -> float:
+    """
+    layer_fanout - Number of synaptic operations triggered by a single input
+                   event to `layer`.
+    :param layer:  Convolutional or linear layer
+    :return:
+        Number of synaptic operations per input event
+    """
+    if isinstance(layer, nn.Conv2d):
+        kernel_h, kernel_w = layer.kernel_size
+        stride_h, stride_w = layer.stride
+        return layer.out_channels * kernel_h * kernel_w / (stride_h * stride_w)
+    elif isinstance(layer, nn.Linear):
+        return float(layer.out_features)
+    else:
+        raise TypeError(f"layer_fanout: Layer type {type(layer)} is not supported.")
+
+
+def spiking_model(net: nn.Module) -> nn.Module:
+    """
+    spiking_model - Return the spiking part of a network produced by
+                    `sinabs.from_torch.from_model`, or `net` itself if it
+                    does not hold a separate spiking model.
+    """
+    return getattr(net, "spiking_model", net)
+
+
+class SynOpCounter:
+    """
+    SynOpCounter - Record the input events of each synaptic layer of a spiking
+                   network during forward passes and convert them to synaptic
+                   operations per layer and time step. The first dimension of
+                   the network input is treated as time, as in sinabs.
+    """
+
+    def __init__(self, net: nn.Module):
+        self.layer_names: List[str] = []
+        fanouts = []
+        self._handles = []
+        self._events: List[List[torch.Tensor]] = []
+        for name, layer in spiking_model(net).named_modules():
+            if isinstance(layer, SYNAPTIC_LAYERS):
+                self.layer_names.append(name)
+                fanouts.append(layer_fanout(layer))
+                self._events.append([])
+                self._handles.append(
+                    layer.register_forward_pre_hook(
+                        self._make_hook(len(self._events) - 1)
+                    )
+                )
+        self.fanouts = np.array(fanouts)
+
+    def _make_hook(self, idx_layer: int):
+        def hook(module, inputs):
+            # - Keep per-time-step event counts on the device until `pop` is called
+            self._events[idx_layer].append(inputs[0].detach().flatten(1).sum(1))
+
+        return hook
+
+    def pop(self) -> np.ndarray:
+        """
+        pop - Return synaptic operations recorded since the last call and clear them.
+        :return:
+            2D-array of synaptic operations with shape [#layers x #time steps]
+        """
+        if not self._events or not self._events[0]:
+            return np.zeros((len(self.layer_names), 0))
+        events = torch.stack([torch.cat(evts) for evts in self._events])
+        for evts in self._events:
+            evts.clear()
+        return events.cpu().numpy() * self.fanouts[:, None]
+
+    def remove(self):
+        """
+        remove - Remove the hooks from the network.
+        """
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.remove()
@@ -0,0 +1,215 @@
+# Sliding-window inference of a sinabs network over DVS recordings of arbitrary
+# length. Events are binned lazily, chunk by chunk, so that neither the binned
+# recording nor the network output ever has to be held in memory as a whole.
+
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+import torch
+from torch import nn
+
+from scripts.synops import SynOpCounter
+
+TIMESTEP_LENGTH = 10  # ms
+FRAME_SHAPE = (64, 64)
+
+
+class EventBinner:
+    """
+    EventBinner - Bin DVS events into frames of `timestep_length` ms on demand.
+                  Bins are identical to those of
+                  `np.histogramdd((t, x, y), bins=(np.arange(t.min(), t.max(), 1000 * timestep_length), 64, 64))`
+                  but any range of bins can be produced without binning the
+                  whole recording. Timestamps `t` (in us) must be sorted.
+    """
+
+    def __init__(
+        self,
+        t: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        timestep_length: float = TIMESTEP_LENGTH,
+        frame_shape: Tuple[int, int] = FRAME_SHAPE,
+    ):
+        self.t = t
+        self.x = x
+        self.y = y
+        self.frame_shape = frame_shape
+        self.edges = np.arange(t[0], t[-1], 1000 * timestep_length)
+        # - Spatial bins span the full recording, as for `np.histogramdd`
+        self.range_xy = ((x.min(), x.max()), (y.min(), y.max()))
+
+    def __len__(self) -> int:
+        return max(self.edges.size - 1, 0)
+
+    def get_frames(self, start: int, stop: int) -> np.ndarray:
+        """
+        get_frames - Return binned events for the time bins `start` to `stop`.
+        :param start:  Index of first time bin
+        :param stop:   Index after last time bin
+        :return:
+            3D-array of event counts with shape [#bins x height x width]
+        """
+        stop = min(stop, len(self))
+        # - The final edge of the recording is inclusive, inner edges are not
+        side_stop = "right" if stop == len(self) else "left"
+        idx_start = np.searchsorted(self.t, self.edges[start], side="left")
+        idx_stop = np.searchsorted(self.t, self.edges[stop], side=side_stop)
+        events = slice(idx_start, idx_stop)
+        return np.histogramdd(
+            (self.t[events], self.x[events], self.y[events]),
+            bins=(self.edges[start : stop + 1], *self.frame_shape),
+            range=(None, *self.range_xy),
+        )[0]
+
+
+class WindowBatch(NamedTuple):
+    # Index of the first time bin of each window
+    starts: np.ndarray
+    # Output spike counts summed over each window, shape [#windows x #classes]
+    outputs: np.ndarray
+    # Predicted class for each window
+    predictions: np.ndarray
+    # Synaptic operations per window and layer, shape [#windows x #layers]
+    synops: np.ndarray
+
+
+class WindowedInference:
+    """
+    WindowedInference - Run a spiking network over overlapping windows of
+                        `window_length` time bins that start every `hop` bins.
+                        With `carry_state` the network state is carried across
+                        windows and each bin is simulated only once; otherwise
+                        the network is reset before every window. Windows are
+                        processed in mini-batches of `batch_windows` windows.
+    """
+
+    def __init__(
+        self,
+        net: nn.Module,
+        window_length: int,
+        hop: Optional[int] = None,
+        carry_state: bool = False,
+        batch_windows: int = 16,
+    ):
+        if hop is None:
+            hop = window_length
+        if window_length < 1 or hop < 1 or batch_windows < 1:
+            raise ValueError(
+                "WindowedInference: `window_length`, `hop` and `batch_windows` "
+                + "must be at least 1."
+            )
+        self.net = net
+        self.window_length = window_length
+        self.hop = hop
+        self.carry_state = carry_state
+        self.batch_windows = batch_windows
+        self.device = next(net.parameters()).device
+
+    def num_windows(self, num_bins: int) -> int:
+        """
+        num_windows - Number of complete windows within `num_bins` time bins.
+        """
+        if num_bins < self.window_length:
+            return 0
+        return (num_bins - self.window_length) // self.hop + 1
+
+    def iter_windows(self, binner: EventBinner) -> Iterator[WindowBatch]:
+        """
+        iter_windows - Run the network over the recording in `binner` and yield
+                       the results in batches of windows. Only the bins of the
+                       current mini-batch are held in memory.
+        :param binner:  `EventBinner` (or any object with `__len__` and
+                        `get_frames(start, stop)`) providing the input frames.
+        :return:
+            Iterator over `WindowBatch` objects
+        """
+        with SynOpCounter(self.net) as counter, torch.no_grad():
+            if self.carry_state:
+                yield from self._iter_carry(binner, counter)
+            else:
+                yield from self._iter_reset(binner, counter)
+
+    def run(self, binner: EventBinner) -> WindowBatch:
+        """
+        run - Run the network over the full recording and collect the per-window
+              results (one row per window) of `iter_windows`.
+        """
+        batches = list(self.iter_windows(binner))
+        if not batches:
+            with SynOpCounter(self.net) as counter:
+                num_layers = len(counter.layer_names)
+            return WindowBatch(
+                np.zeros(0, int),
+                np.zeros((0, 0)),
+                np.zeros(0, int),
+                np.zeros((0, num_layers)),
+            )
+        return WindowBatch(*(np.concatenate(field) for field in zip(*batches)))
+
+    def _evolve(self, frames: np.ndarray, counter: SynOpCounter):
+        inp = torch.as_tensor(frames, dtype=torch.float, device=self.device)
+        out = self.net(inp.unsqueeze(1))
+        return out.flatten(1).cpu().numpy(), counter.pop().T
+
+    def _iter_reset(self, binner, counter: SynOpCounter) -> Iterator[WindowBatch]:
+        num_windows = self.num_windows(len(binner))
+        for first in range(0, num_windows, self.batch_windows):
+            starts = np.arange(first, min(first + self.batch_windows, num_windows))
+            starts *= self.hop
+            # - Bin all windows of the batch at once, overlapping bins only once
+            frames = binner.get_frames(starts[0], starts[-1] + self.window_length)
+            outputs = []
+            synops = []
+            for start in starts - starts[0]:
+                self.net.reset_states()
+                out, syn = self._evolve(
+                    frames[start : start + self.window_length], counter
+                )
+                outputs.append(out.sum(0))
+                synops.append(syn.sum(0))
+            outputs = np.array(outputs)
+            yield WindowBatch(starts, outputs, outputs.argmax(1), np.array(synops))
+        self.net.reset_states()
+
+    def _iter_carry(self, binner, counter: SynOpCounter) -> Iterator[WindowBatch]:
+        num_bins = len(binner)
+        num_windows = self.num_windows(num_bins)
+        chunk_size = self.batch_windows * self.hop
+        self.net.reset_states()
+        # - Per-bin outputs and synops from the first bin of the next pending window on
+        buffer_start = 0
+        buffer_out = None
+        buffer_syn = None
+        next_window = 0
+        for chunk_start in range(0, num_bins, chunk_size):
+            if next_window >= num_windows:
+                break
+            chunk_stop = min(chunk_start + chunk_size, num_bins)
+            out, syn = self._evolve(binner.get_frames(chunk_start, chunk_stop), counter)
+            if buffer_out is None:
+                buffer_out, buffer_syn = out, syn
+            else:
+                buffer_out = np.concatenate((buffer_out, out))
+                buffer_syn = np.concatenate((buffer_syn, syn))
+            # - Windows that are complete after this chunk
+            last_window = min(
+                num_windows, (chunk_stop - self.window_length) // self.hop + 1
+            )
+            if last_window > next_window:
+                starts = np.arange(next_window, last_window) * self.hop
+                # - Cumulative sums give window sums for any overlap
+                cum_out = np.r_[np.zeros((1, out.shape[1])), np.cumsum(buffer_out, 0)]
+                cum_syn = np.r_[np.zeros((1, syn.shape[1])), np.cumsum(buffer_syn, 0)]
+                idcs_start = starts - buffer_start
+                idcs_stop = idcs_start + self.window_length
+                outputs = cum_out[idcs_stop] - cum_out[idcs_start]
+                synops = cum_syn[idcs_stop] - cum_syn[idcs_start]
+                yield WindowBatch(starts, outputs, outputs.argmax(1), synops)
+                next_window = last_window
+                # - Drop bins that no pending window needs anymore
+                discard = min(next_window * self.hop, chunk_stop) - buffer_start
+                buffer_out = buffer_out[discard:]
+                buffer_syn = buffer_syn[discard:]
+                buffer_start += discard
+        self.net.reset_states()
@@ -0,0 +1,142 @@
+# On-the-fly augmentation of ECG batches. A batch (signal [#time steps x
+# #leads] with its target raster and beat annotations) is transformed as a
+# whole with array operations:
+#     - amplitude scaling, one factor per segment and lead
+#     - additive Gaussian noise
+#     - baseline wander, a sum of slow sinusoids per lead
+#     - time warping, a smooth monotonic resampling of the time axis, applied
+#       to signal, target and beat boundaries alike
+# Random numbers are drawn from a generator seeded with (seed, batch index),
+# so every batch is reproducible and repeated passes over the same beats see
+# different augmentations without storing augmented copies.
+#
+# Usage:
+#     augment = ECGAugmentation(seed=1)
+#     for batch in data_loader.get_batch_generator(15000, 1000, augment, repeat=3):
+#         ...
+
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+DT = 0.002_778  # Time step of the ECG signal, as in `dataloader`
+
+
+class ECGAugmentation:
+    """
+    ECGAugmentation - Random, batch-wise transformations of ECG signals. Set a
+                      parameter to 0 to disable the corresponding transformation.
+    """
+
+    def __init__(
+        self,
+        scale_std: float = 0.1,
+        noise_std: float = 0.02,
+        wander_amplitude: float = 0.05,
+        wander_freq: Tuple[float, float] = (0.05, 0.5),
+        num_wander_components: int = 3,
+        warp_strength: float = 0.05,
+        warp_interval: float = 1.0,
+        seed: Optional[int] = None,
+        dt: float = DT,
+    ):
+        """
+        :param scale_std:         Std. dev. of the log amplitude scaling factors
+        :param noise_std:         Std. dev. of the additive noise
+        :param wander_amplitude:  Amplitude of each baseline wander component
+        :param wander_freq:       Range of baseline wander frequencies in Hz
+        :param num_wander_components:  Number of sinusoids per lead
+        :param warp_strength:     Std. dev. of the relative local speed of time
+        :param warp_interval:     Time in s between points of the warp function
+        :param seed:              Base seed; batch `i` uses seed (`seed`, `i`)
+        :param dt:                Time step of the signal in s
+        """
+        self.scale_std = scale_std
+        self.noise_std = noise_std
+        self.wander_amplitude = wander_amplitude
+        self.wander_freq = wander_freq
+        self.num_wander_components = num_wander_components
+        self.warp_strength = warp_strength
+        self.warp_interval = warp_interval
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.dt = dt
+
+    def __call__(
+        self,
+        signal: np.ndarray,
+        target: np.ndarray,
+        annotations: pd.DataFrame,
+        i_batch: int,
+    ) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+        """
+        __call__ - Augment one batch.
+        :param signal:       ECG signal [#time steps x #leads]
+        :param target:       Target raster [#time steps x #classes]
+        :param annotations:  Beat annotations of the batch with `idx_start_new`
+                             and `idx_end_new` relative to the whole draw
+        :param i_batch:      Index of the batch, for seeding
+        :return:
+            Augmented signal, target and annotations
+        """
+        rng = np.random.default_rng([self.seed, i_batch])
+        num_timesteps, num_leads = signal.shape
+        signal = np.asarray(signal, dtype=float)
+
+        if self.warp_strength > 0:
+            signal, target, annotations = self._warp(signal, target, annotations, rng)
+        if self.scale_std > 0:
+            # - One factor per segment and lead, repeated over the segment's time steps
+            seg_ids = annotations.segment_id if "segment_id" in annotations else None
+            idx_offset = annotations.idx_start_new.iloc[0]
+            if seg_ids is None:
+                seg_starts = np.array([0])
+            else:
+                is_new = np.r_[True, seg_ids.to_numpy()[1:] != seg_ids.to_numpy()[:-1]]
+                seg_starts = annotations.idx_start_new.to_numpy()[is_new] - idx_offset
+            seg_lengths = np.diff(np.r_[seg_starts, num_timesteps])
+            factors = np.exp(
+                rng.normal(0, self.scale_std, (seg_starts.size, num_leads))
+            )
+            signal = signal * np.repeat(factors, seg_lengths, axis=0)
+        if self.wander_amplitude > 0:
+            times = np.arange(num_timesteps) * self.dt
+            shape = (self.num_wander_components, num_leads)
+            freqs = rng.uniform(*self.wander_freq, shape)
+            phases = rng.uniform(0, 2 * np.pi, shape)
+            # - [#time steps x #components x #leads], summed over components
+            wander = np.sin(2 * np.pi * freqs * times[:, None, None] + phases)
+            signal = signal + self.wander_amplitude * wander.sum(axis=1)
+        if self.noise_std > 0:
+            signal = signal + rng.normal(0, self.noise_std, signal.shape)
+        return signal, target, annotations
+
+    def _warp(
+        self,
+        signal: np.ndarray,
+        target: np.ndarray,
+        annotations: pd.DataFrame,
+        rng: np.random.Generator,
+    ):
+        # - Monotonic map from output time step to (fractional) input time step,
+        #   from random local speeds at knots, keeping the number of time steps
+        num_timesteps = len(signal)
+        knot_step = max(int(self.warp_interval / self.dt), 1)
+        num_knots = num_timesteps // knot_step + 2
+        speed = np.clip(1 + rng.normal(0, self.warp_strength, num_knots), 0.1, None)
+        knots_out = np.linspace(0, num_timesteps - 1, num_knots)
+        knots_in = np.r_[0, np.cumsum(speed[:-1])]
+        knots_in *= (num_timesteps - 1) / knots_in[-1]
+        source = np.interp(np.arange(num_timesteps), knots_out, knots_in)
+        i_low = np.floor(source).astype(int)
+        i_high = np.minimum(i_low + 1, num_timesteps - 1)
+        frac = (source - i_low)[:, None]
+        signal = signal[i_low] * (1 - frac) + signal[i_high] * frac
+        target = target[np.round(source).astype(int)]
+        # - Beat boundaries: first output step that maps to or beyond the old boundary
+        idx_offset = annotations.idx_start_new.iloc[0]
+        annotations = annotations.copy()
+        for col in ("idx_start_new", "idx_end_new"):
+            old = annotations[col].to_numpy() - idx_offset
+            annotations[col] = np.searchsorted(source, old) + idx_offset
+        return signal, target, annotations
@@ -0,0 +1,252 @@
+# Structured bias sets for the DynapSE. A bias set is a table with one row per
+# bias (`group`, `name`, `fine`, `coarse`), stored as JSON with one bias per
+# line, so that bias files can be diffed and reviewed, or as NPZ. Scripts of
+# `set_bias` calls such as `network/biases.py` are parsed without executing
+# them, so no hardware or `CtxDynapse` is needed for conversion or validation.
+#
+# Convert the bias script once
+#     python -m scripts.bias_sets network/biases.py network/biases.json
+# and apply it with
+#     loader = BiasLoader()
+#     loader.apply("network/biases.json")  # Only changed biases are sent
+
+from typing import Union
+from pathlib import Path
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+CORES_PER_CHIP = 4
+NUM_FINE = 256
+NUM_COARSE = 8
+
+# - Currents in A of the coarse bias values 0 to 7; fine values scale linearly up to 255
+COARSE_CURRENTS = np.array(
+    [15e-12, 105e-12, 820e-12, 6.5e-9, 50e-9, 0.4e-6, 3.2e-6, 24e-6]
+)
+
+BIAS_NAMES = [
+    "IF_AHTAU_N",
+    "IF_AHTHR_N",
+    "IF_AHW_P",
+    "IF_BUF_P",
+    "IF_CASC_N",
+    "IF_DC_P",
+    "IF_NMDA_N",
+    "IF_RFR_N",
+    "IF_TAU1_N",
+    "IF_TAU2_N",
+    "IF_THR_N",
+    "NPDPIE_TAU_F_P",
+    "NPDPIE_TAU_S_P",
+    "NPDPIE_THR_F_P",
+    "NPDPIE_THR_S_P",
+    "NPDPII_TAU_F_P",
+    "NPDPII_TAU_S_P",
+    "NPDPII_THR_F_P",
+    "NPDPII_THR_S_P",
+    "PS_WEIGHT_EXC_F_N",
+    "PS_WEIGHT_EXC_S_N",
+    "PS_WEIGHT_INH_F_N",
+    "PS_WEIGHT_INH_S_N",
+    "PULSE_PWLK_P",
+    "R2R_P",
+]
+
+COLUMNS = ["group", "name", "fine", "coarse"]
+
+_BIAS_PATTERN = re.compile(
+    r"get_bias_groups\(\)\[(\d+)\]\.set_bias\(\s*[\"'](\w+)[\"']\s*,"
+    + r"\s*(\d+)\s*,\s*(\d+)\s*\)"
+)
+
+
+def bias_current(fine: Union[int, np.ndarray], coarse: Union[int, np.ndarray]):
+    """
+    bias_current - Approximate current in A of a bias with given fine and coarse value.
+    """
+    return COARSE_CURRENTS[coarse] * np.asarray(fine) / NUM_FINE
+
+
+def _as_table(biases: pd.DataFrame) -> pd.DataFrame:
+    # - Later entries override earlier ones, as on the chip; sorted by group and name
+    biases = biases[COLUMNS].astype(
+        {"group": int, "name": str, "fine": int, "coarse": int}
+    )
+    biases = biases.drop_duplicates(["group", "name"], keep="last")
+    return biases.sort_values(["group", "name"]).reset_index(drop=True)
+
+
+def parse_biases(path: Union[str, Path]) -> pd.DataFrame:
+    """
+    parse_biases - Read a bias script of `set_bias` calls, as written by
+                   `DynapseControl.save_biases`, without executing it.
+    :param path:  Path to the bias script
+    :return:
+        DataFrame with columns `group`, `name`, `fine`, `coarse`, `chip`,
+        `core` and `current` (in A), one row per bias
+    """
+    with open(path) as f:
+        matches = _BIAS_PATTERN.findall(f.read())
+    if not matches:
+        raise ValueError(f"parse_biases: No `set_bias` calls found in {path}.")
+    return with_currents(_as_table(pd.DataFrame(matches, columns=COLUMNS)))
+
+
+def with_currents(biases: pd.DataFrame) -> pd.DataFrame:
+    """
+    with_currents - Add `chip`, `core` and `current` columns to a bias table.
+    """
+    biases = biases.copy()
+    biases["chip"] = biases["group"] // CORES_PER_CHIP
+    biases["core"] = biases["group"] % CORES_PER_CHIP
+    biases["current"] = bias_current(biases["fine"], biases["coarse"])
+    return biases
+
+
+def validate_bias_set(biases: pd.DataFrame):
+    """
+    validate_bias_set - Check value ranges and bias names and that every group
+                        defines the same biases. Raises a `ValueError` otherwise.
+    """
+    problems = []
+    if not biases["fine"].between(0, NUM_FINE - 1).all():
+        problems.append(f"fine values must be between 0 and {NUM_FINE - 1}")
+    if not biases["coarse"].between(0, NUM_COARSE - 1).all():
+        problems.append(f"coarse values must be between 0 and {NUM_COARSE - 1}")
+    unknown = set(biases["name"]) - set(BIAS_NAMES)
+    if unknown:
+        problems.append(f"unknown bias names {sorted(unknown)}")
+    names_per_group = biases.groupby("group")["name"].apply(frozenset)
+    if names_per_group.nunique() > 1:
+        problems.append("groups define different sets of biases")
+    if problems:
+        raise ValueError("validate_bias_set: " + "; ".join(problems) + ".")
+
+
+def save_bias_set(biases: pd.DataFrame, path: Union[str, Path]):
+    """
+    save_bias_set - Store a bias table as `.json` (one bias per line, sorted by
+                    group and name) or `.npz`.
+    """
+    path = Path(path)
+    biases = _as_table(biases)
+    validate_bias_set(biases)
+    if path.suffix == ".npz":
+        np.savez(
+            path,
+            group=biases["group"].to_numpy(np.int16),
+            name=biases["name"].to_numpy(str),
+            fine=biases["fine"].to_numpy(np.uint8),
+            coarse=biases["coarse"].to_numpy(np.uint8),
+        )
+    elif path.suffix == ".json":
+        lines = [
+            "  " + json.dumps(dict(zip(COLUMNS, row)))
+            for row in biases.itertuples(index=False)
+        ]
+        with open(path, "w") as f:
+            f.write("[\n" + ",\n".join(lines) + "\n]\n")
+    else:
+        raise ValueError("save_bias_set: `path` must end with `.json` or `.npz`.")
+
+
+def load_bias_set(path: Union[str, Path]) -> pd.DataFrame:
+    """
+    load_bias_set - Load a bias set from `.json`, `.npz` or a bias script (`.py`).
+    :return:
+        DataFrame as returned by `parse_biases`
+    """
+    path = Path(path)
+    if path.suffix == ".py":
+        return parse_biases(path)
+    if path.suffix == ".npz":
+        with np.load(path) as content:
+            biases = pd.DataFrame({col: content[col] for col in COLUMNS})
+    elif path.suffix == ".json":
+        with open(path) as f:
+            biases = pd.DataFrame(json.load(f), columns=COLUMNS)
+    else:
+        raise ValueError("load_bias_set: Unsupported file type " + path.suffix)
+    biases = _as_table(biases)
+    validate_bias_set(biases)
+    return with_currents(biases)
+
+
+def diff_bias_sets(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """
+    diff_bias_sets - Biases of `new` that are missing from or differ in `old`.
+    :return:
+        Rows of `new` (columns `group`, `name`, `fine`, `coarse`) with
+        additional columns `fine_old` and `coarse_old` (NaN if missing in `old`)
+    """
+    merged = _as_table(new).merge(
+        _as_table(old), on=["group", "name"], how="left", suffixes=("", "_old")
+    )
+    changed = (merged["fine"] != merged["fine_old"]) | (
+        merged["coarse"] != merged["coarse_old"]
+    )
+    return merged[changed].reset_index(drop=True)
+
+
+class BiasLoader:
+    """
+    BiasLoader - Apply bias sets to the chip, group by group. The last applied
+                 values are remembered, so that switching between bias sets
+                 only sends the biases that change.
+    """
+
+    def __init__(self, model=None):
+        """
+        :param model:  Object with a `get_bias_groups` method, such as
+                       `CtxDynapse.model`. Default: `CtxDynapse.model`
+        """
+        if model is None:
+            import CtxDynapse
+
+            model = CtxDynapse.model
+        self.model = model
+        self.applied = pd.DataFrame(columns=COLUMNS)
+
+    def apply(self, biases: Union[str, Path, pd.DataFrame], force: bool = False) -> int:
+        """
+        apply - Set all biases of a bias set that differ from the last applied values.
+        :param biases:  Bias set or path to a file for `load_bias_set`
+        :param force:   Send all biases, e.g. after the chip has been reset
+        :return:
+            Number of biases that have been sent
+        """
+        if not isinstance(biases, pd.DataFrame):
+            biases = load_bias_set(biases)
+        biases = _as_table(biases)
+        delta = biases if force else diff_bias_sets(self.applied, biases)
+        # - Bias groups are fetched once instead of for each bias
+        bias_groups = self.model.get_bias_groups()
+        for group, group_biases in delta.groupby("group"):
+            bias_group = bias_groups[group]
+            for name, fine, coarse in zip(
+                group_biases["name"], group_biases["fine"], group_biases["coarse"]
+            ):
+                bias_group.set_bias(name, int(fine), int(coarse))
+        self.applied = _as_table(pd.concat([self.applied, biases]))
+        return len(delta)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert a DynapSE bias script or bias set to .json or .npz"
+    )
+    parser.add_argument("source", help="Bias script (.py), .json or .npz file")
+    parser.add_argument("target", help="Output file (.json or .npz)")
+    args = parser.parse_args()
+    biases = load_bias_set(args.source)
+    save_bias_set(biases, args.target)
+    print(f"Wrote {len(biases)} biases of {biases['group'].nunique()} groups")
+
+
+if __name__ == "__main__":
+    main()
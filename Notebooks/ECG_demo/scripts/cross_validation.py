@@ -0,0 +1,295 @@
+# Patient-wise cross-validation of the software ECG network. The MIT-BIH
+# recordings (one per patient) are partitioned into K folds, so that training
+# and test beats never come from the same patient. Each fold - drawing beats,
+# simulating the network, fitting the ridge-regression readout and scoring the
+# held-out recordings - runs in its own worker process. The ECG signal is
+# memory-mapped, so all workers share the same pages instead of holding
+# copies, and the wall time is roughly the total work divided by the number
+# of workers.
+#
+# Usage (from the ECG_demo folder):
+#     python -m scripts.cross_validation --folds 5 --workers 5
+# or
+#     result = cross_validate(num_folds=5, num_beats_train=15000)
+#     result.per_class
+
+from typing import List, NamedTuple, Optional, Sequence, Union
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts import recordings
+from scripts.dataloader import (
+    ECGDataLoader,
+    omit_recordings,
+    params_signal,
+    use_targets,
+)
+from scripts.network import software_network
+from scripts.scoring import DT, class_metrics, score_beats
+
+
+class CVResult(NamedTuple):
+    # Recording IDs of the test set of each fold
+    folds: List[np.ndarray]
+    # Metrics of each fold and class, with columns `fold`, `class`, `support`,
+    # `sensitivity`, `ppv`, `mean_latency`, plus `train_time` and `test_time` in s
+    per_fold: pd.DataFrame
+    # Confusion matrix summed over folds [true class x predicted class]
+    confusion: np.ndarray
+    # Metrics of each class, pooled over all folds
+    per_class: pd.DataFrame
+
+
+def recording_folds(
+    annotations: pd.DataFrame,
+    num_folds: int,
+    omit: Sequence[int] = omit_recordings,
+    targets: Optional[Sequence[int]] = None,
+    seed: Optional[int] = None,
+) -> List[np.ndarray]:
+    """
+    recording_folds - Partition recording IDs into folds such that beats of
+                      each anomaly class are spread as evenly as possible.
+                      Recordings are assigned greedily, those with the most
+                      anomalous beats first, each to the fold that has the
+                      fewest beats of the recording's most frequent anomaly.
+    :param annotations:  Beat annotations with columns `recording` and `target`
+    :param num_folds:    Number of folds
+    :param omit:         Recordings that are not used
+    :param targets:      Anomaly classes to balance. Default: all non-zero targets
+    :param seed:         Seed for breaking ties between recordings
+    :return:
+        List with sorted array of recording IDs for each fold
+    """
+    annotations = annotations[~annotations.recording.isin(omit)]
+    counts = pd.crosstab(annotations.recording, annotations.target)
+    counts = counts.drop(columns=0, errors="ignore")
+    if targets is not None:
+        counts = counts.reindex(columns=targets, fill_value=0)
+    if num_folds < 2 or num_folds > len(counts):
+        raise ValueError(
+            f"recording_folds: `num_folds` must be between 2 and {len(counts)}."
+        )
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(counts))
+    counts = counts.iloc[order]
+    counts = counts.iloc[np.argsort(-counts.sum(axis=1).to_numpy(), kind="stable")]
+
+    fold_counts = np.zeros((num_folds, counts.shape[1]), int)
+    fold_sizes = np.zeros(num_folds, int)
+    folds = [[] for _ in range(num_folds)]
+    for recording, row in zip(counts.index, counts.to_numpy()):
+        if row.any():
+            # - Fewest beats of this recording's main anomaly, then fewest recordings
+            key = fold_counts[:, np.argmax(row)] * (len(counts) + 1) + fold_sizes
+        else:
+            key = fold_sizes
+        fold = int(np.argmin(key))
+        folds[fold].append(recording)
+        fold_counts[fold] += row
+        fold_sizes[fold] += 1
+    return [np.sort(np.array(f)) for f in folds]
+
+
+def _restrict(params: dict, recording_ids: Sequence[int]) -> dict:
+    # - `params_signal` with beats limited to the given recordings
+    params = dict(params)
+    params["include"] = {
+        **params.get("include", {}),
+        "recording": [int(r) for r in recording_ids],
+    }
+    return params
+
+
+def _fit_length(samples: np.ndarray, num_timesteps: int) -> np.ndarray:
+    # - Readout traces may differ from the input by one time step
+    samples = samples[:num_timesteps]
+    if len(samples) < num_timesteps:
+        samples = np.pad(samples, ((0, num_timesteps - len(samples)), (0, 0)))
+    return samples
+
+
+def run_fold(
+    fold: int,
+    train_recordings: Sequence[int],
+    test_recordings: Sequence[int],
+    num_beats_train: int = 15000,
+    num_beats_test: Optional[int] = None,
+    batchsize: int = 1000,
+    regularize: float = 0.1,
+    threshold: Union[float, np.ndarray] = 0.5,
+    params: Optional[dict] = None,
+    load_path: Union[str, Path, None] = None,
+    network_path: Union[str, Path, None] = None,
+    num_cores: Optional[int] = 1,
+    seed: Optional[int] = None,
+) -> dict:
+    """
+    run_fold - Train the readout on beats of `train_recordings` and score it
+               on beats of `test_recordings`.
+    :param num_beats_train:  Number of training beats, drawn as in the notebook
+    :param num_beats_test:   Number of test beats. `None`: all beats of the
+                             test recordings with the natural class frequencies
+    :param params:           Arguments for `provide_data`. Default: `params_signal`
+    :param load_path:        Folder with the ECG data. Default: `recordings.ecg_dir`
+    :param network_path:     Folder with the network files
+    :param num_cores:        CPU cores for the NEST reservoir of this fold
+    :return:
+        Dict with `fold`, `confusion`, `labels`, `latency`, `train_time` and
+        `test_time`
+    """
+    # - Beat selection draws from the global random generators
+    np.random.seed(seed)
+    random.seed(seed)
+    params = params_signal if params is None else params
+    if load_path is None:
+        load_path = recordings.ecg_dir
+    annotations, ecg_data = recordings.load_from_file(load_path, mmap_mode="r")
+    ecg_recordings = recordings.ECGRecordings(annotations, ecg_data)
+    net = software_network(network_path, num_cores=num_cores)
+
+    # - Train readout
+    t_start = time.time()
+    loader = ECGDataLoader(ecg_recordings, _restrict(params, train_recordings))
+    for batch in loader.get_batch_generator(num_beats_train, batchsize):
+        output = net.evolve(batch.input)
+        net.readout.train_rr(
+            batch.target,
+            output["reservoir"],
+            is_first=batch.is_first,
+            is_last=batch.is_last,
+            regularize=regularize,
+        )
+    net.reset_all()
+    train_time = time.time() - t_start
+
+    # - Test on held-out recordings
+    t_start = time.time()
+    # - With `num_beats_test=None`, `target_probs` only defines the classes
+    loader = ECGDataLoader(ecg_recordings, _restrict(params, test_recordings))
+    test_annotations = []
+    test_output = []
+    for batch in loader.get_batch_generator(num_beats_test, batchsize):
+        output = net.evolve(batch.input)["readout"].samples
+        test_output.append(_fit_length(output, batch.num_timesteps))
+        test_annotations.append(batch.annotations)
+    net.reset_all()
+    result = score_beats(
+        np.concatenate(test_output),
+        pd.concat(test_annotations),
+        map_target=loader.remap_targets,
+        threshold=threshold,
+        dt=DT,
+    )
+    return {
+        "fold": fold,
+        "confusion": result.confusion,
+        "labels": result.beats["label"].to_numpy(),
+        "latency": result.beats["latency"].to_numpy(),
+        "train_time": train_time,
+        "test_time": time.time() - t_start,
+    }
+
+
+def cross_validate(
+    num_folds: int = 5,
+    num_workers: Optional[int] = None,
+    seed: Optional[int] = None,
+    load_path: Union[str, Path, None] = None,
+    **kwargs,
+) -> CVResult:
+    """
+    cross_validate - Patient-wise K-fold cross-validation, one worker process per fold.
+    :param num_folds:    Number of folds
+    :param num_workers:  Number of worker processes. Default: `num_folds`
+    :param seed:         Seed for fold assignment and beat selection
+    :param load_path:    Folder with the ECG data. Default: `recordings.ecg_dir`
+    :param kwargs:       Further arguments for `run_fold`
+    :return:
+        `CVResult`
+    """
+    if load_path is None:
+        load_path = recordings.ecg_dir
+    annotations, _ = recordings.load_from_file(load_path, mmap_mode="r")
+    params = kwargs.get("params") or params_signal
+    omit = params["exclude"].get("recording", [])
+    # - Balance only the anomaly classes that the readout models
+    targets = [t for t in params["include"].get("target", use_targets) if t != 0]
+    folds = recording_folds(
+        annotations, num_folds, omit=omit, targets=targets, seed=seed
+    )
+    all_recordings = np.concatenate(folds)
+    fold_seeds = np.random.SeedSequence(seed).generate_state(num_folds)
+
+    with ProcessPoolExecutor(max_workers=num_workers or num_folds) as executor:
+        futures = [
+            executor.submit(
+                run_fold,
+                fold=i_fold,
+                train_recordings=np.setdiff1d(all_recordings, test_recordings),
+                test_recordings=test_recordings,
+                load_path=load_path,
+                seed=int(fold_seeds[i_fold]),
+                **kwargs,
+            )
+            for i_fold, test_recordings in enumerate(folds)
+        ]
+        fold_results = [future.result() for future in futures]
+
+    # - Aggregate
+    per_fold = []
+    for res in fold_results:
+        metrics = class_metrics(res["confusion"], res["labels"], res["latency"])
+        metrics = metrics.reset_index()
+        metrics.insert(0, "fold", res["fold"])
+        metrics["train_time"] = res["train_time"]
+        metrics["test_time"] = res["test_time"]
+        per_fold.append(metrics)
+    confusion = sum(res["confusion"] for res in fold_results)
+    per_class = class_metrics(
+        confusion,
+        np.concatenate([res["labels"] for res in fold_results]),
+        np.concatenate([res["latency"] for res in fold_results]),
+    )
+    return CVResult(folds, pd.concat(per_fold, ignore_index=True), confusion, per_class)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Patient-wise cross-validation of the ECG network"
+    )
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--beats-train", type=int, default=15000)
+    parser.add_argument("--beats-test", type=int, default=None)
+    parser.add_argument("--cores-per-fold", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="Store per-fold metrics as .csv")
+    args = parser.parse_args()
+
+    t_start = time.time()
+    result = cross_validate(
+        num_folds=args.folds,
+        num_workers=args.workers,
+        seed=args.seed,
+        num_beats_train=args.beats_train,
+        num_beats_test=args.beats_test,
+        num_cores=args.cores_per_fold,
+    )
+    for i_fold, fold in enumerate(result.folds):
+        print(f"Fold {i_fold}: recordings {list(fold)}")
+    print(result.per_class.to_string())
+    print(f"Cross-validation took {time.time() - t_start:.1f} s")
+    if args.output is not None:
+        result.per_fold.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
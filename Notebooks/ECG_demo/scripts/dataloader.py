@@ -1,3 +1,5 @@
+from typing import Callable, Optional
+
 import numpy as np
 from rockpool import TSContinuous
 from scripts import recordings
@@ -21,12 +23,28 @@ params_signal = {
 
 
 class ECGDataLoader:
-    def __init__(self):
-        self.ecg_recordings = recordings.ECGRecordings()
-        self.params = params_signal
+    def __init__(
+        self,
+        ecg_recordings: Optional[recordings.ECGRecordings] = None,
+        params: Optional[dict] = None,
+        dt: float = DT,
+    ):
+        """
+        :param ecg_recordings:  `ECGRecordings` to draw beats from. Default:
+                                load all recordings from file
+        :param params:          Arguments for `ECGRecordings.provide_data`.
+                                Default: `params_signal`
+        :param dt:              Time step of the signal of `ecg_recordings`,
+                                e.g. of a resampled corpus from `load_resampled`
+        """
+        if ecg_recordings is None:
+            ecg_recordings = recordings.ECGRecordings()
+        self.ecg_recordings = ecg_recordings
+        self.params = params_signal if params is None else params
+        self._dt = dt
 
         # - Infer target classes from probabilities
-        target_classes = set(params_signal["target_probs"].keys())
+        target_classes = set(self.params["target_probs"].keys())
 
         self.remap_targets = {k: v for v, k in enumerate(sorted(target_classes))}
         self.target_idcs = {
@@ -36,12 +54,31 @@ class ECGDataLoader:
             tgt: self.ecg_recordings.target_names[tgt] for tgt in self.remap_targets
         }
 
-    def get_batch_generator(self, num_beats: int, batchsize: int):
-
+    def get_batch_generator(
+        self,
+        num_beats: Optional[int],
+        batchsize: int,
+        augment: Optional[Callable] = None,
+        repeat: int = 1,
+    ):
+        """
+        get_batch_generator - Draw beats and yield them in batches of whole segments.
+        :param num_beats:  Number of beats to draw. `None` for all matching beats
+        :param batchsize:  Approximate number of beats per batch
+        :param augment:    If not `None`, function (e.g. `ECGAugmentation`) that
+                           takes signal, target, annotations and batch index of
+                           a batch and returns augmented signal, target and
+                           annotations
+        :param repeat:     Number of passes over the drawn beats. With `augment`,
+                           each pass is augmented differently.
+        """
         # - Get data
         annotations, signal = self.ecg_recordings.provide_data(num_beats, **self.params)
         num_batches = int(np.ceil(annotations.index.size / batchsize))
-        # - Make sure to not divide segments
+        # - Make sure to not divide segments. Draws of all beats
+        #   (`num_beats=None`) have no segments and are split by recording.
+        if "segment_id" not in annotations:
+            annotations["segment_id"] = annotations.recording
         segment_ids = np.unique(annotations.segment_id)
         num_segs_batch = int(np.ceil(segment_ids.size / num_batches))
         idcs_seg_split = np.arange(1, num_batches) * num_segs_batch
@@ -55,16 +92,23 @@ class ECGDataLoader:
         # Will iterate over split annotations
         iterator = np.split(annotations, idcs_split)
 
+        num_batches_total = len(iterator) * repeat
+
         timestep_start = 0
         is_first = True
-        for i_batch, it in enumerate(iterator):
+        for i_batch in range(num_batches_total):
 
-            print(f"\n\tBatch {i_batch + 1} of {num_batches}")
+            print(f"\n\tBatch {i_batch + 1} of {num_batches_total}")
 
-            ann_batch = it
+            ann_batch = iterator[i_batch % len(iterator)]
             signal_batch = signal[
                 ann_batch.idx_start_new.iloc[0] : ann_batch.idx_end_new.iloc[-1]
             ]
+            target_batch = self._get_target(ann_batch)
+            if augment is not None:
+                signal_batch, target_batch, ann_batch = augment(
+                    signal_batch, target_batch, ann_batch, i_batch
+                )
 
             batch = self._create_batch(
                 signal=signal_batch,
@@ -72,7 +116,8 @@ class ECGDataLoader:
                 i_batch=i_batch,
                 timestep_start=timestep_start,
                 is_first=is_first,
-                is_last=i_batch == num_batches - 1,
+                is_last=i_batch == num_batches_total - 1,
+                target=target_batch,
             )
             timestep_start += batch.num_timesteps
             is_first = False
@@ -97,9 +142,16 @@ class ECGDataLoader:
         )
 
     def _create_batch(
-        self, signal, annotations, i_batch, timestep_start, is_first, is_last
+        self,
+        signal,
+        annotations,
+        i_batch,
+        timestep_start,
+        is_first,
+        is_last,
+        target=None,
     ):
-        target_batch = self._get_target(annotations)
+        target_batch = self._get_target(annotations) if target is None else target
 
         return ECGBatch(
             n_id=i_batch,
@@ -109,13 +161,13 @@ class ECGDataLoader:
             timestep_start=timestep_start,
             is_first=is_first,
             is_last=is_last,
-            dt=DT,
+            dt=self.dt,
             target_names=self.target_names,
         )
 
     @property
     def dt(self):
-        return DT
+        return self._dt
 
 
 class ECGBatch:
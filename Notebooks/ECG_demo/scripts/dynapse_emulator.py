@@ -0,0 +1,313 @@
+# Offline emulation of the DynapSE reservoir, as a stand-in for `RecDynapSE`
+# with `DynapseControlExtd` on machines without the chip or `CtxDynapse`.
+#
+# Bias sets (see `bias_sets`) such as `network/biases.py` give per-core tables
+# (bias group i belongs to chip i // 4, core i % 4). Bias currents are mapped to
+# time constants (tau = Q / I), synaptic efficacies and refractory periods of
+# the same IAF model that the software reservoir uses. The charge constants
+# are calibrated such that the reservoir cores of `network/biases.py`
+# reproduce the mean parameters of `scripts/gen_params.py`, so absolute values
+# are approximate, but differences between cores and bias settings carry over.
+#
+# Replaces the hardware cells of the notebook by
+#     reservoir_hw = DynapseEmulator(weights_res_in, weights_rec, neuron_ids,
+#                                    dt=dt_hardware, biases="network/biases.py")
+#     hot_neurons = reservoir_hw.silence_hot_neurons(silence_hot_neurons_dur)
+#     times, channels = reservoir_hw.evolve_events(inp_times, inp_channels, t_stop)
+
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from pathlib import Path
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.bias_sets import (
+    COARSE_CURRENTS,
+    bias_current,
+    load_bias_set,
+    with_currents,
+)
+
+NEURONS_PER_CORE = 256
+CORE_WIDTH = 16  # Neurons are arranged in 16 x 16 squares per core
+
+
+# - Charges in A*s, tau = Q / I, calibrated on the reservoir cores of `network/biases.py`
+Q_MEM = 0.175 * bias_current(121, 1)
+Q_SYN_EXC = 0.4 * bias_current(96, 2)
+Q_SYN_INH = 0.35 * bias_current(104, 2)
+Q_REFR = 0.002 * bias_current(50, 3)
+# - Synaptic efficacy per A of weight bias, as `baseweight_inp_to_rec` for the reservoir cores
+WEIGHT_PER_AMP = 8e-5 / bias_current(138, 7)
+# - DPI gain (threshold over leak current) of the reservoir cores, used as reference
+GAIN_REF = bias_current(145, 1) / bias_current(121, 1)
+# - A DC bias of 1 nA drives the membrane to threshold
+V_THRESH = 0.01
+DC_PER_AMP = V_THRESH / 1e-9
+
+
+def core_parameters(biases: Union[str, Path, pd.DataFrame]) -> pd.DataFrame:
+    """
+    core_parameters - Neuron and synapse parameters of each core.
+    :param biases:  Bias set or path to a file for `load_bias_set`
+    :return:
+        DataFrame indexed by bias group with columns `tau_mem`, `tau_syn_exc`,
+        `tau_syn_inh`, `refractory` (in s), `weight_exc`, `weight_inh`
+        (efficacy per connection), `gain` and `dc`
+    """
+    if not isinstance(biases, pd.DataFrame):
+        biases = load_bias_set(biases)
+    elif "current" not in biases:
+        biases = with_currents(biases)
+    currents = biases.pivot(index="group", columns="name", values="current")
+    # - Avoid division by zero for switched-off leak and refractory biases
+    tiny = COARSE_CURRENTS[0] / 256
+    params = pd.DataFrame(index=currents.index)
+    params["tau_mem"] = Q_MEM / np.maximum(currents["IF_TAU1_N"], tiny)
+    params["tau_syn_exc"] = Q_SYN_EXC / np.maximum(currents["NPDPIE_TAU_F_P"], tiny)
+    params["tau_syn_inh"] = Q_SYN_INH / np.maximum(currents["NPDPII_TAU_F_P"], tiny)
+    params["refractory"] = Q_REFR / np.maximum(currents["IF_RFR_N"], tiny)
+    params["weight_exc"] = WEIGHT_PER_AMP * currents["PS_WEIGHT_EXC_F_N"]
+    params["weight_inh"] = WEIGHT_PER_AMP * currents["PS_WEIGHT_INH_F_N"]
+    params["gain"] = (
+        currents["IF_THR_N"] / np.maximum(currents["IF_TAU1_N"], tiny) / GAIN_REF
+    )
+    params["dc"] = DC_PER_AMP * currents["IF_DC_P"]
+    return params
+
+
+def rectangular_neuron_arrangement(
+    first_neuron: int, num_neurons: int, width: int, core_width: int = CORE_WIDTH
+) -> List[int]:
+    """
+    rectangular_neuron_arrangement - IDs of neurons forming a rectangle of
+                                     `width` columns on the chip, starting at
+                                     `first_neuron`, as in `rockpool.devices`.
+    """
+    height = int(np.ceil(num_neurons / width))
+    ids = [
+        first_neuron + row * core_width + col
+        for row in range(height)
+        for col in range(width)
+    ]
+    return ids[:num_neurons]
+
+
+# - Neuron arrangement of the ECG notebook: input, reservoir I + II, inhibitory
+ECG_ARRANGEMENT = [
+    {"first_neuron": 4, "num_neurons": 128, "width": 8},
+    {"first_neuron": 256, "num_neurons": 256, "width": 16},
+    {"first_neuron": 768, "num_neurons": 512 - 256, "width": 16},
+    {"first_neuron": 516, "num_neurons": 128, "width": 8},
+]
+ECG_VIRTUAL_NEURON_IDS = [1, 2, 3, 12]
+
+
+def ecg_neuron_ids() -> List[int]:
+    """
+    ecg_neuron_ids - Chip neuron IDs of the ECG reservoir, in reservoir order.
+    """
+    neuron_ids = []
+    for rectangle_params in ECG_ARRANGEMENT:
+        neuron_ids += rectangular_neuron_arrangement(**rectangle_params)
+    return neuron_ids
+
+
+class DynapseEmulator:
+    """
+    DynapseEmulator - Reservoir of IAF neurons with exponential excitatory and
+                      inhibitory synapses whose parameters are taken from the
+                      bias group of each neuron's core. Weights are integer
+                      connection counts as on the chip; positive entries use
+                      the excitatory, negative ones the inhibitory synapse of
+                      the target neuron. Spikes arrive with one time step delay.
+    """
+
+    def __init__(
+        self,
+        weights_in: np.ndarray,
+        weights_rec: np.ndarray,
+        neuron_ids: Sequence[int],
+        dt: float = 0.000_1389,
+        biases: Union[str, Path, pd.DataFrame] = "network/biases.py",
+        mismatch: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        :param weights_in:  Input connection counts [#inputs x #neurons]
+        :param weights_rec: Recurrent connection counts [#neurons x #neurons]
+        :param neuron_ids:  Chip neuron ID of each reservoir neuron
+        :param dt:          Time step in s
+        :param biases:      Bias set or path to a file for `load_bias_set`
+        :param mismatch:    Relative std. dev. of the neuron and synapse
+                            parameters, emulating device mismatch
+        :param seed:        Random seed for the mismatch
+        """
+        self.neuron_ids = np.asarray(neuron_ids)
+        self.size = len(self.neuron_ids)
+        if weights_rec.shape != (self.size, self.size) or weights_in.shape[1] != (
+            self.size
+        ):
+            raise ValueError(
+                "DynapseEmulator: Weight shapes do not match number of neurons."
+            )
+        self.dt = dt
+        self.size_in = weights_in.shape[0]
+        groups = self.neuron_ids // NEURONS_PER_CORE
+        self.core_params = core_parameters(biases)
+        missing = set(groups) - set(self.core_params.index)
+        if missing:
+            raise ValueError(
+                f"DynapseEmulator: No biases for groups {sorted(missing)}."
+            )
+        rng = np.random.default_rng(seed)
+        params = {}
+        for name in self.core_params.columns:
+            values = self.core_params[name].to_numpy()[
+                np.searchsorted(self.core_params.index, groups)
+            ]
+            if mismatch > 0 and name != "dc":
+                values = values * np.clip(
+                    1 + mismatch * rng.standard_normal(self.size), 0.1, None
+                )
+            params[name] = values
+        self.params = params
+        self.decay_mem = np.exp(-dt / params["tau_mem"])
+        self.decay_exc = np.exp(-dt / params["tau_syn_exc"])
+        self.decay_inh = np.exp(-dt / params["tau_syn_inh"])
+        self.refractory_steps = np.round(params["refractory"] / dt).astype(int)
+        # - Efficacies of the target neurons' synapses
+        self.w_in_exc = np.clip(weights_in, 0, None) * params["weight_exc"]
+        self.w_in_inh = np.clip(-weights_in, 0, None) * params["weight_inh"]
+        self.w_rec_exc = np.clip(weights_rec, 0, None) * params["weight_exc"]
+        self.w_rec_inh = np.clip(-weights_rec, 0, None) * params["weight_inh"]
+        self.silenced = np.zeros(self.size, bool)
+        self.reset_state()
+
+    def reset_state(self):
+        """
+        reset_state - Reset membrane potentials, synapses and refractory counters.
+        """
+        self.v_mem = np.zeros(self.size)
+        self.i_exc = np.zeros(self.size)
+        self.i_inh = np.zeros(self.size)
+        self.refr = np.zeros(self.size, int)
+        self.spikes_in = np.zeros(self.size_in)
+        self.spikes_rec = np.zeros(self.size)
+
+    def evolve(self, inp: np.ndarray) -> np.ndarray:
+        """
+        evolve - Evolve the reservoir.
+        :param inp:  Input spike counts [#time steps x #inputs]
+        :return:
+            Boolean output spike raster [#time steps x #neurons]
+        """
+        num_steps = len(inp)
+        raster = np.zeros((num_steps, self.size), bool)
+        for step in range(num_steps):
+            self.i_exc = self.i_exc * self.decay_exc + (
+                self.spikes_in @ self.w_in_exc + self.spikes_rec @ self.w_rec_exc
+            )
+            self.i_inh = self.i_inh * self.decay_inh + (
+                self.spikes_in @ self.w_in_inh + self.spikes_rec @ self.w_rec_inh
+            )
+            self.spikes_in = inp[step]
+            active = self.refr == 0
+            drive = self.params["gain"] * (self.i_exc - self.i_inh) + self.params["dc"]
+            v_new = self.v_mem * self.decay_mem + (1 - self.decay_mem) * drive
+            self.v_mem = np.where(active, v_new, self.v_mem)
+            self.refr[~active] -= 1
+            spikes = (self.v_mem >= V_THRESH) & ~self.silenced
+            self.v_mem[spikes] = 0
+            self.refr[spikes] = self.refractory_steps[spikes]
+            self.spikes_rec = spikes.astype(float)
+            raster[step] = spikes
+        return raster
+
+    def evolve_events(
+        self,
+        times: np.ndarray,
+        channels: np.ndarray,
+        t_stop: float,
+        t_start: float = 0.0,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        evolve_events - Evolve the reservoir with input events, e.g. the
+                        `times` and `channels` of the spike encoder's `TSEvent`.
+        :return:
+            Output spike times in s
+            Output spike channels (index into `neuron_ids`)
+        """
+        num_steps = int(np.ceil((t_stop - t_start) / self.dt))
+        steps = np.floor((np.asarray(times) - t_start) / self.dt).astype(int)
+        valid = (steps >= 0) & (steps < num_steps)
+        inp = np.zeros((num_steps, self.size_in))
+        np.add.at(inp, (steps[valid], np.asarray(channels)[valid]), 1)
+        out_steps, out_channels = np.nonzero(self.evolve(inp))
+        return t_start + (out_steps + 1) * self.dt, out_channels
+
+    def silence_hot_neurons(self, duration: float) -> List[int]:
+        """
+        silence_hot_neurons - Evolve without input for `duration` seconds and
+                              silence all neurons that spike, as
+                              `DynapseControl.silence_hot_neurons` does.
+        :return:
+            Chip IDs of silenced neurons
+        """
+        self.reset_state()
+        raster = self.evolve(np.zeros((int(duration / self.dt), self.size_in)))
+        hot = np.any(raster, axis=0)
+        self.silenced |= hot
+        self.reset_state()
+        return self.neuron_ids[hot].tolist()
+
+    def benchmark(self, duration: float = 1.0, rate: float = 50.0, seed=None) -> Dict:
+        """
+        benchmark - Evolve with Poisson input at `rate` Hz per channel.
+        :return:
+            Dict with wall time, real-time factor and mean output rate in Hz
+        """
+        rng = np.random.default_rng(seed)
+        num_steps = int(duration / self.dt)
+        inp = (rng.random((num_steps, self.size_in)) < rate * self.dt).astype(float)
+        self.reset_state()
+        t_start = time.perf_counter()
+        raster = self.evolve(inp)
+        wall_time = time.perf_counter() - t_start
+        self.reset_state()
+        return {
+            "wall_time_s": wall_time,
+            "real_time_factor": wall_time / duration,
+            "mean_rate_hz": raster.sum() / (self.size * duration),
+        }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Emulate the DynapSE ECG reservoir")
+    parser.add_argument("--biases", default="network/biases.py")
+    parser.add_argument("--duration", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(core_parameters(args.biases).to_string())
+    neuron_ids = ecg_neuron_ids()
+    weights_in = np.load("network/weights_res_in.npy")
+    path_rec = Path("network/weights_rec.npy")
+    if path_rec.exists():
+        weights_rec = np.load(path_rec)
+    else:
+        # - Random connectivity with the partition structure of the notebook
+        print(f"{path_rec} not found, using random recurrent connections.")
+        rng = np.random.default_rng(0)
+        weights_rec = (rng.random((len(neuron_ids),) * 2) < 0.05).astype(int)
+        weights_rec[640:] *= -1
+    emulator = DynapseEmulator(
+        weights_in, weights_rec, neuron_ids, biases=args.biases, mismatch=0.15, seed=0
+    )
+    print(emulator.benchmark(args.duration))
+
+
+if __name__ == "__main__":
+    main()
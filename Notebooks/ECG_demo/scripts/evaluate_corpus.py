@@ -0,0 +1,234 @@
+# Evaluation of the trained software network on whole MIT-BIH recordings.
+# Each recording is fed to the network in chunks of fixed duration while the
+# network state is carried over, so memory use depends on the chunk length
+# only. Recordings are distributed over a process pool. For each recording the
+# readout trace is written to `<out_dir>/traces/<recording>.npy`, chunk by
+# chunk, and the scored beats to `<out_dir>/beats/<recording>.csv`. The beat
+# file is written last, so an interrupted run is resumed by calling it again:
+# recordings with a beat file are skipped.
+#
+# Usage (from the ECG_demo folder):
+#     python -m scripts.evaluate_corpus results/corpus --workers 8
+# or
+#     result = evaluate_corpus("results/corpus", num_workers=8)
+#     result.per_class
+
+from typing import NamedTuple, Optional, Sequence, Union
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts import recordings
+from scripts.dataloader import omit_recordings, use_targets
+from scripts.network import network_dir, software_network
+from scripts.resampling import load_resampled, resampled_signal
+from scripts.scoring import DT, class_metrics, confusion_matrix, score_beats
+
+CHUNK_DURATION = 60.0  # Simulated time per chunk in s
+
+
+class CorpusResult(NamedTuple):
+    # One row per recording with number of beats, accuracy and run time in s
+    per_recording: pd.DataFrame
+    # Confusion matrix over all recordings [true class x predicted class]
+    confusion: np.ndarray
+    # Metrics of each class over all recordings
+    per_class: pd.DataFrame
+
+
+def _load_corpus(load_path: Union[str, Path, None], dt: Optional[float]):
+    # - Annotations and memory-mapped signal, resampled if `dt` is given
+    if dt is None:
+        annotations, signal = recordings.load_from_file(
+            recordings.ecg_dir if load_path is None else load_path, mmap_mode="r"
+        )
+        return annotations, signal, DT
+    return load_resampled(dt, load_path)
+
+
+def _write_atomic(df: pd.DataFrame, path: Path):
+    tmp_path = path.with_suffix(".tmp")
+    df.to_csv(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def evaluate_recording(
+    recording: int,
+    out_dir: Union[str, Path],
+    chunk_duration: float = CHUNK_DURATION,
+    threshold: Union[float, np.ndarray] = 0.5,
+    load_path: Union[str, Path, None] = None,
+    network_path: Union[str, Path, None] = None,
+    dt: Optional[float] = None,
+    num_cores: Optional[int] = 1,
+) -> dict:
+    """
+    evaluate_recording - Run one recording through the network and score its beats.
+    :param recording:       Recording ID
+    :param out_dir:         Folder for traces and beat files
+    :param chunk_duration:  Simulated time per chunk in s
+    :param threshold:       Detection threshold for `score_beats`
+    :param load_path:       Folder with the ECG data. Default: `recordings.ecg_dir`
+    :param network_path:    Folder with network and readout weights. Default:
+                            `network_dir`
+    :param dt:              If not `None`, simulate the resampled corpus at this
+                            time step (see `resampling.load_resampled`)
+    :param num_cores:       CPU cores for the NEST reservoir
+    :return:
+        Dict with `recording`, `num_beats`, `accuracy` and `run_time`
+    """
+    t_start = time.time()
+    from rockpool import TSContinuous
+
+    out_dir = Path(out_dir)
+    network_path = Path(network_dir if network_path is None else network_path)
+    annotations, signal, dt = _load_corpus(load_path, dt)
+    annotations = annotations[annotations.recording == recording]
+    idx_first = int(annotations.idx_start.iloc[0])
+    idx_last = int(annotations.idx_end.iloc[-1])
+    num_timesteps = idx_last - idx_first
+
+    net = software_network(network_path, num_cores=num_cores, dt=dt)
+    net.readout.weights = np.load(network_path / "readout_weights.npy")
+    net.readout.bias = np.load(network_path / "readout_bias.npy")
+
+    # - Readout trace is written to disk chunk by chunk
+    trace_path = out_dir / "traces" / f"{recording}.npy"
+    trace = np.lib.format.open_memmap(
+        trace_path,
+        mode="w+",
+        dtype=np.float32,
+        shape=(num_timesteps, net.readout.size),
+    )
+    chunk_size = max(int(round(chunk_duration / dt)), 1)
+    for start in range(0, num_timesteps, chunk_size):
+        stop = min(start + chunk_size, num_timesteps)
+        times = np.arange(start, stop) * dt
+        inp = TSContinuous(
+            times,
+            np.asarray(signal[idx_first + start : idx_first + stop]),
+            t_stop=stop * dt,
+        )
+        output = net.evolve(inp)["readout"].samples[: stop - start]
+        trace[start : start + len(output)] = output
+    trace.flush()
+
+    # - Score beats of the evaluated classes
+    beats = annotations[annotations.target.isin(use_targets)].copy()
+    beats["idx_start_new"] = beats.idx_start - idx_first
+    beats["idx_end_new"] = beats.idx_end - idx_first
+    remap_targets = {k: v for v, k in enumerate(sorted(use_targets))}
+    result = score_beats(trace, beats, remap_targets, threshold=threshold, dt=dt)
+    del trace
+    _write_atomic(result.beats, out_dir / "beats" / f"{recording}.csv")
+    return {
+        "recording": recording,
+        "num_beats": len(beats),
+        "accuracy": result.beats.correct.mean(),
+        "run_time": time.time() - t_start,
+    }
+
+
+def evaluate_corpus(
+    out_dir: Union[str, Path],
+    recording_ids: Optional[Sequence[int]] = None,
+    num_workers: Optional[int] = None,
+    load_path: Union[str, Path, None] = None,
+    **kwargs,
+) -> CorpusResult:
+    """
+    evaluate_corpus - Evaluate all recordings, one task per recording. Recordings
+                      that have already been evaluated in `out_dir` are skipped.
+    :param out_dir:        Folder for traces, beat files and `summary.csv`
+    :param recording_ids:  Recordings to evaluate. Default: all except
+                           `omit_recordings`
+    :param num_workers:    Number of worker processes. Default: number of CPUs
+    :param load_path:      Folder with the ECG data. Default: `recordings.ecg_dir`
+    :param kwargs:         Further arguments for `evaluate_recording`
+    :return:
+        `CorpusResult`
+    """
+    out_dir = Path(out_dir)
+    (out_dir / "traces").mkdir(parents=True, exist_ok=True)
+    (out_dir / "beats").mkdir(parents=True, exist_ok=True)
+    if recording_ids is None:
+        annotations, _ = recordings.load_from_file(
+            recordings.ecg_dir if load_path is None else load_path, mmap_mode="r"
+        )
+        recording_ids = np.setdiff1d(annotations.recording.unique(), omit_recordings)
+    recording_ids = [int(r) for r in recording_ids]
+
+    summary_path = out_dir / "summary.csv"
+    if summary_path.exists():
+        summary = pd.read_csv(summary_path, index_col="recording")
+    else:
+        summary = pd.DataFrame(columns=["num_beats", "accuracy", "run_time"])
+        summary.index.name = "recording"
+    todo = [r for r in recording_ids if not (out_dir / "beats" / f"{r}.csv").exists()]
+    print(f"{len(recording_ids) - len(todo)} recordings done, {len(todo)} to go")
+    if todo and kwargs.get("dt") is not None:
+        # - Create the resampled cache once, not in every worker
+        resampled_signal(kwargs["dt"], load_path)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                evaluate_recording, r, out_dir, load_path=load_path, **kwargs
+            )
+            for r in todo
+        ]
+        for future in futures:
+            res = future.result()
+            recording = res.pop("recording")
+            summary.loc[recording] = res
+            _write_atomic(summary, summary_path)
+            print(f"Recording {recording}: accuracy {res['accuracy']:.3f}")
+
+    # - Pool beats of all requested recordings
+    beats = pd.concat(
+        [
+            pd.read_csv(out_dir / "beats" / f"{r}.csv", index_col=0)
+            for r in recording_ids
+        ]
+    )
+    # - From the beat files, in case a run was interrupted before its summary entry
+    per_recording = beats.groupby("recording").agg(
+        num_beats=("correct", "size"), accuracy=("correct", "mean")
+    )
+    per_recording = per_recording.join(summary["run_time"])
+    labels = beats.label.to_numpy()
+    num_classes = len(use_targets)
+    confusion = confusion_matrix(labels, beats.prediction.to_numpy(), num_classes)
+    per_class = class_metrics(confusion, labels, beats.latency.to_numpy())
+    return CorpusResult(per_recording, confusion, per_class)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Evaluate the ECG network on whole recordings"
+    )
+    parser.add_argument("out_dir", help="Folder for traces and results")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-duration", type=float, default=CHUNK_DURATION)
+    parser.add_argument("--dt", type=float, default=None, help="Resample to this dt")
+    parser.add_argument("--recordings", type=int, nargs="*", default=None)
+    args = parser.parse_args()
+
+    result = evaluate_corpus(
+        args.out_dir,
+        recording_ids=args.recordings,
+        num_workers=args.workers,
+        chunk_duration=args.chunk_duration,
+        dt=args.dt,
+    )
+    print(result.per_class.to_string())
+
+
+if __name__ == "__main__":
+    main()
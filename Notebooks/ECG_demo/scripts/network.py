@@ -0,0 +1,100 @@
+# Software version of the ECG network of the notebook: up/down spike encoder,
+# NEST reservoir and exponential-synapse readout. Building the network in a
+# function allows scripts and worker processes to create their own instances.
+#
+# Usage:
+#     net = software_network()
+#     output = net.evolve(batch.input)
+#     net.readout.train_rr(batch.target, output["reservoir"], ...)
+
+from typing import Optional, Union
+from pathlib import Path
+
+import numpy as np
+
+network_dir = Path(__file__).parent.parent / "network"
+
+# - ECG signal parameters
+DT_ECG = 0.002778
+NUM_ECG_LEADS = 2
+NUM_ANOM_CLASSES = 4
+
+# - Weight scaling for the software simulation
+START_REC = 128
+START_INH = 128 + 512
+BASEWEIGHT_INP = 5e-4
+BASEWEIGHT_EXP_REC = 8e-5
+BASEWEIGHT_REC = 8e-5
+BASEWEIGHT_REC_INH = 8e-5
+BASEWEIGHT_INH = 1e-4
+
+TAU_SYN_READOUT = 0.175
+
+
+def scale_weights(weights_res_in: np.ndarray, weights_rec: np.ndarray):
+    """
+    scale_weights - Scale integer hardware weights to software reservoir weights.
+    :return:
+        Scaled input weights, scaled recurrent weights
+    """
+    weights_res_in_scaled = weights_res_in * BASEWEIGHT_INP
+    weights_rec_scaled = np.array(weights_rec, dtype=float)
+    weights_rec_scaled[:START_REC, START_REC:START_INH] *= BASEWEIGHT_EXP_REC
+    weights_rec_scaled[START_REC:START_INH, START_REC:START_INH] *= BASEWEIGHT_REC
+    weights_rec_scaled[START_REC:START_INH, START_INH:] *= BASEWEIGHT_REC_INH
+    weights_rec_scaled[START_INH:, START_REC:START_INH] *= BASEWEIGHT_INH
+    return weights_res_in_scaled, weights_rec_scaled
+
+
+def software_network(
+    load_path: Union[str, Path, None] = None,
+    num_cores: Optional[int] = None,
+    dt: float = DT_ECG,
+):
+    """
+    software_network - Encoder, reservoir and untrained readout, as in the notebook.
+    :param load_path:  Folder with `weights_res_in.npy`, `weights_rec.npy` and
+                       `kwargs_reservoir.npz`. Default: `network_dir`
+    :param num_cores:  CPU cores for the NEST reservoir. Default: NEST default
+    :param dt:         Time step of the input, encoder and readout. Use the
+                       reservoir time step for input from `load_resampled`.
+    :return:
+        `Network` with layers `spike_encoder`, `reservoir` and `readout`
+    """
+    from rockpool import Network
+    from rockpool.layers import FFUpDown, RecIAFSpkInNest, FFExpSyn
+
+    load_path = Path(network_dir if load_path is None else load_path)
+
+    spike_enc = FFUpDown(
+        weights=NUM_ECG_LEADS,
+        dt=dt,
+        thr_up=0.1,
+        thr_down=0.1,
+        multiplex_spikes=True,
+        name="spike_encoder",
+    )
+
+    weights_res_in, weights_rec = scale_weights(
+        np.load(load_path / "weights_res_in.npy"),
+        np.load(load_path / "weights_rec.npy"),
+    )
+    kwargs_reservoir = dict(np.load(load_path / "kwargs_reservoir.npz"))
+    if num_cores is not None:
+        kwargs_reservoir["num_cores"] = num_cores
+    reservoir = RecIAFSpkInNest(
+        weights_in=weights_res_in,
+        weights_rec=weights_rec,
+        name="reservoir",
+        **kwargs_reservoir,
+    )
+
+    readout = FFExpSyn(
+        weights=np.zeros((reservoir.size, NUM_ANOM_CLASSES)),
+        bias=0,
+        dt=dt,
+        tau_syn=TAU_SYN_READOUT,
+        name="readout",
+    )
+
+    return Network(spike_enc, reservoir, readout, dt=dt)
@@ -0,0 +1,260 @@
+# Online adaptation of the ECG readout with recursive least squares (RLS).
+# Reservoir spikes are filtered with the exponential synapse of the readout,
+# and every time step (or every `update_every`-th) the weights are corrected
+# with a rank-1 update of the inverse correlation matrix P, at O(N^2) cost per
+# update for N reservoir neurons. A forgetting factor below 1 lets the readout
+# follow slow changes such as a new patient or drift of the hardware. Since
+# forgetting inflates P also in directions without input, such as neurons that
+# stay silent for long, the diagonal of P is capped at its initial value, so a
+# long silence neither overflows P nor makes the next spike of such a neuron
+# cause a huge weight jump. Weights,
+# P and the synapse state can be saved and restored at any time, so a deployed
+# detector adapts in place without reprocessing past data.
+#
+# Usage:
+#     detector = OnlineReadout.from_weights(
+#         np.load("network/readout_weights.npy"), np.load("network/readout_bias.npy")
+#     )
+#     output = detector.process(spike_raster, target)  # Predict, then adapt
+#     detector.save("checkpoints/online_readout.npz")
+
+from typing import Optional, Union
+from pathlib import Path
+import os
+
+import numpy as np
+from scipy.signal import lfilter
+
+DT = 0.002_778  # Time step of the readout, as in `dataloader`
+TAU_SYN = 0.175  # Synaptic time constant of the readout, as in the notebook
+
+
+def spike_raster(
+    times: np.ndarray,
+    channels: np.ndarray,
+    num_channels: int,
+    duration: float,
+    dt: float = DT,
+) -> np.ndarray:
+    """
+    spike_raster - Spike counts per time step and channel, e.g. from a
+                   `CachedBatch` of `spike_cache` (with times relative to its start).
+    :return:
+        2D-array [#time steps x `num_channels`]
+    """
+    num_timesteps = int(np.ceil(duration / dt))
+    steps = np.minimum((np.asarray(times) / dt).astype(int), num_timesteps - 1)
+    flat = steps * num_channels + np.asarray(channels, dtype=int)
+    counts = np.bincount(flat, minlength=num_timesteps * num_channels)
+    return counts.reshape(num_timesteps, num_channels)
+
+
+def exp_synapse(
+    raster: np.ndarray,
+    tau_syn: float = TAU_SYN,
+    dt: float = DT,
+    state: Optional[np.ndarray] = None,
+):
+    """
+    exp_synapse - Filter spike counts with an exponential synapse,
+                  x[t] = exp(-dt / tau_syn) * x[t-1] + s[t].
+    :param raster:  Spike counts [#time steps x #neurons]
+    :param state:   Synaptic currents before the first time step. Default: 0
+    :return:
+        Synaptic currents [#time steps x #neurons], currents after the last step
+    """
+    raster = np.asarray(raster, dtype=float)
+    if state is None:
+        state = np.zeros(raster.shape[1])
+    decay = np.exp(-dt / tau_syn)
+    out, _ = lfilter([1.0], [1.0, -decay], raster, axis=0, zi=decay * state[None, :])
+    return out, (out[-1].copy() if len(out) else state)
+
+
+class OnlineReadout:
+    """
+    OnlineReadout - Exponential-synapse readout whose weights are adapted
+                    online with recursive least squares.
+    """
+
+    def __init__(
+        self,
+        num_neurons: int,
+        num_outputs: int,
+        forgetting: float = 0.9999,
+        delta: float = 0.1,
+        tau_syn: float = TAU_SYN,
+        dt: float = DT,
+        update_every: int = 1,
+        max_p: Optional[float] = None,
+    ):
+        """
+        :param num_neurons:   Number of reservoir neurons
+        :param num_outputs:   Number of readout channels (anomaly classes)
+        :param forgetting:    Forgetting factor in (0, 1]. Past samples are
+                              weighted by `forgetting` ** (updates since then)
+        :param delta:         Regularization; P starts as identity / `delta`
+        :param tau_syn:       Synaptic time constant in s
+        :param dt:            Time step in s
+        :param update_every:  Adapt the weights only at every n-th time step
+        :param max_p:         Upper bound for the diagonal of P, against windup
+                              in unexcited directions. Default: 1 / `delta`
+        """
+        if not 0 < forgetting <= 1:
+            raise ValueError("OnlineReadout: `forgetting` must be in (0, 1].")
+        self.num_neurons = num_neurons
+        self.num_outputs = num_outputs
+        self.forgetting = forgetting
+        self.delta = delta
+        self.tau_syn = tau_syn
+        self.dt = dt
+        self.update_every = update_every
+        self.max_p = 1 / delta if max_p is None else max_p
+        # - Weights with the bias as last row, for features with a constant 1
+        self.weights = np.zeros((num_neurons + 1, num_outputs))
+        self.reset_learning()
+        self.reset_state()
+
+    @classmethod
+    def from_weights(
+        cls, weights: np.ndarray, bias: Union[float, np.ndarray] = 0.0, **kwargs
+    ) -> "OnlineReadout":
+        """
+        from_weights - Start from offline-trained weights, such as
+                       `network/readout_weights.npy` and `readout_bias.npy`.
+        """
+        weights = np.asarray(weights, dtype=float)
+        readout = cls(*weights.shape, **kwargs)
+        readout.weights[:-1] = weights
+        readout.weights[-1] = bias
+        return readout
+
+    def reset_learning(self):
+        """
+        reset_learning - Forget all correlation statistics (but keep the weights).
+        """
+        self.P = np.eye(self.num_neurons + 1) / self.delta
+        self.num_updates = 0
+
+    def reset_state(self):
+        """
+        reset_state - Set the synaptic currents to 0.
+        """
+        self.syn_state = np.zeros(self.num_neurons)
+        self.timestep = 0
+
+    def features(self, raster: np.ndarray) -> np.ndarray:
+        """
+        features - Filter spike counts with the exponential synapse, carrying
+                   the synaptic state across calls.
+        :param raster:  Spike counts [#time steps x #neurons]
+        :return:
+            Synaptic currents [#time steps x #neurons]
+        """
+        out, self.syn_state = exp_synapse(raster, self.tau_syn, self.dt, self.syn_state)
+        return out
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """
+        predict - Readout output for synaptic currents [#time steps x #neurons].
+        """
+        return features @ self.weights[:-1] + self.weights[-1]
+
+    def update(self, x: np.ndarray, y: np.ndarray):
+        """
+        update - One RLS step with feature vector `x` and target vector `y`.
+        """
+        x = np.append(x, 1.0)
+        p_x = self.P @ x
+        gain = p_x / (self.forgetting + x @ p_x)
+        error = y - x @ self.weights
+        self.weights += np.outer(gain, error)
+        self.P -= np.outer(gain, p_x)
+        self.P /= self.forgetting
+        # - Bound the windup of directions that get no input, keeping P symmetric
+        #   positive definite
+        diag = np.diag(self.P)
+        if diag.max() > self.max_p:
+            scale = np.sqrt(np.minimum(1, self.max_p / diag))
+            self.P *= np.outer(scale, scale)
+        self.num_updates += 1
+        if self.num_updates % 1000 == 0:
+            # - Counter loss of symmetry from rounding errors
+            self.P = 0.5 * (self.P + self.P.T)
+
+    def process(
+        self, raster: np.ndarray, target: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        process - Readout output for a chunk of spikes. If `target` is given,
+                  adapt the weights, each output being computed before the
+                  update at its time step (prequential evaluation).
+        :param raster:  Spike counts [#time steps x #neurons]
+        :param target:  Target [#time steps x #outputs], or `None` for inference only
+        :return:
+            Readout output [#time steps x #outputs]
+        """
+        features = self.features(raster)
+        if target is None:
+            self.timestep += len(raster)
+            return self.predict(features)
+        target = np.asarray(target, dtype=float)
+        output = np.empty((len(features), self.num_outputs))
+        # - Updated time steps, aligned with the global step count
+        first = (-self.timestep) % self.update_every
+        start = 0
+        for t in range(first, len(features), self.update_every):
+            # - Outputs up to the update with the current weights
+            output[start : t + 1] = self.predict(features[start : t + 1])
+            self.update(features[t], target[t])
+            start = t + 1
+        output[start:] = self.predict(features[start:])
+        self.timestep += len(features)
+        return output
+
+    def save(self, path: Union[str, Path]):
+        """
+        save - Store parameters and the full learning state as `.npz`.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            weights=self.weights,
+            P=self.P,
+            syn_state=self.syn_state,
+            num_updates=self.num_updates,
+            timestep=self.timestep,
+            forgetting=self.forgetting,
+            delta=self.delta,
+            tau_syn=self.tau_syn,
+            dt=self.dt,
+            update_every=self.update_every,
+            max_p=self.max_p,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "OnlineReadout":
+        """
+        load - Restore an `OnlineReadout` stored with `save`.
+        """
+        with np.load(path) as content:
+            weights = content["weights"]
+            readout = cls(
+                weights.shape[0] - 1,
+                weights.shape[1],
+                forgetting=float(content["forgetting"]),
+                delta=float(content["delta"]),
+                tau_syn=float(content["tau_syn"]),
+                dt=float(content["dt"]),
+                update_every=int(content["update_every"]),
+                max_p=float(content["max_p"]) if "max_p" in content else None,
+            )
+            readout.weights = weights.copy()
+            readout.P = content["P"].copy()
+            readout.syn_state = content["syn_state"].copy()
+            readout.num_updates = int(content["num_updates"])
+            readout.timestep = int(content["timestep"])
+        return readout
@@ -0,0 +1,283 @@
+# Pruning of silent and redundant reservoir neurons from the ECG readout.
+# Activity statistics are accumulated in one streaming pass over a training
+# run of the spike cache: spike counts, and the correlation matrix of the
+# synaptically filtered spikes together with its cross-correlation with the
+# targets. From these, neurons that (almost) never fire are dropped, then
+# neurons whose filtered activity is highly correlated with that of a more
+# active, already kept neuron. Because the ridge-regression readout only
+# depends on the same statistics, it is refitted for every pruning level
+# without another pass. A second pass over a test run scores all pruning
+# levels at once and reports accuracy against readout size.
+#
+# Usage (from the ECG_demo folder, with runs recorded by `SpikeCache.record`):
+#     python -m scripts.prune_readout spike_cache/<network hash> train test
+# or
+#     stats = activity_stats(cache, "train")
+#     report = pruning_report(stats, cache, "test")
+
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from scripts.online_readout import DT, TAU_SYN, exp_synapse
+from scripts.scoring import class_metrics, score_beats
+from scripts.spike_cache import CachedBatch, SpikeCache, target_raster
+
+CHUNK_STEPS = 10_000  # Time steps per chunk of filtered activity
+TARGET_MAP = {k: k for k in range(5)}  # Classes as in the notebook
+
+
+class ActivityStats(NamedTuple):
+    # Number of spikes of each neuron
+    spike_counts: np.ndarray
+    # Number of time steps
+    num_timesteps: int
+    # [features, 1]^T [features, 1], [#neurons + 1 x #neurons + 1]
+    xtx: np.ndarray
+    # [features, 1]^T targets, [#neurons + 1 x #classes]
+    xty: np.ndarray
+
+
+def feature_chunks(
+    cached: CachedBatch,
+    tau_syn: float = TAU_SYN,
+    dt: float = DT,
+    chunk_steps: int = CHUNK_STEPS,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    feature_chunks - Synaptically filtered spikes of a cached batch, in chunks
+                     so that the dense activity is never held as a whole.
+    :return:
+        Generator of (first time step, features [#time steps x #neurons])
+    """
+    num_timesteps = int(cached.annotations.idx_end_new.iloc[-1])
+    steps = np.minimum((cached.times / dt).astype(int), num_timesteps - 1)
+    order = np.argsort(steps, kind="stable")
+    steps = steps[order]
+    channels = cached.channels[order].astype(int)
+    state = None
+    for start in range(0, num_timesteps, chunk_steps):
+        stop = min(start + chunk_steps, num_timesteps)
+        first, last = np.searchsorted(steps, [start, stop])
+        flat = (steps[first:last] - start) * cached.num_channels + channels[first:last]
+        raster = np.bincount(flat, minlength=(stop - start) * cached.num_channels)
+        raster = raster.reshape(stop - start, cached.num_channels)
+        features, state = exp_synapse(raster, tau_syn, dt, state)
+        yield start, features
+
+
+def activity_stats(
+    cache: SpikeCache,
+    run: str,
+    map_target: Dict[int, int] = TARGET_MAP,
+    tau_syn: float = TAU_SYN,
+    dt: float = DT,
+    chunk_steps: int = CHUNK_STEPS,
+) -> ActivityStats:
+    """
+    activity_stats - Accumulate spike counts and regression statistics over a
+                     recorded run.
+    """
+    spike_counts = xtx = xty = None
+    num_timesteps = 0
+    for cached in cache.replay(run):
+        if spike_counts is None:
+            num_features = cached.num_channels + 1
+            num_classes = len(set(map_target.values())) - 1
+            spike_counts = np.zeros(cached.num_channels, int)
+            xtx = np.zeros((num_features, num_features))
+            xty = np.zeros((num_features, num_classes))
+        spike_counts += np.bincount(
+            cached.channels.astype(int), minlength=cached.num_channels
+        )
+        target = target_raster(cached, map_target).astype(float)
+        for start, features in feature_chunks(cached, tau_syn, dt, chunk_steps):
+            features = np.column_stack((features, np.ones(len(features))))
+            xtx += features.T @ features
+            xty += features.T @ target[start : start + len(features)]
+            num_timesteps += len(features)
+    if spike_counts is None:
+        raise ValueError(f"activity_stats: Run '{run}' has no batches.")
+    return ActivityStats(spike_counts, num_timesteps, xtx, xty)
+
+
+def correlation_matrix(stats: ActivityStats) -> np.ndarray:
+    """
+    correlation_matrix - Pearson correlation of the filtered activity of all
+                         neurons (NaN for neurons without activity).
+    """
+    num = stats.num_timesteps
+    means = stats.xtx[-1, :-1] / num
+    cov = stats.xtx[:-1, :-1] / num - np.outer(means, means)
+    std = np.sqrt(np.clip(np.diag(cov), 0, None))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return cov / np.outer(std, std)
+
+
+def prune_neurons(
+    stats: ActivityStats,
+    min_rate: float = 0.1,
+    max_corr: float = 0.95,
+    dt: float = DT,
+    corr: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    prune_neurons - Select the neurons to keep.
+    :param min_rate:  Neurons with a lower firing rate in Hz are silent
+    :param max_corr:  Neurons whose correlation with a more active kept neuron
+                      exceeds this are redundant. 1 keeps all active neurons.
+    :param corr:      Correlation matrix, if already computed
+    :return:
+        Sorted indices of kept neurons
+    """
+    rates = stats.spike_counts / (stats.num_timesteps * dt)
+    active = np.flatnonzero(rates >= min_rate)
+    if max_corr >= 1:
+        return active
+    corr = correlation_matrix(stats) if corr is None else corr
+    kept: List[int] = []
+    for idx in active[np.argsort(-rates[active], kind="stable")]:
+        if not kept or np.nanmax(np.abs(corr[idx, kept])) <= max_corr:
+            kept.append(idx)
+    return np.sort(np.array(kept, int))
+
+
+def fit_readout(
+    stats: ActivityStats, neurons: np.ndarray, regularize: float = 0.1
+) -> np.ndarray:
+    """
+    fit_readout - Ridge regression readout on a subset of neurons, from the
+                  accumulated statistics.
+    :return:
+        Weights [#neurons + 1 x #classes], with the bias as last row
+    """
+    idcs = np.r_[neurons, len(stats.xtx) - 1]
+    xtx = stats.xtx[np.ix_(idcs, idcs)]
+    # - The bias is not regularized
+    reg = np.full(len(idcs), regularize)
+    reg[-1] = 0
+    return np.linalg.solve(xtx + np.diag(reg), stats.xty[idcs])
+
+
+def _beat_annotations(cached: CachedBatch, map_target: Dict[int, int]):
+    # - Annotations for `score_beats`, with missing classes treated as normal
+    annotations = cached.annotations.copy()
+    annotations.loc[~annotations.target.isin(list(map_target)), "target"] = 0
+    return annotations
+
+
+def pruning_report(
+    stats: ActivityStats,
+    cache: SpikeCache,
+    test_run: str,
+    max_corrs: Sequence[float] = (1.0, 0.99, 0.95, 0.9, 0.8, 0.7),
+    min_rate: float = 0.1,
+    regularize: float = 0.1,
+    threshold: float = 0.5,
+    map_target: Dict[int, int] = TARGET_MAP,
+    tau_syn: float = TAU_SYN,
+    dt: float = DT,
+    chunk_steps: int = CHUNK_STEPS,
+) -> pd.DataFrame:
+    """
+    pruning_report - Readout size and test performance for several pruning
+                     levels, compared to the readout over all neurons.
+    :param stats:      Statistics of the training run from `activity_stats`
+    :param test_run:   Name of the recorded test run in `cache`
+    :param max_corrs:  Correlation thresholds to evaluate
+    :return:
+        DataFrame with one row per pruning level: `max_corr`, `num_neurons`,
+        `macs_per_step` and `weight_bytes` of the readout, `accuracy`,
+        `sensitivity` and `ppv` (means over anomaly classes)
+    """
+    corr = correlation_matrix(stats)
+    num_all = len(stats.spike_counts)
+    levels = [("all", np.arange(num_all))] + [
+        (c, prune_neurons(stats, min_rate, c, dt, corr)) for c in max_corrs
+    ]
+    weights = [fit_readout(stats, neurons, regularize) for _, neurons in levels]
+
+    num_classes = len(set(map_target.values()))
+    confusion = [np.zeros((num_classes, num_classes), int) for _ in levels]
+    labels: List[list] = [[] for _ in levels]
+    latency: List[list] = [[] for _ in levels]
+    for cached in cache.replay(test_run):
+        annotations = _beat_annotations(cached, map_target)
+        num_timesteps = int(annotations.idx_end_new.iloc[-1])
+        output = np.zeros((len(levels), num_timesteps, num_classes - 1))
+        for start, features in feature_chunks(cached, tau_syn, dt, chunk_steps):
+            for i_level, ((_, neurons), w) in enumerate(zip(levels, weights)):
+                output[i_level, start : start + len(features)] = (
+                    features[:, neurons] @ w[:-1] + w[-1]
+                )
+        for i_level in range(len(levels)):
+            result = score_beats(
+                output[i_level], annotations, map_target, threshold=threshold, dt=dt
+            )
+            confusion[i_level] += result.confusion
+            labels[i_level].append(result.beats.label.to_numpy())
+            latency[i_level].append(result.beats.latency.to_numpy())
+
+    rows = []
+    for i_level, (max_corr, neurons) in enumerate(levels):
+        metrics = class_metrics(
+            confusion[i_level],
+            np.concatenate(labels[i_level]),
+            np.concatenate(latency[i_level]),
+        )
+        rows.append(
+            {
+                "max_corr": max_corr,
+                "num_neurons": len(neurons),
+                "macs_per_step": len(neurons) * (num_classes - 1),
+                "weight_bytes": weights[i_level].nbytes,
+                "accuracy": np.trace(confusion[i_level]) / confusion[i_level].sum(),
+                "sensitivity": metrics.sensitivity.iloc[1:].mean(),
+                "ppv": metrics.ppv.iloc[1:].mean(),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Prune silent and redundant neurons from the ECG readout"
+    )
+    parser.add_argument("cache_dir", help="Spike cache folder of the network")
+    parser.add_argument("train_run", help="Recorded run to fit readouts on")
+    parser.add_argument("test_run", help="Recorded run to evaluate on")
+    parser.add_argument("--min-rate", type=float, default=0.1)
+    parser.add_argument("--regularize", type=float, default=0.1)
+    parser.add_argument(
+        "--max-corrs", type=float, nargs="*", default=[1.0, 0.99, 0.95, 0.9, 0.8, 0.7]
+    )
+    parser.add_argument("--save", help="Store neuron indices and weights of this level")
+    args = parser.parse_args()
+
+    cache = SpikeCache.open(args.cache_dir)
+    stats = activity_stats(cache, args.train_run)
+    rates = stats.spike_counts / (stats.num_timesteps * DT)
+    print(f"{np.sum(rates < args.min_rate)} of {len(rates)} neurons are silent")
+    report = pruning_report(
+        stats,
+        cache,
+        args.test_run,
+        max_corrs=args.max_corrs,
+        min_rate=args.min_rate,
+        regularize=args.regularize,
+    )
+    print(report.to_string(index=False))
+    if args.save is not None:
+        neurons = prune_neurons(stats, args.min_rate, float(args.save))
+        weights = fit_readout(stats, neurons, args.regularize)
+        path = Path(args.cache_dir) / f"pruned_readout_{args.save}.npz"
+        np.savez(path, neurons=neurons, weights=weights[:-1], bias=weights[-1])
+        print(f"Stored readout over {len(neurons)} neurons in {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 # uses data from https://physionet.org/physiobank/database/mitdb/
 
-from typing import Optional, Union, List, Iterable, Dict, Any, Set
+from typing import Optional, Union, List, Iterable, Dict, Any, Set, Tuple
+from contextlib import contextmanager
 from pathlib import Path
 import os
 import random
@@ -47,10 +48,11 @@ target_names = {
 }
 
 
-def load_from_file(load_path: Union[str, Path]):
+def load_from_file(load_path: Union[str, Path], mmap_mode: Optional[str] = None):
     """
     load_from_file - Load ecg signal and beat annotations from .npy and .csv files
     :param load_path:  Path to files.
+    :param mmap_mode:  If not `None`, memory-map the signal with this mode (e.g. "r")
     :return:
         DataFrame with annotations for each beat (each beat one row)
         2D-array with ecg signal from all recordings ([# time steps x # ecg channels])
@@ -67,7 +69,7 @@ def load_from_file(load_path: Union[str, Path]):
             "is_anomal": "bool",
         },
     )
-    rec_data = np.load(os.path.join(load_path, "recordings.npy"))
+    rec_data = np.load(os.path.join(load_path, "recordings.npy"), mmap_mode=mmap_mode)
     print(f"ECG signal and annotaitions have been loaded from {load_path}")
     return annotations, rec_data
 
@@ -114,8 +116,9 @@ class ECGRecordings:
             self.annotations = annotations
             self.ecg_data = ecg_data
 
-        # - Add column to annotations indicating which beats have already been used
-        self.annotations["is_used"] = False
+        # - Bitmap indicating which beats (by position in `annotations`) have
+        #   already been used. Exclude used beats with `exclude={"is_used": True}`.
+        self.used = np.zeros(len(self.annotations), bool)
 
     def provide_data(
         self,
@@ -129,6 +132,7 @@ class ECGRecordings:
         min_len_segment: int = 1,
         max_len_segment: int = 1,
         remain_unused: bool = False,
+        beat_mask: Optional[np.ndarray] = None,
         verbose: bool = False,
     ) -> (pd.DataFrame, np.ndarray):
         """
@@ -156,13 +160,15 @@ class ECGRecordings:
         :param min_len_segment:  Minimum segment length. Default: 1
         :param max_len_segment:  Maximum segment length. Default: 1 (must not be less than `min_len_segment`)
         :param remain_unused:    If `True` do not mark selected heartbeats as 'is_used'.
+        :param beat_mask:  If not `None`, boolean array with one entry per row of
+                           `self.annotations`. Only beats where it is `True` are drawn.
         :param verbose:  Print detailed output for some configurations
         :return:
             DataFrame with annotations of selected heartbeats
             2D-array with ECG signal for selected heartbeats (shape: #timestes x #channels (=2)).
         """
         # - Filter according to `include` and `exclude` keywords
-        annotations = self._filter_data(include, exclude)
+        annotations = self._filter_data(include, exclude, beat_mask)
 
         if num_beats is None:
             # - Skip process of drawing beats and arranging them in segments
@@ -250,7 +256,7 @@ class ECGRecordings:
 
         if not remain_unused:
             # - Mark selected beats as used
-            self.annotations.loc[selection.index, "is_used"] = True
+            self.used[self.annotations.index.get_indexer(selection.index)] = True
 
         return selection, signal
 
@@ -305,8 +311,168 @@ class ECGRecordings:
             boolean_raster=boolean_raster,
         )
 
+    def provide_splits(
+        self,
+        quotas: Dict[str, int],
+        seed: Optional[int] = None,
+        group_by: str = "recording",
+        block_size: int = 100,
+        **kwargs,
+    ) -> Dict[str, Tuple[pd.DataFrame, np.ndarray]]:
+        """
+        provide_splits - Draw several disjoint data sets, such as train,
+                         validation and test sets, in one call.
+        :param quotas:   Dict with number of beats for each split name
+        :param seed:     Seed that, together with `quotas`, determines all splits.
+                         If `None`, one seed is drawn for all splits of this call.
+        :param group_by:    Unit that is assigned to one split as a whole:
+                            "recording" (no patient is in two splits) or
+                            "block" (blocks of consecutive beats within each
+                            recording). Warning: with "block", beats of the
+                            same patient end up in several splits, so test
+                            results are not patient-independent.
+        :param block_size:  Number of beats per block if `group_by` is "block"
+        :param kwargs:   Further arguments for `provide_data`
+        :return:
+            Dict with (annotations, signal) for each split, as from `provide_data`
+        """
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1)[0])
+        return {
+            name: self.provide_split(name, quotas, seed, group_by, block_size, **kwargs)
+            for name in quotas
+        }
+
+    def provide_split(
+        self,
+        name: str,
+        quotas: Dict[str, int],
+        seed: Optional[int] = None,
+        group_by: str = "recording",
+        block_size: int = 100,
+        **kwargs,
+    ) -> Tuple[pd.DataFrame, np.ndarray]:
+        """
+        provide_split - Draw a single split of `provide_splits`. Each split is
+                        drawn from its own pool of beats, which depends only on
+                        `quotas`, `seed` and the filters, and with its own
+                        random state. Splits are therefore disjoint and the
+                        same when they are drawn in a different order, by
+                        other `ECGRecordings` objects or in parallel processes,
+                        as long as all use the same `seed`.
+        :param name:  Name of the split to draw, a key of `quotas`
+        :param seed:  Seed shared by all splits; required, since without it
+                      each call would draw different pools
+        For the other parameters see `provide_splits`.
+        """
+        if seed is None:
+            raise ValueError(
+                "ECGRecordings: `seed` is required for splits to be disjoint."
+            )
+        if name not in quotas:
+            raise ValueError(f"ECGRecordings: No quota for split '{name}'.")
+        names = list(quotas)
+        pools = self.split_pools(
+            [quotas[n] for n in names],
+            seed=seed,
+            include=kwargs.get("include", {}),
+            exclude=kwargs.get("exclude", {"is_used": True}),
+            group_by=group_by,
+            block_size=block_size,
+        )
+        i_split = names.index(name)
+        if kwargs.get("beat_mask") is not None:
+            pools[i_split] &= kwargs["beat_mask"]
+        seed_split = np.random.SeedSequence(seed).spawn(len(names))[i_split]
+        with seeded(int(seed_split.generate_state(1)[0])):
+            return self.provide_data(
+                quotas[name], **{**kwargs, "beat_mask": pools[i_split]}
+            )
+
+    def split_pools(
+        self,
+        quotas: List[int],
+        seed: Optional[int] = None,
+        include: Dict[str, Any] = {},
+        exclude: Dict[str, Any] = {"is_used": True},
+        group_by: str = "recording",
+        block_size: int = 100,
+    ) -> np.ndarray:
+        """
+        split_pools - Assign beats to disjoint pools with sizes proportional to
+                      `quotas`. Whole recordings or blocks of consecutive beats
+                      are assigned in random order. Usage is ignored, so that
+                      pools do not change as beats get used. Pools from
+                      different calls are only disjoint for the same `seed`.
+        :return:
+            2D-bool-array [#splits x #beats in `self.annotations`]
+        """
+        include = {k: v for k, v in include.items() if k != "is_used"}
+        exclude = {k: v for k, v in exclude.items() if k != "is_used"}
+        available = self._filter_mask(include, exclude)
+        if group_by == "recording":
+            units = self.annotations.recording.to_numpy(np.int64)
+        elif group_by == "block":
+            # - Block IDs restart with each recording
+            recording = self.annotations.recording.to_numpy()
+            new_rec = np.r_[True, recording[1:] != recording[:-1]]
+            first = np.maximum.accumulate(np.where(new_rec, np.arange(len(new_rec)), 0))
+            units = np.cumsum(
+                new_rec | ((np.arange(len(new_rec)) - first) % block_size == 0)
+            )
+        else:
+            raise ValueError(
+                "ECGRecordings: `group_by` must be 'recording' or 'block'."
+            )
+        unit_ids, unit_idcs = np.unique(units, return_inverse=True)
+        unit_sizes = np.bincount(unit_idcs[available], minlength=unit_ids.size)
+        # - Cut a random order of units at the cumulative quota fractions
+        order = np.random.default_rng(seed).permutation(unit_ids.size)
+        cum_sizes = np.cumsum(unit_sizes[order])
+        fractions = np.cumsum(quotas) / np.sum(quotas)
+        bounds = np.searchsorted(
+            cum_sizes, fractions[:-1] * cum_sizes[-1], side="right"
+        )
+        split_of_unit = np.empty(unit_ids.size, int)
+        split_of_unit[order] = np.searchsorted(
+            bounds, np.arange(unit_ids.size), "right"
+        )
+        split_of_beat = split_of_unit[unit_idcs]
+        return (split_of_beat == np.arange(len(quotas))[:, None]) & available
+
+    def reset_usage(self):
+        """
+        reset_usage - Mark all beats as unused.
+        """
+        self.used[:] = False
+
+    def _filter_mask(
+        self,
+        include: Dict[str, Any] = {},
+        exclude: Dict[str, Any] = {"is_used": True},
+        beat_mask: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        _filter_mask - Boolean array over `self.annotations`, `True` for beats
+                       that match the `include` argument and do not match the
+                       `exclude` argument. Category "is_used" refers to `self.used`.
+        """
+        mask = np.ones(len(self.annotations), bool) if beat_mask is None else beat_mask
+        for category, values in include.items():
+            mask = mask & self._category_mask(category, values)
+        for category, values in exclude.items():
+            mask = mask & ~self._category_mask(category, values)
+        return mask
+
+    def _category_mask(self, category: str, values: Any) -> np.ndarray:
+        column = self.used if category == "is_used" else self.annotations[category]
+        return np.isin(column, np.atleast_1d(values))
+
     def _filter_data(
-        self, include: Dict[str, Any] = {}, exclude: Dict[str, Any] = {"is_used": True}
+        self,
+        include: Dict[str, Any] = {},
+        exclude: Dict[str, Any] = {"is_used": True},
+        beat_mask: Optional[np.ndarray] = None,
     ) -> pd.DataFrame:
         """
         _filter_data - Return subset of annotations where beats are only included if
@@ -314,17 +480,29 @@ class ECGRecordings:
                        argument.
         :param include:  Dict of categories and allowed values.
         :param exclude:  Dict of categories and values for which beats are included.
+        :param beat_mask:  If not `None`, only consider beats where it is `True`.
         :return:
             DataFrame of annotations for beats that match filters.
         """
-        filtered_annot = self.annotations
-        # - Iterate over include categories
-        for category, values in include.items():
-            filtered_annot = filtered_annot.query(f"{category} == {values}")
-        # - Iterate over exclude categories
-        for category, values in exclude.items():
-            filtered_annot = filtered_annot.query(f"{category} != {values}")
-        return filtered_annot
+        return self.annotations[self._filter_mask(include, exclude, beat_mask)]
+
+
+@contextmanager
+def seeded(seed: Optional[int]):
+    """
+    seeded - Context in which the global random generators of `numpy` and
+             `random`, which are used for drawing beats, are seeded with
+             `seed`. Their previous states are restored afterwards.
+    """
+    state_np = np.random.get_state()
+    state_py = random.getstate()
+    np.random.seed(seed)
+    random.seed(seed)
+    try:
+        yield
+    finally:
+        np.random.set_state(state_np)
+        random.setstate(state_py)
 
 
 ### --- Utility functions for ECGRecordings class
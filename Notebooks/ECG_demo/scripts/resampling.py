@@ -0,0 +1,201 @@
+# Polyphase resampling of the ECG corpus from 360 Hz to the time step of the
+# reservoir. The whole (memory-mapped) signal is resampled once, chunk by
+# chunk, and cached as `.npy` file next to the original data, keyed by the
+# target rate. Later runs memory-map the cached file, so the simulation reads
+# samples on its own time grid and no input has to be interpolated.
+#
+# Usage:
+#     annotations, signal, dt = load_resampled(dt_target=0.001389)
+#     data_loader = ECGDataLoader(ECGRecordings(annotations, signal), dt=dt)
+#     net = software_network(dt=dt)
+# or, to only create the cache (from the ECG_demo folder):
+#     python -m scripts.resampling 0.001389
+
+from typing import Iterator, Optional, Tuple, Union
+from fractions import Fraction
+from pathlib import Path
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.signal import resample_poly
+
+from scripts import recordings
+
+CHUNK_SIZE = 1_000_000  # Input samples per chunk
+
+
+def resample_factors(
+    dt_target: float, dt_source: float = recordings.DT, max_denominator: int = 64
+) -> Tuple[int, int]:
+    """
+    resample_factors - Up- and downsampling factors for resampling from
+                       `dt_source` to (approximately) `dt_target`.
+    :param max_denominator:  Upper limit for both factors
+    :return:
+        up, down
+    """
+    ratio = Fraction(dt_source / dt_target).limit_denominator(max_denominator)
+    if ratio.numerator == 0 or ratio.numerator > max_denominator:
+        raise ValueError(
+            "resample_factors: No ratio of small integers for these time steps."
+        )
+    return ratio.numerator, ratio.denominator
+
+
+def _pad_length(up: int, down: int) -> int:
+    # - Input samples that influence an output sample, as multiple of `down`
+    #   (`resample_poly` uses a filter of half-length 10 * max(up, down) at the
+    #   upsampled rate)
+    half_len = int(np.ceil(10 * max(up, down) / up)) + 1
+    return int(np.ceil(half_len / down)) * down
+
+
+def resample_chunked(
+    data: np.ndarray,
+    up: int,
+    down: int,
+    out: Optional[np.ndarray] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> np.ndarray:
+    """
+    resample_chunked - Polyphase resampling along the first axis, chunk by
+                       chunk. Chunks are extended by the filter length on both
+                       sides, so the result is the same as that of
+                       `resample_poly` on the whole array, while memory use only
+                       depends on `chunk_size`.
+    :param data:        Array [#samples x ...], e.g. memory-mapped
+    :param up:          Upsampling factor
+    :param down:        Downsampling factor
+    :param out:         Array for the result, e.g. memory-mapped. Default: new array
+    :param chunk_size:  Input samples per chunk, rounded down to a multiple of `down`
+    :return:
+        Resampled array [ceil(#samples * up / down) x ...]
+    """
+    num_in = len(data)
+    num_out = int(np.ceil(num_in * up / down))
+    if out is None:
+        out = np.empty((num_out, *data.shape[1:]), dtype=float)
+    pad = _pad_length(up, down)
+    chunk_size = max(chunk_size // down, 1) * down
+    for start in range(0, num_in, chunk_size):
+        stop = min(start + chunk_size, num_in)
+        start_pad = max(start - pad, 0)
+        chunk = resample_poly(
+            data[start_pad : min(stop + pad, num_in)], up, down, axis=0
+        )
+        # - Offsets of `start` and `stop` in the resampled, padded chunk
+        first = (start - start_pad) * up // down
+        out_start = start * up // down
+        out_stop = num_out if stop == num_in else stop * up // down
+        out[out_start:out_stop] = chunk[first : first + out_stop - out_start]
+    return out
+
+
+def resample_annotations(annotations: pd.DataFrame, up: int, down: int) -> pd.DataFrame:
+    """
+    resample_annotations - Beat boundaries `idx_start` and `idx_end` on the
+                           resampled time grid.
+    """
+    annotations = annotations.copy()
+    for col in ("idx_start", "idx_end"):
+        annotations[col] = (
+            (annotations[col].to_numpy(np.int64) * up + down // 2) // down
+        ).astype(annotations[col].dtype)
+    return annotations
+
+
+def cache_path(
+    up: int, down: int, load_path: Union[str, Path], dt_source: float = recordings.DT
+) -> Path:
+    """
+    cache_path - File of the resampled signal, named by its sampling rate.
+    """
+    rate = up / (down * dt_source)
+    return Path(load_path) / f"recordings_{rate:g}Hz.npy"
+
+
+def resampled_signal(
+    dt_target: float,
+    load_path: Union[str, Path, None] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Tuple[np.ndarray, float]:
+    """
+    resampled_signal - Memory-mapped ECG signal at the rate closest to
+                       1 / `dt_target`, resampled and cached on first use.
+    :param dt_target:   Time step in s to resample to
+    :param load_path:   Folder with the ECG data and cache. Default: `recordings.ecg_dir`
+    :param chunk_size:  Input samples per chunk when creating the cache
+    :return:
+        Read-only memory-mapped signal, actual time step in s
+    """
+    if load_path is None:
+        load_path = recordings.ecg_dir
+    up, down = resample_factors(dt_target)
+    dt = recordings.DT * down / up
+    path = cache_path(up, down, load_path)
+    if not path.exists():
+        source = np.load(Path(load_path) / "recordings.npy", mmap_mode="r")
+        num_out = int(np.ceil(len(source) * up / down))
+        # - Write to a temporary file first so that interrupted runs leave no
+        #   cache, with one file per process so concurrent runs do not collide
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=source.dtype, shape=(num_out, *source.shape[1:])
+        )
+        resample_chunked(source, up, down, out=out, chunk_size=chunk_size)
+        out.flush()
+        del out
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode="r"), dt
+
+
+def load_resampled(
+    dt_target: float,
+    load_path: Union[str, Path, None] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Tuple[pd.DataFrame, np.ndarray, float]:
+    """
+    load_resampled - Annotations and signal on the time grid of `dt_target`,
+                     for `ECGRecordings(annotations, signal)`.
+    :return:
+        Annotations, read-only memory-mapped signal, actual time step in s
+    """
+    if load_path is None:
+        load_path = recordings.ecg_dir
+    signal, dt = resampled_signal(dt_target, load_path, chunk_size)
+    annotations, _ = recordings.load_from_file(load_path, mmap_mode="r")
+    up, down = resample_factors(dt_target)
+    return resample_annotations(annotations, up, down), signal, dt
+
+
+def stream(
+    signal: np.ndarray,
+    start: int = 0,
+    stop: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[np.ndarray]:
+    """
+    stream - Yield consecutive chunks of `signal` between `start` and `stop`,
+             e.g. of the memory-mapped cache, as in-memory arrays.
+    """
+    stop = len(signal) if stop is None else min(stop, len(signal))
+    for idx in range(start, stop, chunk_size):
+        yield np.array(signal[idx : min(idx + chunk_size, stop)])
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Resample the ECG corpus to a reservoir time step and cache it"
+    )
+    parser.add_argument("dt", type=float, help="Target time step in s")
+    parser.add_argument("--load-path", default=None)
+    args = parser.parse_args()
+    signal, dt = resampled_signal(args.dt, args.load_path)
+    print(f"Resampled signal: {signal.shape[0]} samples with dt={dt:.6g} s")
+
+
+if __name__ == "__main__":
+    main()
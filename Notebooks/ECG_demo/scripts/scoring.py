@@ -0,0 +1,197 @@
+# Beat-level scoring of ECG readout traces. The readout output is reduced to
+# one score per beat and class with `np.maximum.reduceat` (or `np.add.reduceat`)
+# over the beat boundaries `idx_start_new` / `idx_end_new` that
+# `ECGRecordings.provide_data` adds to the annotations. Confusion matrix,
+# sensitivity, positive predictive value and detection latency are then
+# computed with array operations only, so that full-corpus traces with
+# millions of samples are scored in seconds.
+#
+# Usage with the notebook's objects:
+#     result = score_beats(output, ecg_data.annotations, data_loader.remap_targets)
+#     result.per_class
+
+from typing import Dict, NamedTuple, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+DT = 0.002_778  # Time step of the readout trace, as in `dataloader`
+
+REDUCTIONS = {"max": np.maximum, "sum": np.add}
+
+
+class ScoringResult(NamedTuple):
+    # Per-beat annotations with columns `label`, `prediction`, `correct` and
+    # `latency` (in s, NaN if the true anomaly was not detected)
+    beats: pd.DataFrame
+    # Confusion matrix [true class x predicted class], class 0 is "normal"
+    confusion: np.ndarray
+    # Sensitivity, PPV, mean latency and support for each class
+    per_class: pd.DataFrame
+
+
+def reduce_beats(
+    output: np.ndarray,
+    idx_start: np.ndarray,
+    idx_end: np.ndarray,
+    reduce: str = "max",
+) -> np.ndarray:
+    """
+    reduce_beats - Reduce a trace to one value per beat and channel.
+    :param output:     2D-array [#time steps x #channels]
+    :param idx_start:  First time step of each beat
+    :param idx_end:    Time step after the last one of each beat
+    :param reduce:     "max" or "sum"
+    :return:
+        2D-array [#beats x #channels]. Empty beats are NaN.
+    """
+    ufunc = REDUCTIONS[reduce]
+    output = np.asarray(output)
+    idx_start = np.asarray(idx_start, dtype=np.int64)
+    idx_end = np.asarray(idx_end, dtype=np.int64)
+    if np.array_equal(idx_start[1:], idx_end[:-1]):
+        # - Contiguous beats, as from `provide_data`
+        bounds = idx_start
+        step = 1
+    else:
+        # - Interleaved boundaries; every second reduction is the gap between beats
+        bounds = np.column_stack((idx_start, idx_end)).ravel()
+        step = 2
+        # - The last reduction runs to the end of `output` anyway
+        if bounds[-1] == len(output):
+            bounds = bounds[:-1]
+    reduced = ufunc.reduceat(output, bounds, axis=0)[::step].astype(float)
+    if step == 1 and idx_end[-1] < len(output):
+        # - Last beat ends before the trace does
+        last = slice(idx_start[-1], idx_end[-1])
+        reduced[-1] = (
+            ufunc.reduce(output[last], axis=0) if idx_end[-1] > idx_start[-1] else 0
+        )
+    reduced[idx_end <= idx_start] = np.nan
+    return reduced
+
+
+def first_crossings(
+    trace: np.ndarray, threshold: float, idx_from: np.ndarray
+) -> np.ndarray:
+    """
+    first_crossings - First time step at or after each of `idx_from` at which a
+                      1D `trace` is above `threshold`.
+    :return:
+        Int-array like `idx_from`; `len(trace)` where there is no later crossing
+    """
+    above = np.flatnonzero(trace > threshold)
+    pos = np.searchsorted(above, idx_from)
+    return np.append(above, len(trace))[pos]
+
+
+def confusion_matrix(labels: np.ndarray, predictions: np.ndarray, num_classes: int):
+    """
+    confusion_matrix - Counts [true class x predicted class].
+    """
+    flat = np.asarray(labels) * num_classes + np.asarray(predictions)
+    return np.bincount(flat, minlength=num_classes**2).reshape(num_classes, num_classes)
+
+
+def class_metrics(
+    confusion: np.ndarray, labels: np.ndarray, latency: np.ndarray
+) -> pd.DataFrame:
+    """
+    class_metrics - Support, sensitivity, PPV and mean latency of each class.
+    :param confusion:  Confusion matrix [true class x predicted class]
+    :param labels:     True class of each beat
+    :param latency:    Detection latency of each beat, NaN if not detected
+    """
+    num_classes = len(confusion)
+    labels = np.asarray(labels)
+    latency = np.asarray(latency, dtype=float)
+    true_pos = np.diag(confusion)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sensitivity = true_pos / confusion.sum(axis=1)
+        ppv = true_pos / confusion.sum(axis=0)
+    # - Mean latency per class via bincount instead of a groupby
+    valid = ~np.isnan(latency)
+    lat_sum = np.bincount(labels[valid], latency[valid], minlength=num_classes)
+    lat_cnt = np.bincount(labels[valid], minlength=num_classes)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_latency = lat_sum / lat_cnt
+    return pd.DataFrame(
+        {
+            "support": confusion.sum(axis=1),
+            "sensitivity": sensitivity,
+            "ppv": ppv,
+            "mean_latency": mean_latency,
+        },
+        index=pd.RangeIndex(num_classes, name="class"),
+    )
+
+
+def score_beats(
+    output,
+    annotations: pd.DataFrame,
+    map_target: Optional[Dict[int, int]] = None,
+    threshold: Union[float, np.ndarray] = 0.5,
+    reduce: str = "max",
+    dt: float = DT,
+) -> ScoringResult:
+    """
+    score_beats - Per-beat decisions and metrics for a readout trace.
+                  A beat is classified as the anomaly whose readout channel
+                  has the largest score, if that score exceeds `threshold`,
+                  otherwise as normal (class 0).
+    :param output:       Readout trace, 2D-array [#time steps x #anomaly classes]
+                         or `TSContinuous`; channel i corresponds to class i + 1
+    :param annotations:  Annotations of the beats in `output`, with columns
+                         `target`, `idx_start_new` and `idx_end_new`
+    :param map_target:   Mapping from original to class IDs, such as
+                         `ECGDataLoader.remap_targets`. Default: identity
+    :param threshold:    Detection threshold, scalar or one per channel
+    :param reduce:       How scores are reduced over each beat: "max" or "sum"
+    :param dt:           Time step of `output`, for latencies
+    :return:
+        `ScoringResult`
+    """
+    samples = np.asarray(getattr(output, "samples", output))
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    num_classes = samples.shape[1] + 1
+    idx_start = annotations["idx_start_new"].to_numpy(np.int64)
+    idx_end = annotations["idx_end_new"].to_numpy(np.int64)
+    targets = annotations["target"].to_numpy()
+    if map_target is None:
+        labels = targets.astype(int)
+    else:
+        lookup = np.full(max(map_target) + 1, -1)
+        lookup[list(map_target.keys())] = list(map_target.values())
+        labels = lookup[targets]
+        if np.any(labels < 0):
+            raise ValueError("score_beats: Some targets are missing in `map_target`.")
+
+    # - Decisions
+    threshold = np.broadcast_to(np.asarray(threshold, dtype=float), num_classes - 1)
+    scores = reduce_beats(samples, idx_start, idx_end, reduce)
+    best = np.argmax(np.nan_to_num(scores - threshold, nan=-np.inf), axis=1)
+    detected = scores[np.arange(len(scores)), best] > threshold[best]
+    predictions = np.where(detected, best + 1, 0)
+    confusion = confusion_matrix(labels, predictions, num_classes)
+
+    # - Latency from beat onset to the first crossing of the true class' channel
+    latency = np.full(len(labels), np.nan)
+    for cls in range(1, num_classes):
+        beat_idcs = np.flatnonzero(labels == cls)
+        first = first_crossings(
+            samples[:, cls - 1], threshold[cls - 1], idx_start[beat_idcs]
+        )
+        in_beat = first < idx_end[beat_idcs]
+        latency[beat_idcs[in_beat]] = (
+            first[in_beat] - idx_start[beat_idcs[in_beat]]
+        ) * dt
+
+    beats = annotations.copy()
+    beats["label"] = labels
+    beats["prediction"] = predictions
+    beats["correct"] = labels == predictions
+    beats["latency"] = latency
+
+    per_class = class_metrics(confusion, labels, latency)
+    return ScoringResult(beats, confusion, per_class)
@@ -0,0 +1,307 @@
+# On-disk cache of reservoir spike output, so that readouts can be retrained
+# with other `regularize`, `tau_syn` or class sets without simulating the
+# reservoir again. The output of each batch is stored as compressed `.npz`
+# file with sparse spike times and channels plus the beat annotations of the
+# batch, including the beat boundaries within the batch as simulated (which
+# differ from the original ones for time-warped, augmented batches). Files live in a folder named after a hash of the encoder and
+# reservoir weights and parameters, and are named after a hash of the batch
+# input, so any change of network or data selection leads to new entries.
+# A run (a sequence of batches, e.g. one training set) can be recorded under a
+# name and replayed later without the data loader or the network.
+#
+# Usage:
+#     cache = SpikeCache("spike_cache", net)
+#     for batch in cache.record("train_15000", data_loader.get_batch_generator(15000, 1000)):
+#         ...
+#     readout = FFExpSyn(np.zeros((768, 4)), dt=DT_ECG, tau_syn=0.1)
+#     train_readout_from_cache(readout, cache, "train_15000", regularize=1.0)
+
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Union
+from pathlib import Path
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from scripts.recordings import generate_target
+
+# - Layer attributes that determine the spike output of encoder and reservoir
+ENCODER_ATTRS = ["weights", "dt", "thr_up", "thr_down", "multiplex_spikes"]
+RESERVOIR_ATTRS = [
+    "weights_in",
+    "weights_rec",
+    "dt",
+    "bias",
+    "tau_mem",
+    "tau_syn_exc",
+    "tau_syn_inh",
+    "v_thresh",
+    "v_reset",
+    "v_rest",
+    "refractory",
+]
+# - Annotation columns stored with each batch
+ANNOTATION_COLUMNS = ["idx_start", "idx_end", "target", "recording"]
+# - Beat boundaries in time steps from the start of the batch
+BOUNDARY_COLUMNS = ["idx_start_new", "idx_end_new"]
+
+
+class CachedBatch(NamedTuple):
+    # Spike times in s, relative to `t_start`
+    times: np.ndarray
+    # Channel of each spike
+    channels: np.ndarray
+    # Start time and duration of the batch in s
+    t_start: float
+    duration: float
+    # Number of reservoir neurons
+    num_channels: int
+    # Beat annotations of the batch, with original index. `idx_start_new` and
+    # `idx_end_new` are the boundaries in time steps from the batch start.
+    annotations: pd.DataFrame
+
+
+def _update_hash(hasher, value):
+    if isinstance(value, np.ndarray):
+        hasher.update(str((value.dtype, value.shape)).encode())
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    else:
+        hasher.update(repr(value).encode())
+
+
+def network_hash(net) -> str:
+    """
+    network_hash - Hash of the weights and parameters of `net.spike_encoder`
+                   and `net.reservoir`.
+    """
+    hasher = hashlib.sha1()
+    for layer, attrs in (
+        (net.spike_encoder, ENCODER_ATTRS),
+        (net.reservoir, RESERVOIR_ATTRS),
+    ):
+        for attr in attrs:
+            hasher.update(attr.encode())
+            _update_hash(hasher, getattr(layer, attr, None))
+    return hasher.hexdigest()[:16]
+
+
+def batch_hash(batch) -> str:
+    """
+    batch_hash - Hash of the input samples and start time of an `ECGBatch`.
+    """
+    hasher = hashlib.sha1()
+    _update_hash(hasher, np.asarray(batch.input.samples, dtype=np.float32))
+    _update_hash(hasher, float(batch.times[0]))
+    return hasher.hexdigest()[:16]
+
+
+class SpikeCache:
+    """
+    SpikeCache - Reservoir spike output of ECG batches, cached on disk per network.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], net):
+        """
+        :param cache_dir:  Base folder of the cache
+        :param net:        `Network` with layers `spike_encoder` and `reservoir`.
+                           Its weights and parameters select the cache folder.
+        """
+        self.net = net
+        self.dir = Path(cache_dir) / network_hash(net)
+        (self.dir / "runs").mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def open(cls, network_cache_dir: Union[str, Path]) -> "SpikeCache":
+        """
+        open - Access the cache folder of one network, e.g.
+               "spike_cache/<network hash>", for replay without the network.
+        """
+        cache = cls.__new__(cls)
+        cache.net = None
+        cache.dir = Path(network_cache_dir)
+        return cache
+
+    def _path(self, key: str) -> Path:
+        return self.dir / f"{key}.npz"
+
+    def reservoir_output(self, batch, key: Optional[str] = None) -> CachedBatch:
+        """
+        reservoir_output - Spike output for `batch`, simulated only if not cached.
+        :param key:  Hash of `batch`, if already known
+        """
+        path = self._path(batch_hash(batch) if key is None else key)
+        if path.exists():
+            return self.load(path)
+        # - The network time lags behind the batches if earlier ones were cached
+        t_net = self.net.t
+        output = self.net.evolve(batch.input.delay(t_net - batch.input.t_start))
+        output = output["reservoir"]
+        t_start = float(batch.times[0])
+        annotations = batch.annotations
+        # - Boundaries as simulated, e.g. after time warping
+        idx_offset = annotations.idx_start_new.iloc[0]
+        boundaries = {
+            col: (annotations[col] - idx_offset).to_numpy(np.int64)
+            for col in BOUNDARY_COLUMNS
+        }
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            times=(output.times - t_net).astype(np.float32),
+            channels=output.channels.astype(np.uint16),
+            t_start=t_start,
+            duration=batch.duration,
+            num_channels=output.num_channels,
+            index=annotations.index.to_numpy(),
+            **{col: annotations[col].to_numpy() for col in ANNOTATION_COLUMNS},
+            **boundaries,
+        )
+        os.replace(tmp_path, path)
+        return self.load(path)
+
+    @staticmethod
+    def load(path: Union[str, Path]) -> CachedBatch:
+        """
+        load - Read a cached batch.
+        """
+        with np.load(path) as content:
+            annotations = pd.DataFrame(
+                {col: content[col] for col in ANNOTATION_COLUMNS},
+                index=content["index"],
+            )
+            if all(col in content.files for col in BOUNDARY_COLUMNS):
+                for col in BOUNDARY_COLUMNS:
+                    annotations[col] = content[col]
+            else:
+                # - Files written before boundaries were stored; not augmented
+                sizes = (annotations.idx_end - annotations.idx_start).to_numpy()
+                annotations["idx_end_new"] = np.cumsum(sizes)
+                annotations["idx_start_new"] = annotations.idx_end_new - sizes
+            return CachedBatch(
+                times=content["times"],
+                channels=content["channels"],
+                t_start=float(content["t_start"]),
+                duration=float(content["duration"]),
+                num_channels=int(content["num_channels"]),
+                annotations=annotations,
+            )
+
+    def record(self, name: str, batches: Iterable) -> Iterator:
+        """
+        record - Pass through `batches`, making sure each one is cached, and
+                 store their order as run `name`. The network is reset at the end.
+        :return:
+            Generator of the batches, with the cached spikes as attribute
+            `reservoir_output`
+        """
+        keys = []
+        for batch in batches:
+            keys.append(batch_hash(batch))
+            batch.reservoir_output = self.reservoir_output(batch, keys[-1])
+            yield batch
+        self.net.reset_all()
+        with open(self.dir / "runs" / f"{name}.json", "w") as f:
+            json.dump(keys, f)
+
+    def replay(self, name: str) -> Iterator[CachedBatch]:
+        """
+        replay - Cached batches of run `name`, in their original order.
+        """
+        for key in self.run_keys(name):
+            yield self.load(self._path(key))
+
+    def run_keys(self, name: str) -> list:
+        """
+        run_keys - Batch hashes of run `name`, in their original order.
+        """
+        with open(self.dir / "runs" / f"{name}.json") as f:
+            return json.load(f)
+
+    def runs(self):
+        """
+        runs - Names of recorded runs.
+        """
+        return sorted(p.stem for p in (self.dir / "runs").glob("*.json"))
+
+
+def to_tsevent(cached: CachedBatch):
+    """
+    to_tsevent - Spike output of a cached batch as `TSEvent`.
+    """
+    from rockpool import TSEvent
+
+    return TSEvent(
+        cached.times.astype(float) + cached.t_start,
+        cached.channels,
+        t_start=cached.t_start,
+        t_stop=cached.t_start + cached.duration,
+        num_channels=cached.num_channels,
+    )
+
+
+def target_raster(cached: CachedBatch, map_target: Dict[int, int]) -> np.ndarray:
+    """
+    target_raster - Boolean target raster [#time steps x #anomaly classes] of a
+                    cached batch.
+    :param map_target:  Mapping of original targets to class IDs, such as
+                        `ECGDataLoader.remap_targets`. Beats of classes that
+                        are missing are treated as normal (class 0).
+    """
+    annotations = cached.annotations.copy()
+    annotations.loc[~annotations.target.isin(list(map_target)), "target"] = 0
+    # - Beats as simulated, so the target stays aligned with time-warped batches
+    annotations["idx_start"] = annotations.idx_start_new
+    annotations["idx_end"] = annotations.idx_end_new
+    return generate_target(annotations, map_target=map_target, boolean_raster=True)
+
+
+def target_series(cached: CachedBatch, map_target: Dict[int, int], dt: float):
+    """
+    target_series - Target raster of a cached batch (see `target_raster`) as
+                    `TSContinuous`.
+    :param dt:  Time step of the ECG signal
+    """
+    from rockpool import TSContinuous
+
+    target = target_raster(cached, map_target)
+    times = cached.t_start + np.arange(len(target)) * dt
+    return TSContinuous(times, target)
+
+
+def train_readout_from_cache(
+    readout,
+    cache: SpikeCache,
+    name: str,
+    map_target: Optional[Dict[int, int]] = None,
+    regularize: float = 0.1,
+    dt: Optional[float] = None,
+):
+    """
+    train_readout_from_cache - Train a readout with ridge regression on a
+                               recorded run, without simulating the reservoir.
+    :param readout:     Readout layer, e.g. `FFExpSyn` with any `tau_syn`.
+                        Its number of outputs must match `map_target`.
+    :param cache:       `SpikeCache` with the recorded run
+    :param name:        Name of the run
+    :param map_target:  Class mapping. Default: targets 0 to 4 as in the notebook
+    :param regularize:  Regularization parameter of `train_rr`
+    :param dt:          Time step of the ECG signal. Default: `readout.dt`
+    :return:
+        `readout`, trained
+    """
+    if map_target is None:
+        map_target = {k: k for k in range(5)}
+    dt = readout.dt if dt is None else dt
+    num_batches = len(cache.run_keys(name))
+    for i_batch, cached in enumerate(cache.replay(name)):
+        readout.train_rr(
+            target_series(cached, map_target, dt),
+            to_tsevent(cached),
+            is_first=i_batch == 0,
+            is_last=i_batch == num_batches - 1,
+            regularize=regularize,
+        )
+    readout.reset_all()
+    return readout
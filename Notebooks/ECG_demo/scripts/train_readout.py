@@ -0,0 +1,204 @@
+# Readout training of the software ECG network with checkpoints, so that long
+# runs survive crashes and kernel restarts. A checkpoint holds
+#     - the random states and usage bitmap from before the beats were drawn,
+#       so that a resumed run draws exactly the same beats
+#     - the batch cursor, i.e. the number of batches already trained on
+#     - the state of the readout layer, including the regression statistics
+#       that `train_rr` accumulates over batches
+# It is written atomically every `checkpoint_every` batches. Calling
+# `train_readout` again with the same checkpoint path resumes after the last
+# saved batch. The state of the reservoir is not stored: the first batch after
+# resuming starts from a fresh network, so the result is close to, but not
+# bit-identical with, that of an uninterrupted run.
+#
+# Usage (from the ECG_demo folder):
+#     python -m scripts.train_readout checkpoints/readout.pkl --beats 15000
+# or
+#     net = software_network()
+#     train_readout(net, ECGDataLoader(), "checkpoints/readout.pkl", num_beats=15000)
+
+from typing import Callable, Optional, Union
+from pathlib import Path
+import os
+import pickle
+import random
+import time
+
+import numpy as np
+
+from scripts.dataloader import ECGDataLoader
+
+
+def save_checkpoint(state: dict, path: Union[str, Path]):
+    """
+    save_checkpoint - Pickle `state` to `path` via a temporary file, so that an
+                      interruption never leaves a corrupt checkpoint.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: Union[str, Path]) -> Optional[dict]:
+    """
+    load_checkpoint - Checkpoint at `path`, or `None` if there is none.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _describe(augment: Callable) -> dict:
+    # - Type and parameters of an augmentation; an unseeded `ECGAugmentation`
+    #   draws its seed on creation, so it never matches a previous run
+    return {"type": type(augment).__name__, **vars(augment)}
+
+
+def _aligned(ts, t_start: float):
+    # - Time series shifted to start at `t_start`, e.g. the time of a fresh
+    #   network after resuming
+    return ts.delay(t_start - ts.t_start)
+
+
+def train_readout(
+    net,
+    data_loader: ECGDataLoader,
+    checkpoint_path: Union[str, Path],
+    num_beats: int = 15000,
+    batchsize: int = 1000,
+    regularize: float = 0.1,
+    checkpoint_every: int = 1,
+    augment: Optional[Callable] = None,
+    repeat: int = 1,
+    seed: Optional[int] = None,
+):
+    """
+    train_readout - Train `net.readout` with ridge regression on batches of
+                    ECG data, as in the notebook, with checkpoints.
+    :param net:               `Network` with layers `reservoir` and `readout`
+    :param data_loader:       `ECGDataLoader` to draw the beats from
+    :param checkpoint_path:   File for the checkpoint. If it exists, training
+                              resumes from it.
+    :param num_beats:         Number of training beats
+    :param batchsize:         Number of beats per batch
+    :param regularize:        Regularization parameter of `train_rr`
+    :param checkpoint_every:  Number of batches between checkpoints
+    :param augment:           Augmentation for `get_batch_generator`. Its
+                              parameters, including the seed, must match when
+                              resuming, so use a seeded `ECGAugmentation`.
+    :param repeat:            Number of passes for `get_batch_generator`
+    :param seed:              Seed for drawing the beats; must match when resuming
+    :return:
+        Trained readout layer. The reservoir state is not restored on resuming,
+        so the first batch after a resume starts from a fresh network.
+    """
+    config = dict(
+        num_beats=num_beats,
+        batchsize=batchsize,
+        regularize=regularize,
+        repeat=repeat,
+        seed=seed,
+        # - Parameters and seed of the augmentation, so that a resumed run
+        #   augments the same way
+        augment=None if augment is None else _describe(augment),
+    )
+    ecg_recordings = data_loader.ecg_recordings
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        np.random.seed(seed)
+        random.seed(seed)
+        checkpoint = {
+            "config": config,
+            "state_np": np.random.get_state(),
+            "state_py": random.getstate(),
+            "used": ecg_recordings.used.copy(),
+            "cursor": 0,
+            "readout": None,
+            "finished": False,
+        }
+    elif checkpoint["config"] != config:
+        changed = [k for k in config if checkpoint["config"].get(k) != config[k]]
+        raise ValueError(
+            f"train_readout: Checkpoint was made with different settings of {changed}: "
+            + f"{checkpoint['config']}."
+        )
+    else:
+        print(f"Resuming after batch {checkpoint['cursor']}")
+        net.readout.__dict__.update(checkpoint["readout"])
+        if checkpoint["finished"]:
+            return net.readout
+
+    # - Restore the state from before the beats were drawn, so they are drawn again
+    np.random.set_state(checkpoint["state_np"])
+    random.setstate(checkpoint["state_py"])
+    ecg_recordings.used[:] = checkpoint["used"]
+
+    cursor = checkpoint["cursor"]
+    batch_gen = data_loader.get_batch_generator(
+        num_beats, batchsize, augment=augment, repeat=repeat
+    )
+    t_start = time.time()
+    for i_batch, batch in enumerate(batch_gen):
+        if i_batch < cursor:
+            continue
+        output = net.evolve(_aligned(batch.input, net.t))
+        res_data = output["reservoir"]
+        net.readout.train_rr(
+            _aligned(batch.target, res_data.t_start),
+            res_data,
+            is_first=i_batch == 0,
+            is_last=batch.is_last,
+            regularize=regularize,
+        )
+        checkpoint["cursor"] = i_batch + 1
+        if batch.is_last or checkpoint["cursor"] % checkpoint_every == 0:
+            checkpoint["readout"] = dict(net.readout.__dict__)
+            checkpoint["finished"] = batch.is_last
+            save_checkpoint(checkpoint, checkpoint_path)
+    net.reset_all()
+    print(f"Trained readout in {time.time() - t_start:.2f} seconds.")
+    return net.readout
+
+
+def main():
+    import argparse
+
+    from scripts.network import network_dir, software_network
+
+    parser = argparse.ArgumentParser(
+        description="Train the ECG readout with checkpoints"
+    )
+    parser.add_argument("checkpoint", help="Checkpoint file, resumed if it exists")
+    parser.add_argument("--beats", type=int, default=15000)
+    parser.add_argument("--batchsize", type=int, default=1000)
+    parser.add_argument("--regularize", type=float, default=0.1)
+    parser.add_argument("--checkpoint-every", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--save", action="store_true", help="Store weights in the network folder"
+    )
+    args = parser.parse_args()
+
+    net = software_network()
+    readout = train_readout(
+        net,
+        ECGDataLoader(),
+        args.checkpoint,
+        num_beats=args.beats,
+        batchsize=args.batchsize,
+        regularize=args.regularize,
+        checkpoint_every=args.checkpoint_every,
+        seed=args.seed,
+    )
+    if args.save:
+        np.save(network_dir / "readout_weights.npy", readout.weights)
+        np.save(network_dir / "readout_bias.npy", readout.bias)
+
+
+if __name__ == "__main__":
+    main()